@@ -6,13 +6,11 @@ from dotenv import load_dotenv
 from flask_cors import CORS
 from app.annotation_graph.schema_handler import SchemaHandler
 from app.llm_handle.llm_models import get_llm_model
-from app.storage.qdrant import Qdrant
 from app.main import AiAssistance
-from app.rag.rag import RAG
+from app.rag.warm_start import warm_start
 from .routes import main_bp
 import os
 import yaml
-import json
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -85,24 +83,14 @@ def create_app():
     app.config['ai_assistant'] = ai_assistant
     logger.info('App config populated with models and assistants')
 
-    # intialize qdrant connection
+    # intialize vector store connection
     # uploading data first time
     try:
-        client = Qdrant()
-
-        collections = client.client.get_collections()
-        if collections and collections.collections:
-            logger.info("collections on the qdrant database already exist skipping population data")
-        else:
-            logger.info('uploading sample web data to qdrant db')
-            with open('sample_data.json') as data:
-                data = json.load(data)
-            rag = RAG(client,advanced_llm)
-            rag.save_doc_to_rag(data=data)
+        warm_start(ai_assistant.client, advanced_llm)
     except:
         import traceback
         traceback.print_exc()
-        logger.warning("Qdrant Connection Failed!!! If you are running locally Please connect qdrant database by running docker run -d -p 6333:6333 -v qdrant_data:/qdrant/storage qdrant/qdrant")
+        logger.warning("Qdrant Connection Failed!!! If you are running locally Please connect qdrant database by running docker run -d -p 6333:6333 -v qdrant_data:/qdrant/storage qdrant/qdrant or set VECTOR_STORE=local")
 
     # Register routes
     app.register_blueprint(main_bp)
@@ -4,11 +4,17 @@ import logging
 from flask import current_app
 import requests
 import os
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from app.annotation_graph.neo4j_handler import Neo4jConnection
 from app.annotation_graph.schema_handler import SchemaHandler
+from app.annotation_graph.question_cache import QuestionCache, QUESTION_CACHE
+from app.annotation_graph.schema_slicer import SchemaSlicer, SCHEMA_SLICING
 from app.llm_handle.llm_models import LLMInterface
-from app.prompts.annotation_prompts import EXTRACT_RELEVANT_INFORMATION_PROMPT, JSON_CONVERSION_PROMPT, SELECT_PROPERTY_VALUE_PROMPT
+from app.lib.annotation_client import annotation_client
+from app.prompts.annotation_prompts import (
+    EXTRACT_RELEVANT_INFORMATION_PROMPT, JSON_CONVERSION_PROMPT, SELECT_PROPERTY_VALUE_PROMPT, STRUCTURED_ANNOTATION_PROMPT,
+)
 from .dfs_handler import *
 
 
@@ -17,6 +23,16 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+# number of property values grounded in parallel (neo4j lookup + LLM selection), 1 grounds them one by one
+GROUNDING_MAX_WORKERS = int(os.getenv("GROUNDING_MAX_WORKERS", 8))
+# "two_step" extracts the relevant information then converts it to the annotation JSON (two LLM calls),
+# "structured" produces the annotation JSON in one structured output call
+ANNOTATION_PIPELINE_MODE = os.getenv("ANNOTATION_PIPELINE_MODE", "two_step")
+# a fuzzy candidate is accepted without the LLM when its similarity is at least RESOLVER_MIN_SIMILARITY
+# and ahead of the second best candidate by RESOLVER_MARGIN
+RESOLVER_MIN_SIMILARITY = float(os.getenv("RESOLVER_MIN_SIMILARITY", 0.85))
+RESOLVER_MARGIN = float(os.getenv("RESOLVER_MARGIN", 0.15))
+
 class Graph:
     def __init__(self, llm: LLMInterface, schema_handler:SchemaHandler) -> None:
         self.llm = llm
@@ -26,6 +42,15 @@ class Graph:
                                     username=os.getenv('NEO4J_USERNAME'), 
                                     password=os.getenv('NEO4J_PASSWORD'))
         self.kg_service_url = os.getenv('ANNOTATION_SERVICE_URL')
+        self.annotation_client = annotation_client
+        self.pipeline_mode = ANNOTATION_PIPELINE_MODE
+        self._annotation_schema = None
+        self.schema_slicer = None
+        if SCHEMA_SLICING == "on" and getattr(schema_handler, "schema_graph", None) is not None:
+            self.schema_slicer = SchemaSlicer(self.enhanced_schema, schema_handler.schema_graph)
+        self.question_cache = None
+        if QUESTION_CACHE == "on" and getattr(schema_handler, "schema_hash", None):
+            self.question_cache = QuestionCache(schema_handler.schema_hash)
 
     def query_knowledge_graph(self, json_query, token):
         """
@@ -51,8 +76,8 @@ class Graph:
         
         try:
             logger.debug(f"Sending request to {self.kg_service_url} with payload: {payload}")
-            response = requests.post(
-                self.kg_service_url+'/query',
+            response = self.annotation_client.post(
+                '/query',
                 json=payload,
                 params=params,
                 headers={"Authorization": f"Bearer {token}"}
@@ -71,22 +96,26 @@ class Graph:
         try:
             logger.info(f"Starting annotation query processing for question: '{query}'")
 
-            # Extract relevant information
-            relevant_information = self._extract_relevant_information(query)
-            
-            # Convert to initial JSON
-            initial_json = self._convert_to_annotation_json(relevant_information, query)
-            
-            # Validate and update
-            validation = self._validate_and_update(initial_json)
-            
-            # If validation failed, return the intermediate steps
-            if validation["validation_report"]["validation_status"] == "failed":
-                logger.error("Validation failed for the constructed json query")
-                return {"text": f"Unable to generate graph from the query: {query}"}
-            
-            # Use the updated JSON for subsequent steps
-            validated_json = validation["updated_json"]
+            # Reuse the validated JSON of an already answered question
+            validated_json = self._cached_annotation_json(query)
+
+            if validated_json is None:
+                # Build the initial annotation JSON
+                initial_json = self.build_annotation_json(query)
+
+                # Validate and update
+                validation = self._validate_and_update(initial_json)
+
+                # If validation failed, return the intermediate steps
+                if validation["validation_report"]["validation_status"] == "failed":
+                    logger.error("Validation failed for the constructed json query")
+                    return {"text": f"Unable to generate graph from the query: {query}"}
+
+                # Use the updated JSON for subsequent steps
+                validated_json = validation["updated_json"]
+                if self.question_cache is not None:
+                    self.question_cache.put(query, validated_json, validation["validation_report"])
+
             validated_json["question"] = query
             # Query knowledge graph with validated JSON
             graph = self.query_knowledge_graph(validated_json, token)
@@ -105,10 +134,72 @@ class Graph:
             logger.error(f"An error occurred during graph generation: {e}")
             return {"text": f"Unable to generate graph from the query: {query}"}
 
-    def _extract_relevant_information(self, query):
+    def _cached_annotation_json(self, query):
+        """
+        :return: The validated annotation JSON of the question from the question cache, or None.
+            A JSON filled from a question template is grounded again before it is used.
+        """
+        if self.question_cache is None:
+            return None
+        cached_json, exact = self.question_cache.get(query)
+        if cached_json is None or exact:
+            if exact:
+                logger.info("Annotation JSON served from the question cache")
+            return cached_json
+
+        validation = self._validate_and_update(cached_json)
+        if validation["validation_report"]["validation_status"] == "failed":
+            logger.info("Question template did not validate, building the annotation JSON")
+            return None
+        logger.info("Annotation JSON built from a question template")
+        validated_json = validation["updated_json"]
+        self.question_cache.put(query, validated_json, validation["validation_report"])
+        return validated_json
+
+    def build_annotation_json(self, query, mode=None):
+        """
+        Builds the annotation query JSON of a question with the configured pipeline.
+
+        :param mode: overrides ANNOTATION_PIPELINE_MODE ("two_step" or "structured").
+        """
+        mode = mode or self.pipeline_mode
+        schema = self.schema_for(query)
+        if mode == "structured":
+            return self._generate_structured_annotation_json(query, schema)
+        if mode == "two_step":
+            # Extract relevant information
+            relevant_information = self._extract_relevant_information(query, schema)
+            # Convert to initial JSON
+            return self._convert_to_annotation_json(relevant_information, query, schema)
+        raise ValueError(f"Invalid annotation pipeline mode: {mode}")
+
+    def schema_for(self, query):
+        """The schema put in the annotation prompts: the slice relevant to the question, or the full schema."""
+        if self.schema_slicer is None:
+            return self.enhanced_schema
+        try:
+            return self.schema_slicer.slice(query)
+        except Exception as e:
+            logger.error(f"Schema slicing failed, using the full schema: {e}")
+            return self.enhanced_schema
+
+    def _generate_structured_annotation_json(self, query, schema=None):
+        try:
+            logger.info("Generating annotation JSON with a single structured output call.")
+            if self._annotation_schema is None:
+                self._annotation_schema = self.schema_handler.annotation_json_schema()
+            prompt = STRUCTURED_ANNOTATION_PROMPT.format(query=query, schema=schema or self.enhanced_schema)
+            json_data = self.llm.generate_structured(prompt, self._annotation_schema, name="annotation_query")
+            logger.info(f"Generated JSON:\n{json.dumps(json_data, indent=2)}")
+            return json_data
+        except Exception as e:
+            logger.error(f"Failed to generate the annotation JSON: {e}")
+            raise
+
+    def _extract_relevant_information(self, query, schema=None):
         try:
             logger.info("Extracting relevant information from the query.")
-            prompt = EXTRACT_RELEVANT_INFORMATION_PROMPT.format(schema=self.enhanced_schema, query=query)
+            prompt = EXTRACT_RELEVANT_INFORMATION_PROMPT.format(schema=schema or self.enhanced_schema, query=query)
             extracted_info =  self.llm.generate(prompt)
             logger.info(f"Extracted data: \n{extracted_info}")
             return extracted_info
@@ -116,10 +207,10 @@ class Graph:
             logger.error(f"Failed to extract relevant information: {e}")
             raise
 
-    def _convert_to_annotation_json(self, relevant_information, query):
+    def _convert_to_annotation_json(self, relevant_information, query, schema=None):
         try:
             logger.info("Converting relevant information to annotation JSON format.")
-            prompt = JSON_CONVERSION_PROMPT.format(query=query, extracted_information=relevant_information, schema=self.enhanced_schema)
+            prompt = JSON_CONVERSION_PROMPT.format(query=query, extracted_information=relevant_information, schema=schema or self.enhanced_schema)
             json_data = self.llm.generate(prompt)
             logger.info(f"Converted JSON:\n{json.dumps(json_data, indent=2)}")
             return json_data
@@ -135,6 +226,8 @@ class Graph:
                 "property_changes": [],
                 "direction_changes": [],
                 "removed_properties": [],
+                "property_errors": [],
+                "property_resolutions": [],
                 "validation_status": "success"
             }
             
@@ -145,6 +238,7 @@ class Graph:
             if "nodes" not in updated_json:
                 raise ValueError("The input JSON must contain a 'nodes' key.")
                 
+            grounding_tasks = []
             for node in updated_json.get("nodes"):
                 node_type = node.get('type')
                 properties = node.get('properties', {})
@@ -164,48 +258,50 @@ class Graph:
                             "original_value": property_value
                         })
                     elif isinstance(property_value, str):
-                        similar_values = self.neo4j.get_similar_property_values(
-                            node_type, property_key, property_value
-                        )
-                        
-                        if similar_values:
-                            selected_property = self._select_best_matching_property_value(
-                                property_value, similar_values
-                            )
-                            
-                            if selected_property.get("selected_value"):
-                                new_value = selected_property.get("selected_value")
-                                if new_value != property_value:
-                                    validation_report["property_changes"].append({
-                                        "node_type": node_type,
-                                        "node_id": node_id,
-                                        "property": property_key,
-                                        "original_value": property_value,
-                                        "new_value": new_value,
-                                        "similar_values": similar_values
-                                    })
-                                properties[property_key] = new_value
-                            else:
-                                raise ValueError(
-                                    f"No suitable property found for {node_type} with key {property_key} "
-                                    f"and value {property_value}."
-                                )
-                        else:
-                            raise ValueError(
-                                f"No suitable property found for {node_type} with key {property_key} "
-                                f"and value {property_value}."
-                            )
+                        grounding_tasks.append((node, property_key, property_value))
+
+            # Ground the string property values against the graph, concurrently when GROUNDING_MAX_WORKERS > 1
+            grounded = self._ground_properties(grounding_tasks)
+            for (node, property_key, property_value), (new_value, similar_values, path, error) in zip(grounding_tasks, grounded):
+                if error is not None:
+                    validation_report["property_errors"].append({
+                        "node_type": node.get('type'),
+                        "node_id": node.get('node_id'),
+                        "property": property_key,
+                        "original_value": property_value,
+                        "error": error
+                    })
+                    continue
+                validation_report["property_resolutions"].append({
+                    "node_type": node.get('type'),
+                    "node_id": node.get('node_id'),
+                    "property": property_key,
+                    "original_value": property_value,
+                    "new_value": new_value,
+                    "path": path
+                })
+                if new_value != property_value:
+                    validation_report["property_changes"].append({
+                        "node_type": node.get('type'),
+                        "node_id": node.get('node_id'),
+                        "property": property_key,
+                        "original_value": property_value,
+                        "new_value": new_value,
+                        "similar_values": similar_values
+                    })
+                node['properties'][property_key] = new_value
+
+            if validation_report["property_errors"]:
+                raise ValueError("; ".join(error["error"] for error in validation_report["property_errors"]))
             
             # Validate edge direction
             for edge in updated_json.get("predicates", []):
                 s = node_types.get(edge['source'])
                 t = node_types.get(edge['target'])
                 rel = edge['type']
-                conn = f'{s}-{rel}-{t}'
                 
-                if conn not in self.schema_handler.processed_schema:
-                    rev = f'{t}-{rel}-{s}'
-                    if rev not in self.schema_handler.processed_schema:
+                if (s, rel, t) not in self.schema_handler.triples:
+                    if (s, rel, t) not in self.schema_handler.reversed_triples:
                         raise ValueError(
                             f"Invalid source {s} and target {t} for predicate {rel}"
                         )
@@ -236,6 +332,84 @@ class Graph:
                 "validation_report": validation_report
             }
 
+    def _resolve_property_value(self, node_type, property_key, property_value, similar_values):
+        """
+        Picks the graph value of a property without the LLM when the choice is unambiguous.
+
+        :return: A tuple of the value and the resolution path ("exact", "case_insensitive",
+                 "synonym" or "margin"), or (None, None) when the LLM has to choose.
+        """
+        candidates = [value for value, _ in similar_values]
+        if property_value in candidates:
+            return property_value, "exact"
+
+        lowered = property_value.lower()
+        case_matches = [value for value in candidates if isinstance(value, str) and value.lower() == lowered]
+        if len(case_matches) == 1:
+            return case_matches[0], "case_insensitive"
+
+        node_properties = self.schema_handler.processed_schema.get(node_type, {}).get('properties') or {}
+        if 'synonyms' in node_properties:
+            synonym_matches = self.neo4j.get_values_for_synonym(node_type, property_key, property_value)
+            if len(synonym_matches) == 1:
+                return synonym_matches[0], "synonym"
+
+        if similar_values and not case_matches:
+            top_similarity = similar_values[0][1]
+            runner_up = similar_values[1][1] if len(similar_values) > 1 else 0
+            if top_similarity >= RESOLVER_MIN_SIMILARITY and top_similarity - runner_up >= RESOLVER_MARGIN:
+                return similar_values[0][0], "margin"
+        return None, None
+
+    def _ground_property(self, node_type, property_key, property_value):
+        """
+        Finds the value stored in the graph for a property value of the query, the LLM
+        selector is only asked when the deterministic resolver cannot decide.
+
+        :return: A tuple of the grounded value, the similar values it was selected from and the resolution path.
+        :raises ValueError: when no suitable value exists.
+        """
+        similar_values = self.neo4j.get_similar_property_values(
+            node_type, property_key, property_value
+        )
+        resolved_value, path = self._resolve_property_value(node_type, property_key, property_value, similar_values)
+        if resolved_value is not None:
+            logger.info(f"Resolved {node_type}.{property_key}={property_value} to {resolved_value} ({path})")
+            return resolved_value, similar_values, path
+
+        if similar_values:
+            selected_property = self._select_best_matching_property_value(
+                property_value, similar_values
+            )
+            if selected_property.get("selected_value"):
+                return selected_property.get("selected_value"), similar_values, "llm"
+
+        raise ValueError(
+            f"No suitable property found for {node_type} with key {property_key} "
+            f"and value {property_value}."
+        )
+
+    def _ground_properties(self, grounding_tasks):
+        """
+        Grounds (node, property_key, property_value) tasks, in parallel with at most
+        GROUNDING_MAX_WORKERS threads.
+
+        :return: One (new_value, similar_values, path, error) tuple per task in the same order,
+                 error is None when the property was grounded.
+        """
+        def ground(task):
+            node, property_key, property_value = task
+            try:
+                return (*self._ground_property(node.get('type'), property_key, property_value), None)
+            except Exception as e:
+                logger.error(f"Grounding {node.get('type')}.{property_key}={property_value} failed: {e}")
+                return None, None, None, str(e)
+
+        if GROUNDING_MAX_WORKERS <= 1 or len(grounding_tasks) <= 1:
+            return [ground(task) for task in grounding_tasks]
+        with ThreadPoolExecutor(max_workers=min(GROUNDING_MAX_WORKERS, len(grounding_tasks))) as executor:
+            return list(executor.map(ground, grounding_tasks))
+
     def _select_best_matching_property_value(self, user_input_value, possible_values):
         try:
             prompt = SELECT_PROPERTY_VALUE_PROMPT.format(search_query = user_input_value, possible_values=possible_values)
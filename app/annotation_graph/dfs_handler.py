@@ -1,14 +1,29 @@
 from config.dfs_json_format import schema, nodes_template,predicates_template
 from app.prompts.dfs_prompt import *
+from app.annotation_graph.schema_paths import SchemaPathIndex, explain
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 class DFSHandler:
 
-    def __init__(self,llm,schema) -> None:
+    def __init__(self,llm,schema,schema_handler=None) -> None:
+        """
+        :param schema_handler: SchemaHandler whose schema_graph the relation paths are searched in.
+        """
         self.schema = self.process_schema(schema)
         self.llm= llm
+        self.schema_handler = schema_handler
+        self._path_index = None
+
+    @property
+    def path_index(self):
+        """Shortest paths between the schema node types, built on first use."""
+        if self._path_index is None:
+            if self.schema_handler is None:
+                raise ValueError("DFSHandler needs a schema_handler to extract the relations between node types")
+            self._path_index = SchemaPathIndex(self.schema_handler.schema_graph)
+        return self._path_index
 
     def process_schema(self, schema):
         """Processes the schema input into a usable format."""
@@ -37,35 +52,13 @@ class DFSHandler:
         return json_format
 
 
-    def extract_relations_between_nodes_dfs(self,current, target, path=None, relationships=None, visited=None):
-        from app import schema_handler
-        # read the file 
-        # return the graph
-        graph = schema_handler.schema_graph
-        if visited is None:
-            visited = set()
-        if path is None:
-            path = []
-        if relationships is None:
-            relationships = []
-
-        visited.add(current)
-        path.append(current)
-
-        if current == target:
-            # Combine the nodes and relationships into a single explanatory string
-            explanation = " -> ".join(f"{path[i]} -> {relationships[i]}" for i in range(len(relationships)))
-            explanation += f" -> {path[-1]}"
-            return explanation
-
-        for neighbor, rel in graph[current]:
-            if neighbor not in visited:
-                explanation = self.extract_relations_between_nodes_dfs(
-                    neighbor, target, path.copy(), relationships + [rel], visited.copy()
-                )
-                if explanation:
-                    return explanation
-        return None
+    def extract_relations_between_nodes_dfs(self, current, target):
+        """
+        :return: The shortest path of relationships from the current node type to the target one,
+            as "gene -> transcribed_to -> transcript", or None when the schema has no such path.
+        """
+        path = self.path_index.shortest(current, target)
+        return explain(path) if path else None
         
     
     def generate_json_from_schema_and_json_query(self,prompt_answer, traversal_data=None, schema=schema, nodes_template=nodes_template, predicates_template=predicates_template):
@@ -0,0 +1,245 @@
+import os
+import re
+import json
+import time
+import threading
+import traceback
+import logging
+import numpy as np
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# "on" answers similar property value lookups from the local index, "off" runs the Neo4j query
+FUZZY_INDEX = os.getenv("FUZZY_INDEX", "on")
+FUZZY_INDEX_PATH = os.getenv("FUZZY_INDEX_PATH", "./fuzzy_index")
+# seconds after which an index is reloaded from Neo4j in the background
+FUZZY_INDEX_REFRESH = int(os.getenv("FUZZY_INDEX_REFRESH", 86400))
+# seconds before an index whose build failed is built again, lookups fall back to Neo4j meanwhile
+FUZZY_INDEX_RETRY = int(os.getenv("FUZZY_INDEX_RETRY", 600))
+
+
+# size of the hashed character histograms used to bound the edit distance
+HISTOGRAM_SIZE = 64
+
+
+class FuzzyIndex:
+    """
+    Distinct values of one (label, property), answering top-k Levenshtein similarity queries
+    with the same scores as apoc.text.levenshteinSimilarity on lowercased values:
+    1 - distance / max(length).
+
+    Values are bucketed by length. A query visits the buckets closest to its own length first
+    and skips the ones whose length difference alone keeps them below the threshold or the
+    current k-th best score. Inside a bucket, a character histogram bound drops most values
+    and the edit distances of the rest are computed at once, one vectorized row of the
+    dynamic program per query character.
+    """
+
+    def __init__(self, values):
+        self.values = list(dict.fromkeys(value for value in values if isinstance(value, str)))
+        # lowercasing can change the length of a value ("İ" becomes two code points), bucket the lowercased one
+        lowered = [value.lower() for value in self.values]
+        buckets = {}
+        for index, value in enumerate(lowered):
+            buckets.setdefault(len(value), []).append(index)
+        self.buckets = {}
+        for length, indices in buckets.items():
+            codes = np.array([[ord(char) for char in lowered[index]] for index in indices], dtype=np.int32)
+            codes = codes.reshape(len(indices), length)
+            histograms = np.zeros((len(indices), HISTOGRAM_SIZE), dtype=np.int16)
+            for column in codes.T:
+                np.add.at(histograms, (np.arange(len(indices)), column % HISTOGRAM_SIZE), 1)
+            # one column per value so the dynamic program runs along contiguous rows
+            self.buckets[length] = (np.array(indices, dtype=np.int64), np.ascontiguousarray(codes.T), histograms)
+
+    def __len__(self):
+        return len(self.values)
+
+    @staticmethod
+    def _distances(query, codes):
+        """Edit distances between the query code points and every column of codes (values of the same length)."""
+        length, count = codes.shape
+        dtype = np.int8 if max(length, len(query)) < 127 else np.int32
+        positions = np.arange(length + 1, dtype=dtype)[:, None]
+        previous = np.broadcast_to(positions, (length + 1, count)).astype(dtype)
+        current = np.empty_like(previous)
+        for row, char in enumerate(query, start=1):
+            current[0] = row
+            np.minimum(previous[1:] + 1, previous[:-1] + (codes != char), out=current[1:])
+            # insertions: current[j] = min over k <= j of current[k] + (j - k)
+            current -= positions
+            np.minimum.accumulate(current, axis=0, out=current)
+            current += positions
+            previous, current = current, previous
+        return previous[-1].astype(np.int64)
+
+    def search(self, search_value, top_k=10, threshold=0.3):
+        """
+        :return: Up to top_k (value, similarity) pairs with similarity > threshold, best first.
+        """
+        query = np.array([ord(char) for char in search_value.lower()], dtype=np.int32)
+        query_length = len(query)
+        query_histogram = np.bincount(query % HISTOGRAM_SIZE, minlength=HISTOGRAM_SIZE).astype(np.int16)
+
+        matches = []
+        floor = None
+        for length in sorted(self.buckets, key=lambda length: abs(length - query_length)):
+            indices, codes, histograms = self.buckets[length]
+            longest = max(length, query_length)
+            if longest == 0:
+                matches.extend((index, 1.0) for index in indices.tolist())
+                continue
+            # the distance is at least the length difference
+            bound = 1 - abs(length - query_length) / longest
+            if bound <= threshold or (floor is not None and bound < floor):
+                continue
+
+            # and at least the number of characters without a counterpart in the other string
+            # (computed like the similarity so values right at the threshold are rounded the same way)
+            common = np.minimum(histograms, query_histogram).sum(axis=1)
+            upper = 1 - (longest - common) / longest
+            candidates = np.flatnonzero(upper > threshold)
+            if floor is not None:
+                candidates = candidates[upper[candidates] >= floor]
+            if not len(candidates):
+                continue
+
+            similarities = 1 - self._distances(query, codes[:, candidates]) / longest
+            keep = similarities > threshold
+            matches.extend(zip(indices[candidates[keep]].tolist(), similarities[keep].tolist()))
+            if len(matches) >= top_k:
+                matches.sort(key=lambda match: (-match[1], match[0]))
+                del matches[top_k:]
+                floor = matches[-1][1]
+
+        matches.sort(key=lambda match: (-match[1], match[0]))
+        return [(self.values[index], round(similarity, 2)) for index, similarity in matches[:top_k]]
+
+
+class SynonymIndex:
+    """Lowercased synonyms of the nodes of one (label, property) mapped to the property values of those nodes."""
+
+    def __init__(self, values):
+        self.values = []
+        self.synonyms = {}
+        for value, synonyms in values:
+            if isinstance(synonyms, str):
+                try:
+                    synonyms = json.loads(synonyms)
+                except ValueError:
+                    synonyms = [synonyms]
+            synonyms = [synonym for synonym in synonyms or [] if isinstance(synonym, str)]
+            self.values.append([value, synonyms])
+            for synonym in synonyms:
+                self.synonyms.setdefault(synonym.lower(), set()).add(value)
+
+    def __len__(self):
+        return len(self.values)
+
+    def lookup(self, synonym):
+        """:return: The property values of the nodes having this synonym."""
+        return sorted(self.synonyms.get(synonym.lower(), ()))
+
+
+class PropertyIndexStore:
+    """
+    Indexes per (label, property), built lazily from `loader(label, property_key)`,
+    persisted to FUZZY_INDEX_PATH so restarts do not scan Neo4j again, and reloaded in a
+    background thread once older than FUZZY_INDEX_REFRESH seconds. A failed build is not
+    attempted again for `retry` seconds, get raises meanwhile without scanning Neo4j.
+
+    :param index_class: FuzzyIndex for the distinct values, SynonymIndex for (value, synonyms) pairs.
+    """
+
+    def __init__(self, loader, path=FUZZY_INDEX_PATH, refresh=FUZZY_INDEX_REFRESH, index_class=FuzzyIndex,
+                 retry=FUZZY_INDEX_RETRY):
+        self.loader = loader
+        self.path = path
+        self.refresh = refresh
+        self.retry = retry
+        self.index_class = index_class
+        self.lock = threading.Lock()
+        self.indexes = {}
+        self.key_locks = {}
+        self.refreshing = set()
+        # (label, property) -> time of the last failed build
+        self.failures = {}
+
+    def _file(self, label, property_key):
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", f"{label}.{property_key}")
+        suffix = "" if self.index_class is FuzzyIndex else f".{self.index_class.__name__.lower()}"
+        return os.path.join(self.path, f"{name}{suffix}.json")
+
+    def _read(self, label, property_key):
+        file_path = self._file(label, property_key)
+        if not os.path.exists(file_path):
+            return None
+        with open(file_path, "r", encoding="utf-8") as file:
+            stored = json.load(file)
+        return stored["built_at"], self.index_class(stored["values"])
+
+    def _build(self, label, property_key):
+        started = time.time()
+        values = self.loader(label, property_key)
+        index = self.index_class(values)
+        os.makedirs(self.path, exist_ok=True)
+        file_path = self._file(label, property_key)
+        temp_path = f"{file_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump({"label": label, "property": property_key, "built_at": started, "values": index.values}, file)
+        os.replace(temp_path, file_path)
+        logger.info(f"{self.index_class.__name__} {label}.{property_key} built with {len(index)} values in {time.time() - started:.2f}s")
+        return started, index
+
+    def get(self, label, property_key):
+        key = (label, property_key)
+        entry = self.indexes.get(key)
+        if entry is None:
+            with self.lock:
+                key_lock = self.key_locks.setdefault(key, threading.Lock())
+            with key_lock:
+                entry = self.indexes.get(key)
+                if entry is None:
+                    failed_at = self.failures.get(key)
+                    if failed_at is not None and time.time() - failed_at < self.retry:
+                        raise RuntimeError(f"{self.index_class.__name__} {label}.{property_key} failed to build, retrying in "
+                                           f"{self.retry - (time.time() - failed_at):.0f}s")
+                    try:
+                        entry = self._read(label, property_key) or self._build(label, property_key)
+                    except Exception:
+                        self.failures[key] = time.time()
+                        raise
+                    self.failures.pop(key, None)
+                    self.indexes[key] = entry
+
+        if time.time() - entry[0] > self.refresh:
+            self._refresh_in_background(key)
+        return entry[1]
+
+    def _refresh_in_background(self, key):
+        with self.lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+
+        def refresh():
+            try:
+                self.indexes[key] = self._build(*key)
+            except Exception:
+                traceback.print_exc()
+                logger.error(f"refreshing {self.index_class.__name__} {key} failed, serving the previous one")
+            finally:
+                with self.lock:
+                    self.refreshing.discard(key)
+
+        threading.Thread(target=refresh, name=f"index-refresh-{key[0]}.{key[1]}", daemon=True).start()
+
+    def search(self, label, property_key, search_value, top_k=10, threshold=0.3):
+        return self.get(label, property_key).search(search_value, top_k, threshold)
+
+    def lookup(self, label, property_key, synonym):
+        return self.get(label, property_key).lookup(synonym)
@@ -1,32 +1,50 @@
 import logging
+import threading
 from typing import List
-from neo4j import GraphDatabase
+from app.annotation_graph.fuzzy_index import PropertyIndexStore, SynonymIndex, FUZZY_INDEX
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class Neo4jConnection:
-    """Singleton class to manage Neo4j connection"""
+    """
+    Singleton class to manage Neo4j connection.
+    The driver (and the neo4j package) is created on the first query, not when the app starts.
+    """
     _instance = None
     _driver = None
+    _credentials = None
+    _driver_lock = threading.Lock()
+    _fuzzy_indexes = None
+    _synonym_indexes = None
 
     def __new__(cls, uri: str = None, username: str = None, password: str = None):
         if cls._instance is None:
             cls._instance = super(Neo4jConnection, cls).__new__(cls)
             if uri and username and password:
-                cls._driver = GraphDatabase.driver(uri, auth=(username, password))
+                cls._credentials = (uri, username, password)
+            cls._fuzzy_indexes = PropertyIndexStore(cls._instance.get_property_values)
+            cls._synonym_indexes = PropertyIndexStore(cls._instance.get_property_synonyms, index_class=SynonymIndex)
         return cls._instance
 
     @classmethod
     def get_driver(cls):
         if cls._driver is None:
-            raise ConnectionError("Neo4j connection not initialized. Call with credentials first.")
+            if cls._credentials is None:
+                raise ConnectionError("Neo4j connection not initialized. Call with credentials first.")
+            with cls._driver_lock:
+                if cls._driver is None:
+                    from neo4j import GraphDatabase
+                    uri, username, password = cls._credentials
+                    cls._driver = GraphDatabase.driver(uri, auth=(username, password))
         return cls._driver
 
     def close(self):
-        if self._driver:
-            self._driver.close()
-            self._driver = None
+        cls = type(self)
+        with cls._driver_lock:
+            if cls._driver:
+                cls._driver.close()
+                cls._driver = None
 
     def get_similar_property_values(self, label: str, 
                                     property_key: str, 
@@ -47,6 +65,14 @@ class Neo4jConnection:
         """
         logger.info(f"Searching for similar values for '{search_value}' in label '{label}' with property key '{property_key}'.")
 
+        if FUZZY_INDEX != "off":
+            try:
+                similar_values = self._fuzzy_indexes.search(label, property_key, search_value, top_k, threshold)
+                logger.info(f"Found {len(similar_values)} similar values: {similar_values}.")
+                return similar_values
+            except Exception as e:
+                logger.error(f"Fuzzy index lookup failed, querying Neo4j: {str(e)}")
+
         query = f"""
         MATCH (n:{label})
         WITH DISTINCT n.{property_key} as value
@@ -81,3 +107,66 @@ class Neo4jConnection:
         except Exception as e:
             logger.error(f"Error querying Neo4j: {str(e)}")
             return []
+
+    def get_property_values(self, label: str, property_key: str):
+        """
+        Get the distinct string values of a property across all nodes of a label, to build the fuzzy index.
+
+        Returns:
+            List[str]: The distinct property values
+        """
+        query = f"""
+        MATCH (n:{label})
+        WITH DISTINCT n.{property_key} as value
+        WHERE value IS NOT NULL
+        RETURN value
+        """
+        driver = self.get_driver()
+        with driver.session() as session:
+            result = session.run(query)
+            return [record["value"] for record in result if isinstance(record["value"], str)]
+
+    def get_property_synonyms(self, label: str, property_key: str):
+        """
+        Get the synonyms of every node of a label with the property value of the node, to build the synonym index.
+
+        Returns:
+            List[Tuple[str, List[str]]]: (property value, synonyms) pairs
+        """
+        query = f"""
+        MATCH (n:{label})
+        WHERE n.{property_key} IS NOT NULL AND n.synonyms IS NOT NULL
+        RETURN n.{property_key} as value, n.synonyms as synonyms
+        """
+        driver = self.get_driver()
+        with driver.session() as session:
+            result = session.run(query)
+            return [(record["value"], record["synonyms"]) for record in result if isinstance(record["value"], str)]
+
+    def get_values_for_synonym(self, label: str, property_key: str, synonym: str):
+        """
+        Get the property values of the nodes of a label having the given synonym (case-insensitive).
+
+        Returns:
+            List[str]: The distinct property values
+        """
+        if FUZZY_INDEX != "off":
+            try:
+                return self._synonym_indexes.lookup(label, property_key, synonym)
+            except Exception as e:
+                logger.error(f"Synonym index lookup failed, querying Neo4j: {str(e)}")
+
+        query = f"""
+        MATCH (n:{label})
+        WHERE n.{property_key} IS NOT NULL
+          AND ANY(synonym IN n.synonyms WHERE toLower(synonym) = toLower($synonym))
+        RETURN DISTINCT n.{property_key} as value
+        """
+        try:
+            driver = self.get_driver()
+            with driver.session() as session:
+                result = session.run(query, synonym=synonym)
+                return sorted(record["value"] for record in result)
+        except Exception as e:
+            logger.error(f"Error querying Neo4j: {str(e)}")
+            return []
@@ -0,0 +1,156 @@
+import os
+import re
+import copy
+import traceback
+import logging
+from dotenv import load_dotenv
+from app.lib.cache import SQLiteCache
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# "on" reuses the validated annotation JSON of a previously seen question
+QUESTION_CACHE = os.getenv("QUESTION_CACHE", "on")
+# "on" also matches questions that only differ by their entities (gene names, ids, ...),
+# the new entities are put in the cached JSON and grounded again
+QUESTION_CACHE_TEMPLATES = os.getenv("QUESTION_CACHE_TEMPLATES", "off")
+
+# words that do not change the annotation query, negations and prepositions are kept on purpose
+STOPWORDS = frozenset({
+    "a", "an", "the", "of", "is", "are", "was", "were", "be", "been", "being", "do", "does", "did",
+    "have", "has", "had", "what", "which", "who", "whom", "whose", "how", "that", "this", "these",
+    "those", "and", "all", "any", "some", "there", "it", "its", "i", "me", "my", "you", "your", "we",
+    "can", "could", "would", "will", "please", "show", "tell", "give", "list", "find",
+})
+# words, keeping the separators of identifiers such as GO:0008150, ENST00000269305.4 or HLA-A
+TOKEN = re.compile(r"\w(?:[\w:.\-]*\w)?")
+
+
+def normalize_question(question):
+    """Lowercased words of the question without punctuation and stopwords."""
+    words = (token.lower() for token in TOKEN.findall(question))
+    return " ".join(word for word in words if word not in STOPWORDS)
+
+
+def is_entity(token):
+    """Identifier looking tokens: TP53, BRCA1, KRAS, ENST00000269305, GO:0008150 (but not GO in "GO terms")."""
+    return any(char.isdigit() for char in token) or (len(token) > 2 and sum(char.isupper() for char in token) >= 2)
+
+
+def question_template(question):
+    """
+    Normalized question with its entities replaced by placeholders.
+    :return: A (template, entities) tuple, entities in the original case.
+    """
+    words, entities = [], []
+    for token in TOKEN.findall(question):
+        if is_entity(token):
+            words.append(f"{{e{len(entities)}}}")
+            entities.append(token)
+        elif token.lower() not in STOPWORDS:
+            words.append(token.lower())
+    return " ".join(words), entities
+
+
+class QuestionCache:
+    """
+    Validated annotation JSON of the questions already answered, keyed by the normalized
+    question and persisted in the shared SQLite cache. Entries are stamped with the schema
+    config hash, so a schema change invalidates all of them.
+
+    With templates on, a question whose property values are exactly its entities is also
+    stored as a template: "transcripts {e0}" -> the JSON with the gene name replaced by
+    {e0}. A later "What transcripts does BRCA1 have?" gets that JSON with BRCA1 in it,
+    which still has to be grounded but skips the LLM calls building the JSON.
+    """
+
+    def __init__(self, schema_hash, templates=QUESTION_CACHE_TEMPLATES == "on"):
+        self.cache = SQLiteCache("validated_json", version=schema_hash)
+        self.templates = templates
+
+    def get(self, question):
+        """
+        :return: A (annotation_json, exact) tuple. exact is False for a filled template,
+            which is not validated yet. (None, False) on a miss.
+        """
+        try:
+            cached = self.cache.get(f"q:{normalize_question(question)}")
+            if cached is not None:
+                return cached, True
+            if not self.templates:
+                return None, False
+            template, entities = question_template(question)
+            cached = self.cache.get(f"t:{template}") if entities else None
+            if cached is None or cached["entities"] != len(entities):
+                return None, False
+            return self._fill(cached["json"], entities), False
+        except Exception:
+            traceback.print_exc()
+            logger.error("question cache lookup failed")
+            return None, False
+
+    def put(self, question, validated_json, validation_report):
+        try:
+            self.cache.set(f"q:{normalize_question(question)}", validated_json)
+            if self.templates:
+                template, entities = question_template(question)
+                template_json = self._template_json(validated_json, validation_report, entities)
+                if template_json is not None:
+                    self.cache.set(f"t:{template}", {"entities": len(entities), "json": template_json})
+        except Exception:
+            traceback.print_exc()
+            logger.error("question cache write failed")
+
+    @staticmethod
+    def _template_json(validated_json, validation_report, entities):
+        """
+        The validated JSON with the value of each grounded property replaced by the placeholder
+        of the question entity it came from, or None when the JSON does not map onto the entities
+        (a value the LLM rephrased, an entity that is not a property value, ...).
+        """
+        if not entities:
+            return None
+        positions = {}
+        for index, entity in enumerate(entities):
+            positions.setdefault(entity.lower(), index)
+        if len(positions) != len(entities):
+            return None
+
+        template_json = copy.deepcopy(validated_json)
+        nodes = {node.get("node_id"): node for node in template_json.get("nodes", [])}
+        used = set()
+        for resolution in validation_report.get("property_resolutions", []):
+            index = positions.get(str(resolution["original_value"]).lower())
+            node = nodes.get(resolution["node_id"])
+            if index is None or node is None:
+                return None
+            node["properties"][resolution["property"]] = f"{{e{index}}}"
+            used.add(index)
+        for node in nodes.values():
+            if node.get("id"):
+                index = positions.get(str(node["id"]).lower())
+                if index is None:
+                    return None
+                node["id"] = f"{{e{index}}}"
+                used.add(index)
+        if len(used) != len(entities):
+            return None
+        return template_json
+
+    @staticmethod
+    def _fill(template_json, entities):
+        annotation_json = copy.deepcopy(template_json)
+        placeholders = {f"{{e{index}}}": entity for index, entity in enumerate(entities)}
+        for node in annotation_json.get("nodes", []):
+            if isinstance(node.get("id"), str) and node["id"] in placeholders:
+                node["id"] = placeholders[node["id"]]
+            properties = node.get("properties", {})
+            for key, value in properties.items():
+                if isinstance(value, str) and value in placeholders:
+                    properties[key] = placeholders[value]
+        return annotation_json
+
+    def stats(self):
+        return self.cache.stats()
@@ -1,27 +1,113 @@
 from collections import defaultdict
+import fcntl
+import hashlib
 import json
 import logging
-from biocypher import BioCypher
+import os
+import re
+from types import MappingProxyType
+from dotenv import load_dotenv
 from flask import current_app, jsonify
 import yaml
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+load_dotenv()
+
+# derived schema structures, rebuilt with BioCypher only when the config files change
+SCHEMA_ARTIFACT_PATH = os.getenv("SCHEMA_ARTIFACT_PATH", "./schema_artifact.json")
+# bumped when the layout of the artifact changes
+SCHEMA_ARTIFACT_FORMAT = 1
+ARTIFACT_FIELDS = ("schema", "processed_schema", "parent_nodes", "adj_list", "schema_graph")
+# "- **gene**" property block headers of enhanced_schema.txt
+ENHANCED_SCHEMA_NODE = re.compile(r"^- \*\*(.+?)\*\*\s*$", re.MULTILINE)
+
+def config_hash(*paths):
+    """sha256 of the content of the config files, changes whenever one of them is edited."""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
 class SchemaHandler:
-    def __init__(self, schema_config_path, biocypher_config_path, enhanced_schema_path):
+    def __init__(self, schema_config_path, biocypher_config_path, enhanced_schema_path, artifact_path=SCHEMA_ARTIFACT_PATH):
+        """
+        :param artifact_path: precompiled schema artifact, loaded when it matches the hash of the
+            config files and rebuilt otherwise. None always builds from BioCypher without saving.
+        """
         try:
-            self.bcy = BioCypher(schema_config_path=schema_config_path, biocypher_config_path=biocypher_config_path)
-            self.graph_file = 'graph.pkl'
+            self.schema_hash = config_hash(schema_config_path, biocypher_config_path, enhanced_schema_path)
             self.enhanced_schema = open(enhanced_schema_path, 'r').read()
-            self.schema = self.bcy._get_ontology_mapping()._extend_schema()
-            self.processed_schema = self.process_schema(self.schema) 
-            self.parent_nodes = self.get_parent_nodes()
-            self.adj_list = self.get_adjacency_list()
-            self.schema_graph = self.build_graph(self.adj_list)
+            if artifact_path is None:
+                self.build(schema_config_path, biocypher_config_path)
+            elif not self.load_artifact(artifact_path):
+                # the first worker rebuilds the artifact, the others wait and load it
+                with open(f"{artifact_path}.lock", "a") as lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    try:
+                        if not self.load_artifact(artifact_path):
+                            self.build(schema_config_path, biocypher_config_path)
+                            self.save_artifact(artifact_path)
+                    finally:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+            self.build_indexes()
         except Exception as e:
             logger.error(f"Unable to initialize Schema Handler: {e}")
 
+    def build(self, schema_config_path, biocypher_config_path):
+        """Derives the schema structures from the BioCypher ontology mapping (slow, loads the ontologies)."""
+        from biocypher import BioCypher
+
+        self.bcy = BioCypher(schema_config_path=schema_config_path, biocypher_config_path=biocypher_config_path)
+        self.schema = self.bcy._get_ontology_mapping()._extend_schema()
+        self.processed_schema = self.process_schema(self.schema) 
+        self.parent_nodes = self.get_parent_nodes()
+        self.adj_list = self.get_adjacency_list()
+        self.schema_graph = self.build_graph(self.adj_list)
+
+    def load_artifact(self, path):
+        """
+        Loads the derived schema structures from a precompiled artifact.
+        :return: False when the artifact is missing, of another format or built from other config files.
+        """
+        if not os.path.exists(path):
+            return False
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                artifact = json.load(file)
+        except ValueError:
+            logger.warning(f"Unreadable schema artifact {path}, rebuilding it")
+            return False
+        if artifact.get("format") != SCHEMA_ARTIFACT_FORMAT or artifact.get("schema_hash") != self.schema_hash:
+            logger.info(f"Schema artifact {path} is out of date, rebuilding it")
+            return False
+
+        self.bcy = None
+        for field in ARTIFACT_FIELDS:
+            setattr(self, field, artifact[field])
+        self.schema_graph = defaultdict(list, {
+            node: [tuple(relation) for relation in relations] for node, relations in self.schema_graph.items()
+        })
+        logger.info(f"Loaded schema artifact {path}")
+        return True
+
+    def save_artifact(self, path):
+        artifact = {"format": SCHEMA_ARTIFACT_FORMAT, "schema_hash": self.schema_hash}
+        artifact.update((field, getattr(self, field)) for field in ARTIFACT_FIELDS)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                json.dump(artifact, file, separators=(',', ':'))
+            os.replace(temp_path, path)
+            logger.info(f"Schema artifact written to {path}")
+        except (OSError, TypeError, ValueError) as e:
+            # the schema built in memory is still used, the next start rebuilds it
+            logger.warning(f"Unable to write the schema artifact {path}: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
     def process_schema(self, schema):
         process_schema = {}
         for _, value in schema.items():
@@ -59,62 +145,127 @@ class SchemaHandler:
 
         return list(parent_edges)
 
-    def get_nodes(self):
-        nodes = {}
+    def build_indexes(self):
+        """
+        Indexes of the processed schema for the lookups done per request, built once per process
+        from the loaded or built schema and never modified afterwards (read-only mappings of tuples,
+        shared as is by forked workers):
+
+        - relations_by_node: node type -> relations whose source or target it is
+        - child_nodes / child_edges: parent type -> node / edge types that are a kind of it
+        - triples / reversed_triples: (source, relation, target) of the schema edges and the
+          same triples reversed, node types with underscores as in the annotation JSON
+        """
+        self.parent_edges = self.get_parent_edges()
+        relations_by_node = defaultdict(list)
+        child_nodes = defaultdict(list)
+        child_edges = defaultdict(list)
+        triples = set()
         for key, value in self.processed_schema.items():
-            if value['represented_as'] == 'node':
+            if value.get('represented_as') == 'node':
                 if key in self.parent_nodes:
                     continue
-                parent = value['is_a']
-                currNode = {
+                child_nodes[value['is_a']].append({
                     'type': key,
-                    'is_a': parent,
+                    'is_a': value['is_a'],
                     'label': value['input_label'],
                     'properties': value.get('properties', {})
-                }
-                if parent not in nodes:
-                    nodes[parent] = []
-                nodes[parent].append(currNode)
-
-        return [{'child_nodes': nodes[key], 'parent_node': key} for key in nodes]
-
-    def get_edges(self):
-        edges = {}
-        for key, value in self.processed_schema.items():
-            if value['represented_as'] == 'edge':
-                if key in self.parent_edges:
+                })
+            elif value.get('represented_as') == 'edge':
+                label = value.get('output_label') or value['input_label']
+                if key not in self.parent_edges:
+                    child_edges[value['is_a']].append({
+                        'type': key,
+                        'label': label,
+                        'is_a': value['is_a'],
+                        'source': value.get('source', ''),
+                        'target': value.get('target', ''),
+                        'properties': value.get('properties', {})
+                    })
+                if not value.get('source') or not value.get('target'):
                     continue
-                label = value.get('output_lable', value['input_label'])
-                edge = {
+                relation = {
                     'type': key,
                     'label': label,
-                    'is_a': value['is_a'],
-                    'source': value.get('source', ''),
-                    'target': value.get('target', ''),
-                    'properties': value.get('properties', {})
+                    'source': value['source'],
+                    'target': value['target']
                 }
-                parent = value['is_a']
-                if parent not in edges:
-                    edges[parent] = []
-                edges[parent].append(edge)
-        return [{'child_edges': edges[key], 'parent_edge': key} for key in edges]
+                sources, targets = self._node_types(value['source']), self._node_types(value['target'])
+                for node_type in dict.fromkeys(sources + targets):
+                    relations_by_node[node_type].append(relation)
+                for relation_label in (label if isinstance(label, list) else [label]):
+                    triples.update((source, relation_label, target) for source in sources for target in targets)
+
+        self.relations_by_node = MappingProxyType({node: tuple(relations) for node, relations in relations_by_node.items()})
+        self.child_nodes = MappingProxyType({parent: tuple(nodes) for parent, nodes in child_nodes.items()})
+        self.child_edges = MappingProxyType({parent: tuple(edges) for parent, edges in child_edges.items()})
+        self.triples = frozenset(triples)
+        self.reversed_triples = frozenset((target, relation, source) for source, relation, target in triples)
+
+    @staticmethod
+    def _node_types(labels):
+        """Node types of a schema source or target (a label or a list of labels), with underscores."""
+        if isinstance(labels, str):
+            labels = [labels]
+        return [label.replace(' ', '_') for label in labels]
+
+    def get_nodes(self):
+        return [{'child_nodes': [dict(node) for node in nodes], 'parent_node': parent}
+                for parent, nodes in self.child_nodes.items()]
+
+    def get_edges(self):
+        return [{'child_edges': [dict(edge) for edge in edges], 'parent_edge': parent}
+                for parent, edges in self.child_edges.items()]
+
+    def annotation_json_schema(self):
+        """
+        JSON Schema of the annotation query (nodes and predicates), restricting node
+        types and predicates to the ones of the schema, for structured output LLM calls.
+        """
+        # parent_nodes holds labels ("coding element"), processed_schema keys use underscores;
+        # only the types stored in the graph (in the schema graph or described in the enhanced schema) are queryable
+        parent_nodes = {parent.replace(' ', '_') for parent in self.parent_nodes}
+        graph_types = set(self.schema_graph) | {target for relations in self.schema_graph.values() for target, _ in relations}
+        graph_types.update(ENHANCED_SCHEMA_NODE.findall(self.enhanced_schema))
+        node_types = sorted(
+            key for key, value in self.processed_schema.items()
+            if value.get('represented_as') == 'node' and key.replace(' ', '_') not in parent_nodes and key in graph_types
+        )
+        predicates = sorted({label for relations in self.adj_list.values() for label in relations})
+        return {
+            "type": "object",
+            "properties": {
+                "nodes": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "node_id": {"type": "string"},
+                            "id": {"type": "string"},
+                            "type": {"type": "string", "enum": node_types},
+                            "properties": {"type": "object"},
+                        },
+                        "required": ["node_id", "id", "type", "properties"],
+                    },
+                },
+                "predicates": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "type": {"type": "string", "enum": predicates},
+                            "source": {"type": "string"},
+                            "target": {"type": "string"},
+                        },
+                        "required": ["type", "source", "target"],
+                    },
+                },
+            },
+            "required": ["nodes", "predicates"],
+        }
 
     def get_relations_for_node(self, node):
-        relations = []
-        node_label = node.replace('_', ' ')
-        for key, value in self.processed_schema.items():
-            if value['represented_as'] == 'edge':
-                if 'source' in value and 'target' in value:
-                    if value['source'] == node_label or value['target'] == node_label:
-                        label = value.get('output_label', value['input_label'])
-                        relation = {
-                            'type': key,
-                            'label': label,
-                            'source': value.get('source', ''),
-                            'target': value.get('target', '')
-                        }
-                        relations.append(relation)
-        return relations
+        return [dict(relation) for relation in self.relations_by_node.get(node.replace(' ', '_'), ())]
 
     def get_schema(schema_path):
         with open(schema_path, 'r') as file:
@@ -173,15 +324,6 @@ class SchemaHandler:
     def build_graph(self, schema_relationship):
         # schema_relationship = generate_schema_relationship()
 
-        import os
-        import pickle
-        if os.path.exists(self.graph_file):
-            with open(self.graph_file, 'rb') as f:
-                graph = pickle.load(f)
-            print("Retrieved graph from storage.")
-            return graph
-
-        # If no stored graph, build a new one
         graph = defaultdict(list)
         for node, relationships in schema_relationship.items():
             for rel, target in relationships.items():
@@ -190,7 +332,6 @@ class SchemaHandler:
                         graph[node].append((t, rel))
                 else:
                     graph[node].append((target, rel))
-        # store the graph in file
         return graph
         
                 
@@ -0,0 +1,118 @@
+import os
+import time
+import logging
+from collections import deque
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# alternative paths kept per (source, target) pair, 1 keeps only the shortest one
+SCHEMA_PATH_K = int(os.getenv("SCHEMA_PATH_K", 3))
+# longest alternative path (in relationships) enumerated for the k shortest paths
+SCHEMA_PATH_MAX_HOPS = int(os.getenv("SCHEMA_PATH_MAX_HOPS", 3))
+
+
+def explain(path):
+    """Renders a ((node, ...), (relationship, ...)) path as "gene -> transcribed_to -> transcript"."""
+    nodes, relationships = path
+    parts = [nodes[0]]
+    for relationship, node in zip(relationships, nodes[1:]):
+        parts.extend((relationship, node))
+    return " -> ".join(parts)
+
+
+class SchemaPathIndex:
+    """
+    Paths between every pair of node types of the schema graph, computed once.
+
+    The shortest path of each pair comes from one BFS per source type, following the
+    relationships in their schema direction. Neighbors are visited in sorted order, so among
+    equally short paths the lexicographically smallest is kept and lookups are deterministic.
+    The path from a type to itself is its shortest cycle (gene -> regulates -> gene).
+
+    With k > 1, up to k simple paths of at most max_hops relationships are also kept per pair,
+    shortest first, for callers that want alternatives to the shortest path.
+    """
+
+    def __init__(self, schema_graph, k=SCHEMA_PATH_K, max_hops=SCHEMA_PATH_MAX_HOPS):
+        """
+        :param schema_graph: SchemaHandler.schema_graph, node type -> [(target type, relationship)].
+        """
+        started = time.perf_counter()
+        self.k = k
+        self.max_hops = max_hops
+        self.adjacency = {
+            node: sorted(set((target, relationship) for target, relationship in relations))
+            for node, relations in schema_graph.items()
+        }
+        self.paths = {}
+        for source in sorted(self.adjacency):
+            self._bfs(source)
+        self.alternatives = {}
+        if k > 1:
+            for source in sorted(self.adjacency):
+                self._enumerate(source)
+        self.build_seconds = time.perf_counter() - started
+        logger.info(f"Schema path index: {len(self.paths)} pairs, {sum(map(len, self.alternatives.values()))} alternatives "
+                    f"in {self.build_seconds * 1000:.1f}ms")
+
+    def _bfs(self, source):
+        # the source is not marked as seen, so reaching it again gives its shortest cycle
+        parents = {}
+        queue = deque()
+        for target, relationship in self.adjacency[source]:
+            if target not in parents:
+                parents[target] = (source, relationship)
+                queue.append(target)
+        while queue:
+            node = queue.popleft()
+            if node == source:
+                continue
+            for target, relationship in self.adjacency.get(node, ()):
+                if target not in parents:
+                    parents[target] = (node, relationship)
+                    queue.append(target)
+
+        for target in parents:
+            nodes, relationships = [target], []
+            node = target
+            while True:
+                parent, relationship = parents[node]
+                nodes.append(parent)
+                relationships.append(relationship)
+                if parent == source:
+                    break
+                node = parent
+            self.paths[(source, target)] = (tuple(reversed(nodes)), tuple(reversed(relationships)))
+
+    def _enumerate(self, source):
+        """Simple paths from source of up to max_hops relationships, in BFS order (shortest first)."""
+        queue = deque([((source,), ())])
+        while queue:
+            nodes, relationships = queue.popleft()
+            if len(relationships) == self.max_hops:
+                continue
+            for target, relationship in self.adjacency.get(nodes[-1], ()):
+                if target in nodes[1:]:
+                    continue
+                path = (nodes + (target,), relationships + (relationship,))
+                found = self.alternatives.setdefault((source, target), [])
+                if len(found) < self.k:
+                    found.append(path)
+                # a path back to the source is a cycle, it is not extended
+                if target != source:
+                    queue.append(path)
+
+    def shortest(self, source, target):
+        """:return: The shortest ((node, ...), (relationship, ...)) path from source to target, or None."""
+        return self.paths.get((source, target))
+
+    def k_shortest(self, source, target):
+        """:return: Up to k paths from source to target, shortest first (only the shortest when k is 1)."""
+        if self.k > 1:
+            return list(self.alternatives.get((source, target), []))
+        path = self.paths.get((source, target))
+        return [path] if path else []
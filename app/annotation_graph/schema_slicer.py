@@ -0,0 +1,227 @@
+import os
+import re
+import threading
+import logging
+import tiktoken
+from functools import cached_property
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# "on" puts only the node types a question refers to (and their neighbors) in the annotation prompts
+SCHEMA_SLICING = os.getenv("SCHEMA_SLICING", "on")
+# hops around the matched node types in the schema graph that are kept in the slice (1 or 2)
+SCHEMA_SLICE_HOPS = int(os.getenv("SCHEMA_SLICE_HOPS", 1))
+# node types with more neighbors than this (e.g. gene) are kept but not expanded, their neighborhood is most of the schema
+SCHEMA_SLICE_MAX_FANOUT = int(os.getenv("SCHEMA_SLICE_MAX_FANOUT", 6))
+
+# how questions refer to node types whose label is an abbreviation, see also the notes of enhanced_schema.txt
+TYPE_ALIASES = {
+    "gene": ["transcription factor", "tf"],
+    "tfbs": ["transcription factor binding site", "binding site"],
+    "snp": ["variant", "polymorphism", "rsid", "eqtl"],
+    "go": ["gene ontology", "go term", "biological process", "molecular function", "cellular component"],
+    "uberon": ["tissue", "anatomy", "anatomical", "organ"],
+    "cl": ["cell type"],
+    "clo": ["cell line"],
+    "efo": ["experimental factor", "disease"],
+    "bto": ["brenda tissue"],
+    "tad": ["topologically associating domain"],
+    "non_coding_rna": ["ncrna", "lncrna", "mirna"],
+}
+
+NODE_HEADER = re.compile(r"^- \*\*(.+?)\*\*\s*$")
+RELATIONSHIP = re.compile(r"^\(:(\w+)\)-\[:(\w+)\]->\(:(\w+)\)")
+WORD = re.compile(r"[a-z0-9]+")
+# relationship label words that do not point at a relationship on their own
+LABEL_STOPWORDS = {"of", "to", "in", "with", "by", "from", "region", "state"}
+MAX_PHRASE = 5
+
+
+def stem(word):
+    """Crude plural folding so "transcripts" and "pathways" match their labels."""
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def phrase(text):
+    return " ".join(stem(word) for word in WORD.findall(text.lower().replace("_", " ")))
+
+
+class SchemaSlicer:
+    """
+    Renders the part of enhanced_schema.txt relevant to a question.
+
+    A lexical index maps the words of node labels, relationship labels and TYPE_ALIASES
+    to node types. The node types a question mentions, plus the source and target of the
+    relationships it mentions, are grown by `hops` in the schema graph (hub types with more
+    than `max_fanout` neighbors are not grown through), and only their property blocks and
+    the relationships between them are rendered. A question matching
+    no label gets the full schema. Prompt tokens of the full schema and of the slices are
+    counted for `stats()`.
+    """
+
+    def __init__(self, enhanced_schema, schema_graph, hops=SCHEMA_SLICE_HOPS, max_fanout=SCHEMA_SLICE_MAX_FANOUT):
+        """
+        :param enhanced_schema: text of config/enhanced_schema.txt.
+        :param schema_graph: SchemaHandler.schema_graph, node type -> [(target type, relationship)].
+        """
+        self.enhanced_schema = enhanced_schema
+        self.hops = hops
+        self.max_fanout = max_fanout
+        self._parse(enhanced_schema)
+
+        self.neighbors = {}
+        for source, targets in (schema_graph or {}).items():
+            for target, _ in targets:
+                self.neighbors.setdefault(source, set()).add(target)
+                self.neighbors.setdefault(target, set()).add(source)
+        for source, _, target in self.relationships:
+            self.neighbors.setdefault(source, set()).add(target)
+            self.neighbors.setdefault(target, set()).add(source)
+
+        self.index = {}
+        for node_type in self.node_blocks:
+            self._add(phrase(node_type), node_type)
+            for alias in TYPE_ALIASES.get(node_type, []):
+                self._add(phrase(alias), node_type)
+        node_keys = set(self.index)
+        edges = set(self.relationships)
+        edges.update((source, label, target) for source, targets in (schema_graph or {}).items() for target, label in targets)
+        for source, label, target in edges:
+            self._add(phrase(label), source, target)
+            # "coexpressed" or "translates" alone also point at the relationship
+            for word in phrase(label).split():
+                if word not in LABEL_STOPWORDS and word not in node_keys:
+                    self._add(word, source, target)
+
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.fallbacks = 0
+        self.tokens_sent = 0
+
+    @cached_property
+    def tokenizer(self):
+        # loaded on the first slice, not when the app starts
+        return tiktoken.get_encoding("cl100k_base")
+
+    @cached_property
+    def full_tokens(self):
+        return len(self.tokenizer.encode(self.enhanced_schema))
+
+    def _parse(self, enhanced_schema):
+        """Splits the schema text into its header, node property blocks, notes and relationship lines."""
+        self.header, self.notes = [], []
+        self.node_blocks = {}
+        self.relationships = []
+        self.relationship_lines = []
+        section, current = "header", None
+        for line in enhanced_schema.splitlines():
+            stripped = line.strip()
+            if stripped.startswith("#### Relationships"):
+                section = "relationships"
+                continue
+            if stripped.startswith("#### Node Properties"):
+                section = "nodes"
+                continue
+            if section == "header":
+                self.header.append(line)
+            elif section == "nodes":
+                header = NODE_HEADER.match(line)
+                if header:
+                    current = header.group(1)
+                    self.node_blocks[current] = [line]
+                elif line.startswith("  ") and current is not None:
+                    self.node_blocks[current].append(line)
+                elif stripped:
+                    current = None
+                    self.notes.append(line)
+            else:
+                relationship = RELATIONSHIP.match(stripped)
+                if relationship:
+                    self.relationships.append(relationship.groups())
+                    self.relationship_lines.append(line)
+
+    def _add(self, key, *node_types):
+        if key:
+            self.index.setdefault(key, set()).update(node_types)
+
+    def match(self, question):
+        """:return: The node types whose label, alias or relationship label appears in the question."""
+        words = [stem(word) for word in WORD.findall(question.lower())]
+        matched = set()
+        for start in range(len(words)):
+            for end in range(start + 1, min(start + MAX_PHRASE, len(words)) + 1):
+                matched.update(self.index.get(" ".join(words[start:end]), ()))
+        return matched
+
+    def is_hub(self, node_type):
+        return len(self.neighbors.get(node_type, ())) > self.max_fanout
+
+    def node_types(self, question):
+        """:return: The node types of the slice of a question, empty when the full schema is used."""
+        selected = self.match(question)
+        # hubs are not grown through, a question only about hubs (e.g. "what does this gene code?")
+        # would get a slice without the types it leads to
+        if all(self.is_hub(node_type) for node_type in selected):
+            return set()
+        frontier = set(selected)
+        for _ in range(self.hops):
+            frontier = {
+                neighbor for node_type in frontier
+                if not self.is_hub(node_type)
+                for neighbor in self.neighbors[node_type]
+            } - selected
+            selected |= frontier
+        return {node_type for node_type in selected if node_type in self.node_blocks}
+
+    def render(self, node_types):
+        lines = list(self.header)
+        lines.append("#### Node Properties:")
+        for node_type, block in self.node_blocks.items():
+            if node_type in node_types:
+                lines.extend(block)
+        if self.notes:
+            lines.append("")
+            lines.extend(self.notes)
+        lines.append("")
+        lines.append("#### Relationships:")
+        for (source, _, target), line in zip(self.relationships, self.relationship_lines):
+            if source in node_types and target in node_types:
+                lines.append(line)
+        return "\n".join(lines) + "\n"
+
+    def slice(self, question):
+        """:return: The schema text for the prompts of a question."""
+        node_types = self.node_types(question)
+        if node_types:
+            schema = self.render(node_types)
+            tokens = len(self.tokenizer.encode(schema))
+            logger.info(f"Schema slice of {len(node_types)} node types: {tokens} of {self.full_tokens} tokens")
+        else:
+            schema = self.enhanced_schema
+            tokens = self.full_tokens
+            logger.info("No schema label (or only hub types) in the question, using the full schema")
+        with self.lock:
+            self.calls += 1
+            self.fallbacks += not node_types
+            self.tokens_sent += tokens
+        return schema
+
+    def stats(self):
+        """Slices served by this process and the schema tokens they saved per prompt."""
+        with self.lock:
+            saved = self.calls * self.full_tokens - self.tokens_sent
+            return {
+                "calls": self.calls,
+                "full_schema_fallbacks": self.fallbacks,
+                "full_schema_tokens": self.full_tokens,
+                "tokens_saved": saved,
+                "mean_tokens_saved": round(saved / self.calls, 1) if self.calls else 0.0,
+            }
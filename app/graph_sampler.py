@@ -0,0 +1,178 @@
+import os
+import re
+import logging
+import numpy as np
+from dotenv import load_dotenv
+from app.annotation_graph.question_cache import normalize_question
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# how the nodes of a graph too large to summarize whole are picked:
+# "structure" (degree, edge type diversity and relevance to the question), "degree", or "first" (the first nodes of the payload)
+GRAPH_SAMPLING = os.getenv("GRAPH_SAMPLING", "structure")
+# estimated description tokens of the sampled nodes and of the edges between them
+GRAPH_SAMPLE_TOKENS = int(os.getenv("GRAPH_SAMPLE_TOKENS", 10000))
+
+STRATEGIES = ("structure", "degree", "first")
+# tokens of an edge line besides its label and the target description: "-> Target Node (<id>): "
+EDGE_LINE_TOKENS = 12
+WORD = re.compile(r"\w+")
+
+
+def _query_words(user_query):
+    return {word for word in normalize_question(user_query).split() if len(word) > 2}
+
+
+def _relevant(nodes_data, words):
+    """Nodes with a property value (other than their type) containing a word of the question."""
+    relevant = np.zeros(len(nodes_data), dtype=bool)
+    for position, data in enumerate(nodes_data):
+        for key, value in data.items():
+            if key != 'type' and value is not None and words & set(WORD.findall(str(value).lower())):
+                relevant[position] = True
+                break
+    return relevant
+
+
+def _scores(strategy, count, sources, targets, labels, label_count, nodes_data, user_query):
+    """Selection score of every node, from the edge index arrays."""
+    ends = np.concatenate([sources, targets])
+    degree = np.bincount(ends, minlength=count)
+    score = np.log1p(degree) / np.log1p(degree.max()) if len(ends) else np.zeros(count)
+    if strategy == "degree":
+        return score
+
+    # distinct edge types incident to each node
+    pairs = np.unique(ends * label_count + np.concatenate([labels, labels]))
+    types = np.bincount(pairs // label_count, minlength=count)
+    score = score + (types / types.max() if len(ends) else 0)
+
+    words = _query_words(user_query) if user_query else set()
+    if words:
+        relevant = _relevant(nodes_data, words)
+        near = np.zeros(count, dtype=bool)
+        near[sources[relevant[targets]]] = True
+        near[targets[relevant[sources]]] = True
+        score = score + 2.0 * relevant + 0.5 * near
+    return score
+
+
+def _order(strategy, score, sources, targets, labels):
+    """Nodes in the order they are considered, the endpoints of the best edge of each type first for "structure"."""
+    by_score = np.argsort(-score, kind="stable")
+    if strategy != "structure" or not len(labels):
+        return by_score
+    edge_score = score[sources] + score[targets]
+    ranked = np.lexsort((-edge_score, labels))
+    _, first = np.unique(labels[ranked], return_index=True)
+    best = ranked[first]
+    seeds = np.stack([sources[best], targets[best]], axis=1).ravel()
+    order = np.concatenate([seeds, by_score])
+    _, keep = np.unique(order, return_index=True)
+    return order[np.sort(keep)]
+
+
+def sample_graph(graph, node_tokens, count_tokens, user_query=None, strategy=GRAPH_SAMPLING,
+                 token_budget=GRAPH_SAMPLE_TOKENS, limited_nodes=100):
+    """
+    Picks the nodes of a graph to describe, with the edges between them.
+
+    "first" keeps the first limited_nodes nodes of the payload. "degree" and "structure"
+    rank the nodes (degrees counted with numpy over the edge index arrays) and add them in
+    that order while the estimated tokens of their descriptions and of the edges to the nodes
+    already picked fit in token_budget. "structure" ranks by degree, number of incident edge
+    types and relevance to user_query (the nodes whose properties contain a word of the
+    question, and their neighbors), and starts with the endpoints of the best edge of each
+    edge type so every type is represented.
+
+    :param graph: {"nodes": [{"data": {"id": ...}}], "edges": [{"data": {"source", "target", "label"}}]}.
+    :param node_tokens: data of a node -> tokens of its description.
+    :param count_tokens: text -> tokens.
+    :return: A (graph, coverage) tuple, the graph holding the picked nodes and their edges in
+        payload order, coverage the fractions of the nodes, edges and edge types kept.
+    """
+    if strategy not in STRATEGIES:
+        logger.warning(f"Unknown GRAPH_SAMPLING strategy {strategy}, using structure")
+        strategy = "structure"
+    nodes = graph.get('nodes') or []
+    edges = graph.get('edges') or []
+    nodes_data = [node['data'] for node in nodes]
+    index = {data['id']: position for position, data in enumerate(nodes_data)}
+
+    # edges between known nodes as index arrays, labels coded as integers
+    label_codes, label_names = {}, []
+    sources, targets, labels, positions = [], [], [], []
+    for position, edge in enumerate(edges):
+        data = edge['data']
+        source, target = index.get(data['source']), index.get(data['target'])
+        if source is None or target is None:
+            continue
+        label = data.get('label')
+        if label not in label_codes:
+            label_codes[label] = len(label_names)
+            label_names.append(label)
+        sources.append(source)
+        targets.append(target)
+        labels.append(label_codes[label])
+        positions.append(position)
+    sources = np.array(sources, dtype=np.int64)
+    targets = np.array(targets, dtype=np.int64)
+    labels = np.array(labels, dtype=np.int64)
+    positions = np.array(positions, dtype=np.int64)
+
+    count = len(nodes)
+    selected = np.zeros(count, dtype=bool)
+    used_tokens = 0
+    if strategy == "first":
+        selected[:limited_nodes] = True
+    elif count:
+        score = _scores(strategy, count, sources, targets, labels, max(len(label_names), 1), nodes_data, user_query)
+        # adjacency of each node: neighbor, edge label, and whether the node is the source of the edge
+        ends = np.concatenate([sources, targets])
+        by_node = np.argsort(ends, kind="stable")
+        neighbors = np.concatenate([targets, sources])[by_node]
+        neighbor_labels = np.concatenate([labels, labels])[by_node]
+        is_source = np.concatenate([np.ones(len(sources), dtype=bool), np.zeros(len(targets), dtype=bool)])[by_node]
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(ends, minlength=count))])
+        label_tokens = np.array([count_tokens(str(label)) for label in label_names] or [0]) + EDGE_LINE_TOKENS
+        description_tokens = np.zeros(count, dtype=np.int64)
+
+        for node in _order(strategy, score, sources, targets, labels):
+            if selected[node]:
+                continue
+            own = node_tokens(nodes_data[node])
+            start, end = offsets[node], offsets[node + 1]
+            linked = selected[neighbors[start:end]]
+            # an edge line describes its target: the neighbor when the node is the source, the node otherwise
+            line_targets = np.where(is_source[start:end][linked], description_tokens[neighbors[start:end][linked]], own)
+            cost = own + int(label_tokens[neighbor_labels[start:end][linked]].sum() + line_targets.sum())
+            if used_tokens + cost > token_budget and selected.any():
+                break
+            selected[node] = True
+            description_tokens[node] = own
+            used_tokens += cost
+
+    kept_edges = selected[sources] & selected[targets] if len(sources) else np.zeros(0, dtype=bool)
+    sample = {
+        "nodes": [nodes[position] for position in np.flatnonzero(selected)],
+        "edges": [edges[position] for position in positions[kept_edges]],
+    }
+    coverage = {
+        "strategy": strategy,
+        "nodes": len(sample["nodes"]),
+        "total_nodes": count,
+        "node_fraction": round(len(sample["nodes"]) / count, 4) if count else 0.0,
+        "edges": len(sample["edges"]),
+        "total_edges": len(sources),
+        "edge_fraction": round(len(sample["edges"]) / len(sources), 4) if len(sources) else 0.0,
+        "edge_types": len(np.unique(labels[kept_edges])),
+        "total_edge_types": len(label_names),
+    }
+    if strategy != "first":
+        coverage["estimated_tokens"] = used_tokens
+        coverage["token_budget"] = token_budget
+    logger.info(f"Graph sample: {coverage}")
+    return sample, coverage
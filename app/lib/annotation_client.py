@@ -0,0 +1,153 @@
+import os
+import time
+import bisect
+import threading
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# seconds to open a connection to the annotation service and to wait for its response
+ANNOTATION_CONNECT_TIMEOUT = float(os.getenv("ANNOTATION_CONNECT_TIMEOUT", 5))
+ANNOTATION_READ_TIMEOUT = float(os.getenv("ANNOTATION_READ_TIMEOUT", 120))
+# retries of failed GETs (connection errors, timeouts, 502/503/504) and of POSTs that could not connect
+ANNOTATION_MAX_RETRIES = int(os.getenv("ANNOTATION_MAX_RETRIES", 2))
+ANNOTATION_RETRY_BACKOFF = float(os.getenv("ANNOTATION_RETRY_BACKOFF", 0.5))
+# keep-alive connections kept per process
+ANNOTATION_POOL_SIZE = int(os.getenv("ANNOTATION_POOL_SIZE", 16))
+# responses larger than this are rejected instead of being loaded in memory
+ANNOTATION_MAX_RESPONSE_BYTES = int(os.getenv("ANNOTATION_MAX_RESPONSE_BYTES", 50 * 1024 * 1024))
+
+# upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class ResponseTooLarge(requests.RequestException):
+    pass
+
+
+class LatencyHistogram:
+    """Request latencies of one endpoint in LATENCY_BUCKETS, with the error count."""
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.errors = 0
+
+    def observe(self, seconds, error=False):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.errors += error
+
+    def snapshot(self):
+        count = sum(self.counts)
+        # cumulative, each bucket counts the requests that took at most its bound
+        buckets, seen = {}, 0
+        for bound, hits in zip(LATENCY_BUCKETS + ("inf",), self.counts):
+            seen += hits
+            buckets[f"le_{bound}"] = seen
+        return {
+            "count": count,
+            "errors": self.errors,
+            "mean_seconds": round(self.total / count, 4) if count else 0.0,
+            "buckets": buckets,
+        }
+
+
+class AnnotationClient:
+    """
+    HTTP client of the annotation service shared by Graph and Graph_Summarizer.
+
+    Requests go through one pooled keep-alive session per process, with connect/read
+    timeouts so a hung upstream can not hold a worker forever. GETs are retried with
+    backoff; POSTs are only retried when the connection could not be opened, as the
+    service may have acted on a request it received. Bodies above max_response_bytes are
+    rejected while they are read. Latencies are kept per endpoint for `metrics()`.
+    """
+
+    def __init__(self, base_url=None, connect_timeout=ANNOTATION_CONNECT_TIMEOUT,
+                 read_timeout=ANNOTATION_READ_TIMEOUT, max_retries=ANNOTATION_MAX_RETRIES,
+                 backoff=ANNOTATION_RETRY_BACKOFF, pool_size=ANNOTATION_POOL_SIZE,
+                 max_response_bytes=ANNOTATION_MAX_RESPONSE_BYTES):
+        self.base_url = (base_url or os.getenv('ANNOTATION_SERVICE_URL') or "").rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_response_bytes = max_response_bytes
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            backoff_factor=backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET", "HEAD"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def request(self, method, path, endpoint=None, **kwargs):
+        """
+        :param path: appended to the service url.
+        :param endpoint: name the latency is recorded under, defaults to the path
+            (pass a template such as "/annotation/<id>" for paths holding ids).
+        :return: The response with its body read, raise_for_status() is left to the caller.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        started = time.perf_counter()
+        error = True
+        try:
+            response = self.session.request(method, self.base_url + path, stream=True, **kwargs)
+            try:
+                self._read_body(response)
+            finally:
+                response.close()
+            error = response.status_code >= 400
+            return response
+        finally:
+            self._observe(f"{method} {endpoint or path}", time.perf_counter() - started, error)
+
+    def get(self, path, endpoint=None, **kwargs):
+        return self.request("GET", path, endpoint=endpoint, **kwargs)
+
+    def post(self, path, endpoint=None, **kwargs):
+        return self.request("POST", path, endpoint=endpoint, **kwargs)
+
+    def _read_body(self, response):
+        length = response.headers.get("Content-Length")
+        if length and length.isdigit() and int(length) > self.max_response_bytes:
+            response._content = b""
+            raise ResponseTooLarge(f"response of {length} bytes exceeds {self.max_response_bytes}", response=response)
+        chunks, size = [], 0
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            size += len(chunk)
+            if size > self.max_response_bytes:
+                response._content = b""
+                raise ResponseTooLarge(f"response exceeds {self.max_response_bytes} bytes", response=response)
+            chunks.append(chunk)
+        # served by response.json() / response.text as with a non streamed request
+        response._content = b"".join(chunks)
+
+    def _observe(self, endpoint, seconds, error):
+        with self.lock:
+            histogram = self.histograms.get(endpoint)
+            if histogram is None:
+                histogram = self.histograms[endpoint] = LatencyHistogram()
+            histogram.observe(seconds, error)
+
+    def metrics(self):
+        """Latency histograms of this process per "METHOD endpoint"."""
+        with self.lock:
+            return {endpoint: histogram.snapshot() for endpoint, histogram in self.histograms.items()}
+
+
+annotation_client = AnnotationClient()
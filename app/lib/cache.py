@@ -0,0 +1,141 @@
+import os
+import time
+import json
+import sqlite3
+import threading
+import logging
+from contextlib import closing
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# SQLite file shared by the app processes for the persistent caches
+CACHE_PATH = os.getenv("CACHE_PATH", "./cache.db")
+
+
+class SQLiteCache:
+    """
+    Persistent JSON key/value cache in a SQLite file, shared by all the app processes and
+    kept across restarts. Entries live in a namespace and are stamped with a version: an
+    entry written under another version (e.g. before a schema change) is never served.
+
+    :param ttl: seconds an entry is served, None keeps it until its version changes.
+    """
+
+    def __init__(self, namespace, version="", ttl=None, path=CACHE_PATH):
+        self.namespace = namespace
+        self.version = version
+        self.ttl = ttl
+        self.path = path
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        with closing(self._connect()) as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    version TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )""")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS counters (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value INTEGER NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )""")
+            removed = connection.execute(
+                "DELETE FROM entries WHERE namespace = ? AND version != ?", (namespace, version)).rowcount
+        if removed:
+            logger.info(f"dropped {removed} {namespace} cache entries of a previous version")
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.execute("PRAGMA busy_timeout=30000")
+        return connection
+
+    def _count(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key):
+        """:return: The cached value or None on a miss."""
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                "SELECT value, created_at FROM entries WHERE namespace = ? AND key = ? AND version = ?",
+                (self.namespace, key, self.version)).fetchone()
+            if row and self.ttl is not None and row[1] + self.ttl < time.time():
+                connection.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (self.namespace, key))
+                row = None
+        self._count(row is not None)
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value):
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, version, value, created_at) VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, key, self.version, json.dumps(value, ensure_ascii=False), time.time()))
+
+    def delete(self, key):
+        with closing(self._connect()) as connection:
+            connection.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (self.namespace, key))
+
+    def delete_prefix(self, prefix):
+        """
+        Drops the entries whose key starts with prefix.
+        :return: The number of entries removed.
+        """
+        pattern = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        with closing(self._connect()) as connection:
+            return connection.execute(
+                "DELETE FROM entries WHERE namespace = ? AND key LIKE ? ESCAPE '\\'", (self.namespace, pattern)).rowcount
+
+    def clear(self):
+        with closing(self._connect()) as connection:
+            connection.execute("DELETE FROM entries WHERE namespace = ?", (self.namespace,))
+
+    def counter(self, key):
+        """:return: The value of a counter shared by the processes, 0 when it was never incremented."""
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                "SELECT value FROM counters WHERE namespace = ? AND key = ?", (self.namespace, key)).fetchone()
+        return row[0] if row else 0
+
+    def increment(self, key):
+        """Atomically increments a shared counter. :return: The new value."""
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute(
+                    "INSERT INTO counters (namespace, key, value) VALUES (?, ?, 1) "
+                    "ON CONFLICT (namespace, key) DO UPDATE SET value = value + 1", (self.namespace, key))
+                value = connection.execute(
+                    "SELECT value FROM counters WHERE namespace = ? AND key = ?", (self.namespace, key)).fetchone()[0]
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+        return value
+
+    def stats(self):
+        """Entries of the namespace in the shared file, hits and misses of this process."""
+        with closing(self._connect()) as connection:
+            entries = connection.execute("SELECT COUNT(*) FROM entries WHERE namespace = ?", (self.namespace,)).fetchone()[0]
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
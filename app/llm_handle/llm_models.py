@@ -1,7 +1,5 @@
-import google.generativeai as genai
-from openai import OpenAI
 from dotenv import load_dotenv
-import openai
+import importlib
 import time
 import os
 import logging
@@ -19,8 +17,22 @@ EMBEDDING_MODEL = "text-embedding-3-small"
 GEMINI_EMBEDDING_MODEL="models/text-embedding-004"
 api = os.getenv('OPENAI_API_KEY')
 gemini_api = os.getenv('GEMINI_API_KEY')
+
+
+def _sdk(module_name):
+    """
+    Imports a provider SDK on first use, only the SDK of the configured provider is loaded
+    (google.generativeai and openai each take about half a second to import).
+    """
+    return importlib.import_module(module_name)
+
+
 # Function to generate OpenAI embeddings
 def openai_embedding_model(batch):
+    if isinstance(batch, str):
+        # a single text, not a batch to slice
+        batch = [batch]
+    openai = _sdk("openai")
     openai.api_key = api
     embeddings = []
     batch_size = 1000
@@ -47,6 +59,10 @@ def openai_embedding_model(batch):
 
 # Function to generate gemini embeddings
 def gemini_embedding_model(batch):
+    if isinstance(batch, str):
+        # a single text, not a batch to slice
+        batch = [batch]
+    genai = _sdk("google.generativeai")
     embeddings = []
     batch_size = 1000
     sleep_time = 10
@@ -95,11 +111,17 @@ class LLMInterface:
     def generate(self, prompt: str, **kwargs) -> Dict[str, Any]:
         raise NotImplementedError("Subclasses must implement the generate method")
 
+    def generate_structured(self, prompt: str, json_schema: Dict[str, Any], name: str = "response", system_prompt=None) -> Dict[str, Any]:
+        """Generates a JSON response following json_schema with the provider's structured output mode."""
+        raise NotImplementedError("Subclasses must implement the generate_structured method")
+
 
 
 class GeminiModel(LLMInterface):
     def __init__(self, api_key: str, model_provider,model_name="gemini-pro"): 
+        genai = _sdk("google.generativeai")
         genai.configure(api_key=api_key)
+        self.genai = genai
         self.model = genai.GenerativeModel(model_name or "gemini-pro")
         self.model_name = model_name
         self.model_provider = model_provider
@@ -108,7 +130,7 @@ class GeminiModel(LLMInterface):
     def generate(self, prompt: str,system_prompt=None, temperature=0.0, top_k=1) -> Dict[str, Any]:
         response = self.model.generate_content(
                 prompt,
-                generation_config=genai.types.GenerationConfig(
+                generation_config=self.genai.types.GenerationConfig(
                     temperature=0,
                     top_k=top_k
                 )
@@ -122,6 +144,19 @@ class GeminiModel(LLMInterface):
         except json.JSONDecodeError:
             return json_content
 
+    def generate_structured(self, prompt: str, json_schema: Dict[str, Any], name: str = "response", system_prompt=None) -> Dict[str, Any]:
+        # the JSON mode of the SDK does not take every JSON Schema keyword, the schema goes with the prompt
+        prompt = f"{prompt}\n\nRespond with a JSON object that follows this JSON Schema:\n{json.dumps(json_schema)}"
+        response = self.model.generate_content(
+                prompt,
+                generation_config=self.genai.types.GenerationConfig(
+                    temperature=0,
+                    top_k=1,
+                    response_mime_type="application/json"
+                )
+            )
+        return json.loads(response.text)
+
     def _extract_json_from_codeblock(self, content: str) -> str:
         start = content.find("```json")
         end = content.rfind("```")
@@ -137,18 +172,19 @@ class OpenAIModel(LLMInterface):
         self.api_key = api_key
         self.model_name = model_name
         self.model_provider = model_provider
-        openai.api_key = self.api_key
+        self.openai = _sdk("openai")
+        self.openai.api_key = self.api_key
     
     def generate(self, prompt: str, system_prompt=None) -> Dict[str, Any]:
         if system_prompt:
-            response = openai.chat.completions.create(
+            response = self.openai.chat.completions.create(
             model=self.model_name,
             messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": prompt}],
             temperature=0,
             max_tokens=1000
         )
         else:
-            response = openai.chat.completions.create(
+            response = self.openai.chat.completions.create(
                 model=self.model_name,
                 messages=[{"role": "user", "content": prompt}],
                 temperature=0,
@@ -169,4 +205,29 @@ class OpenAIModel(LLMInterface):
             json_content = content[start + 7:end].strip()
             return json_content
         else:
-            return content
\ No newline at end of file
+            return content
+
+    def generate_structured(self, prompt: str, json_schema: Dict[str, Any], name: str = "response", system_prompt=None) -> Dict[str, Any]:
+        messages = [{"role": "user", "content": prompt}]
+        if system_prompt:
+            messages.insert(0, {"role": "system", "content": system_prompt})
+        try:
+            response = self.openai.chat.completions.create(
+                model=self.model_name,
+                messages=messages,
+                temperature=0,
+                max_tokens=1000,
+                response_format={"type": "json_schema", "json_schema": {"name": name, "schema": json_schema}}
+            )
+        except self.openai.BadRequestError:
+            # models without structured outputs still have the JSON mode
+            logger.warning(f"{self.model_name} does not support json_schema responses, using json_object")
+            messages[-1]["content"] = f"{prompt}\n\nRespond with a JSON object that follows this JSON Schema:\n{json.dumps(json_schema)}"
+            response = self.openai.chat.completions.create(
+                model=self.model_name,
+                messages=messages,
+                temperature=0,
+                max_tokens=1000,
+                response_format={"type": "json_object"}
+            )
+        return json.loads(response.choices[0].message.content)
@@ -6,18 +6,17 @@ from app.annotation_graph.schema_handler import SchemaHandler
 from app.rag.rag import RAG
 from .annotation_graph.annotated_graph import Graph
 from .llm_handle.llm_models import LLMInterface,OpenAIModel,get_llm_model,openai_embedding_model
-from autogen import AssistantAgent, UserProxyAgent, GroupChat, GroupChatManager
 from typing import Annotated
-from app.storage.qdrant import Qdrant
+from app.storage.vector_store import get_vector_store, get_async_vector_store
 from app.prompts.conversation_handler import conversation_prompt
 from app.prompts.classifier_prompt import classifier_prompt
 from app.memory_layer import MemoryManager
+from app.memory_worker import MemoryWriter, MEMORY_WORKERS
 from app.summarizer import Graph_Summarizer
 from app.history import History
 import asyncio
 import traceback
 import json
-import autogen
 
 
 logger = logging.getLogger(__name__)
@@ -38,9 +37,11 @@ class AiAssistance:
         self.basic_llm = basic_llm
         self.annotation_graph = Graph(advanced_llm, schema_handler)
         self.graph_summarizer = Graph_Summarizer(self.advanced_llm)
-        self.client = Qdrant()
+        self.client = get_vector_store()
         self.rag = RAG(client=self.client,llm=advanced_llm)
         self.history = History()
+        # memories are extracted after the response is sent, MEMORY_WORKERS=0 saves them during the request
+        self.memory_writer = MemoryWriter(self.write_memory).start() if MEMORY_WORKERS else None
         
         if self.advanced_llm.model_provider == 'gemini':
             self.llm_config = [{"model":"gemini-1.5-flash","api_key": self.advanced_llm.api_key}]
@@ -54,7 +55,15 @@ class AiAssistance:
             return message
         return message
 
-    def agent(self,message,user_id, token):
+    def agent(self,message,user_id, token, async_client=None, loop=None):
+        """
+        Runs the agents for an information-seeking query.
+        :param async_client: when given with the request's event loop, the rag search runs on that loop
+                             with the async vector store client, while this thread waits for it.
+        """
+        # autogen (with flaml and sklearn) is the slowest import of the app, it is loaded on the first agent call
+        from autogen import AssistantAgent, UserProxyAgent, GroupChat, GroupChatManager
+
         message = self.preprocess_message(message)
         graph_agent = AssistantAgent(
             name="gragh_generate",
@@ -86,6 +95,10 @@ class AiAssistance:
         @rag_agent.register_for_llm(description="Retrieve information for general knowledge queries.")
         def get_general_response() -> str:
             try:
+                if async_client is not None:
+                    future = asyncio.run_coroutine_threadsafe(
+                        self.rag.aget_result_from_rag(message, user_id, async_client), loop)
+                    return future.result()
                 response = self.rag.get_result_from_rag(message, user_id)
                 return response
             except Exception as e:
@@ -118,16 +131,25 @@ class AiAssistance:
             return response
         return group_chat.messages[1]['content']
 
-    async def save_memory(self,query,user_id):
+    def write_memory(self, query, user_id):
+        """Extracts and saves the memories of a query, run by the background memory writer."""
+        memory_manager = MemoryManager(self.advanced_llm,client=self.client)
+        return memory_manager.add_memory(query, user_id)
+
+    async def save_memory(self,query,user_id,async_client=None):
         # saving the new query of the user to a memorymanager
+        if self.memory_writer is not None:
+            return self.memory_writer.submit(user_id, query)
         memory_manager = MemoryManager(self.advanced_llm,client=self.client)
-        memory_manager.add_memory(query, user_id)
+        if async_client is not None:
+            return await memory_manager.aadd_memory(query, user_id, async_client)
+        return memory_manager.add_memory(query, user_id)
 
     async def assistant(self,query,user_id, token, user_context=None):
         # retrieving saved memories
         try:
-            # context = self.client._retrieve_memory(user_id=user_id)
-            context=None
+            # served from the per-user memory cache, the vector store is only read on a miss
+            context = self.client._retrieve_memory(user_id=user_id)
             history = self.history.retrieve_user_history(user_id)
             user_context = user_context
         except:
@@ -144,9 +166,14 @@ class AiAssistance:
                 return {"text":response}
             elif "question:" in response:
                 refactored_question = response.split("question:")[1].strip()
-        await self.save_memory(query,user_id)
-        response = self.agent(refactored_question, user_id, token)
-        self.history.create_history(user_id, query, response)     
+        # the memory job is queued (or, without background writer, runs on this loop) while the agent thread answers the question
+        async with get_async_vector_store() as async_client:
+            memory_task = asyncio.create_task(self.save_memory(query, user_id, async_client))
+            response = await asyncio.to_thread(
+                self.agent, refactored_question, user_id, token, async_client, asyncio.get_running_loop())
+            await asyncio.gather(
+                memory_task,
+                asyncio.to_thread(self.history.create_history, user_id, query, response))
         return response 
 
     def assistant_response(self,query,user_id,token,graph=None,graph_id=None,file=None,resource="annotation"):
@@ -175,12 +202,12 @@ class AiAssistance:
                     logger.debug("Query provided with graph_id")
                     if resource == "annotation":
                         # Process summary with query
-                        summary = self.graph_summarizer.summary(token=token, graph_id=graph_id)
+                        summary = self.graph_summarizer.summary(token=token, graph_id=graph_id, user_id=user_id)
                         prompt = classifier_prompt.format(query=query,graph_summary=summary)
                         response = self.advanced_llm.generate(prompt)
                         if "related" in response:
                             logger.info("question is related with with the graph")
-                            query_response = self.graph_summarizer.summary(token=token, graph_id=graph_id,  user_query=query)
+                            query_response = self.graph_summarizer.summary(token=token, graph_id=graph_id,  user_query=query, user_id=user_id)
                             # creating users history
                             self.history.create_history(user_id, query, query_response)    
                             logger.info(f"user query is {query} response is {query_response}")  
@@ -206,7 +233,7 @@ class AiAssistance:
                     logger.debug("No query provided, but graph_id is available")
                     if resource == "annotation":
                         # Process summary without query
-                        summary = self.graph_summarizer.summary(token=token, graph_id=graph_id, user_query=None)
+                        summary = self.graph_summarizer.summary(token=token, graph_id=graph_id, user_query=None, user_id=user_id)
                         # creating users history
                         self.history.create_history(user_id, query, summary)
                         return summary
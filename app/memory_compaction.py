@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import traceback
+import logging
+import numpy as np
+from dotenv import load_dotenv
+from app.prompts.memory_prompt import get_memory_compaction_messages
+from app.llm_handle.llm_models import openai_embedding_model
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# cosine similarity above which two memories of a user are merged
+MEMORY_COMPACTION_THRESHOLD = float(os.getenv("MEMORY_COMPACTION_THRESHOLD", 0.85))
+# time of the last compaction pass, only users with writes after it (or failed in it) are compacted
+MEMORY_COMPACTION_STATE_PATH = os.getenv("MEMORY_COMPACTION_STATE_PATH", "./memory_compaction.json")
+
+
+def cluster_memories(vectors, threshold=MEMORY_COMPACTION_THRESHOLD):
+    """
+    Groups vectors whose cosine similarity is at least `threshold`, transitively (single linkage).
+    :return: The clusters with more than one member, as lists of row indices in ascending order.
+    """
+    if len(vectors) < 2:
+        return []
+    vectors = np.asarray(vectors, dtype=np.float32)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    similarity = vectors @ vectors.T
+
+    parent = list(range(len(vectors)))
+
+    def find(row):
+        while parent[row] != row:
+            parent[row] = parent[parent[row]]
+            row = parent[row]
+        return row
+
+    for first, second in zip(*np.nonzero(np.triu(similarity >= threshold, k=1))):
+        parent[find(first)] = find(second)
+
+    clusters = {}
+    for row in range(len(vectors)):
+        clusters.setdefault(find(row), []).append(row)
+    return [rows for rows in clusters.values() if len(rows) > 1]
+
+
+class MemoryCompactor:
+    """
+    Offline job merging near-duplicate memories of each user.
+
+    For every user with new writes since the last pass, the user's memory vectors are
+    clustered by cosine similarity, all the clusters of the user are merged with one LLM call,
+    the merged memories are embedded in one batch and replace the originals in a single write.
+    """
+
+    def __init__(self, llm, client, embedding_model=openai_embedding_model,
+                 threshold=MEMORY_COMPACTION_THRESHOLD, state_path=MEMORY_COMPACTION_STATE_PATH):
+        """
+        :param llm: The language model merging the clusters.
+        :param client: The vector store holding the memories.
+        """
+        self.llm = llm
+        self.client = client
+        self.embedding_model = embedding_model
+        self.threshold = threshold
+        self.state_path = state_path
+
+    def _load_state(self):
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path, "r") as state:
+            return json.load(state)
+
+    def _save_state(self, state):
+        temp_path = f"{self.state_path}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump(state, file)
+        os.replace(temp_path, self.state_path)
+
+    def _merge_clusters(self, clusters):
+        """
+        Merges the clusters of a user with a single LLM call.
+        :return: A dict mapping the cluster index to its merged memory text.
+        """
+        groups = [{"group": index, "memories": [memory.content for memory in cluster]} for index, cluster in enumerate(clusters)]
+        response = self.llm.generate(prompt=get_memory_compaction_messages(json.dumps(groups, ensure_ascii=False)))
+        merged = {}
+        for memory in (response or {}).get("memories", []):
+            try:
+                index = int(memory["group"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            text = (memory.get("text") or "").strip()
+            if 0 <= index < len(clusters) and text:
+                merged[index] = text
+        return merged
+
+    def compact_user(self, user_id):
+        """
+        Compacts the memories of one user.
+        :return: The number of memories removed.
+        """
+        memories = self.client._retrieve_memory_vectors(user_id)
+        memories.sort(key=lambda memory: memory[0].date or "")
+        clusters = [
+            [memories[row][0] for row in rows]
+            for rows in cluster_memories([vector for _, vector in memories], self.threshold)
+        ]
+        if not clusters:
+            return 0
+
+        merged = self._merge_clusters(clusters)
+        if not merged:
+            logger.warning(f"no merged memories returned for user {user_id}")
+            return 0
+
+        indices = sorted(merged)
+        data = [merged[index] for index in indices]
+        embeddings = self.embedding_model(data)
+        if len(embeddings) != len(data):
+            raise RuntimeError(f"expected {len(data)} memory embeddings, got {len(embeddings)}")
+        memory_ids = [memory.id for index in indices for memory in clusters[index]]
+        self.client._replace_memories(user_id, memory_ids, data, embeddings)
+
+        removed = len(memory_ids) - len(data)
+        logger.info(f"compacted {len(memory_ids)} memories of user {user_id} into {len(data)}")
+        return removed
+
+    def run(self, full=False):
+        """
+        Runs one compaction pass over the users with memory writes since the last pass.
+        :param full: compacts every user instead.
+        :return: A dict with the number of users compacted, memories removed and failures.
+        """
+        state = self._load_state()
+        since = None if full else state.get("last_pass")
+        # the next pass picks up the writes made while this one runs, not the memories it writes (tagged compacted)
+        started_at = time.time()
+
+        # the users whose compaction failed in the previous pass are tried again
+        users = self.client._memory_users_since(since) | set(state.get("failed_users", []))
+        report = {"users": len(users), "removed": 0, "failed": 0}
+        failed_users = []
+        for user_id in users:
+            try:
+                report["removed"] += self.compact_user(user_id)
+            except Exception:
+                traceback.print_exc()
+                logger.error(f"memory compaction failed for user {user_id}")
+                report["failed"] += 1
+                failed_users.append(user_id)
+
+        state["last_pass"] = started_at
+        state["failed_users"] = failed_users
+        self._save_state(state)
+        logger.info(f"memory compaction pass done: {report}")
+        return report
@@ -0,0 +1,135 @@
+import os
+import re
+import json
+import time
+import random
+import threading
+import logging
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# "on" only sends messages that may hold user facts to the fact extraction LLM call, "off" sends every message
+MEMORY_PREFILTER = os.getenv("MEMORY_PREFILTER", "on")
+# share of the decisions written to the audit log, to check the precision of the filter
+MEMORY_PREFILTER_AUDIT_RATE = float(os.getenv("MEMORY_PREFILTER_AUDIT_RATE", 0.05))
+MEMORY_PREFILTER_AUDIT_PATH = os.getenv("MEMORY_PREFILTER_AUDIT_PATH", "logfiles/memory_prefilter_audit.jsonl")
+# minimum score of a message to be sent to the LLM
+THRESHOLD = 2
+
+SMALL_TALK = {
+    "hi", "hello", "hey", "thanks", "thank you", "ok", "okay", "bye", "goodbye", "good morning",
+    "good evening", "how are you", "yes", "no", "sure", "great", "cool", "nice",
+}
+
+FIRST_PERSON = re.compile(r"\b(i|i'm|im|i've|i'd|i'll|me|my|mine|myself|we|we're|our|ours)\b", re.IGNORECASE)
+
+# weighted cues of a personal fact, preference, plan or professional detail
+FACT_CUES = [
+    (re.compile(r"\b(i am|i'm|im)\s+(a|an|the)\b", re.IGNORECASE), 3),
+    (re.compile(r"\b(i am|i'm|we are|we're)\s+\w+ing\b", re.IGNORECASE), 2),
+    (re.compile(r"\bmy\s+(name|job|role|work|research|lab|team|project|thesis|field|focus|goal|interest|favou?rite|wife|husband|son|daughter|family|birthday|diet|doctor)", re.IGNORECASE), 3),
+    (re.compile(r"\b(i|we)\s+(like|love|enjoy|prefer|hate|dislike|want|need|plan|intend|work|study|research|live|moved|am|have|had|use|focus|specialize|teach|run|eat|avoid)\b", re.IGNORECASE), 2),
+    (re.compile(r"\b(interested in|working on|allergic|favou?rite|remember that|call me|my name|born in|years old)\b", re.IGNORECASE), 2),
+    (re.compile(r"\b(always|never|usually)\b", re.IGNORECASE), 1),
+    (re.compile(r"\.pdf\b", re.IGNORECASE), 3),
+]
+
+
+class MemoryPreFilter:
+    """
+    Cheap local check deciding whether a message may contain user facts worth remembering,
+    so questions and small talk skip the fact extraction LLM call.
+
+    Messages are scored with first person and fact/preference keyword cues. Skip counts per
+    reason are kept for this process and a sample of the decisions is written to a JSONL
+    audit log to tune the cues against the saved LLM calls.
+    """
+
+    def __init__(self, mode=MEMORY_PREFILTER, audit_rate=MEMORY_PREFILTER_AUDIT_RATE,
+                 audit_path=MEMORY_PREFILTER_AUDIT_PATH, threshold=THRESHOLD):
+        self.enabled = mode != "off"
+        self.audit_rate = audit_rate
+        self.audit_path = audit_path
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.counts = {"checked": 0, "passed": 0, "skipped": 0}
+        self.reasons = {}
+
+    def score(self, message):
+        """
+        Scores a message.
+        :return: A tuple (score, reason), reason tells why a message is skipped or passed.
+        """
+        text = " ".join(message.split()).strip()
+        normalized = text.lower().strip(" .!?")
+        if not normalized:
+            return 0, "empty"
+        if normalized in SMALL_TALK or len(normalized) < 4:
+            return 0, "small_talk"
+
+        score = sum(weight for pattern, weight in FACT_CUES if pattern.search(text))
+        if score == 0:
+            if not FIRST_PERSON.search(text):
+                return 0, "question" if text.endswith("?") else "no_personal_reference"
+            return 0, "no_fact_cue"
+        if text.endswith("?") and not FIRST_PERSON.search(text):
+            score -= 1
+        return score, "fact_cue"
+
+    def check(self, message):
+        """
+        Decides whether a message goes to the fact extraction LLM.
+        :return: True if the message may contain user facts.
+        """
+        if not self.enabled:
+            return True
+        if not isinstance(message, str):
+            message = json.dumps(message, default=str)
+
+        score, reason = self.score(message)
+        passed = score >= self.threshold
+        if not passed and reason == "fact_cue":
+            reason = "low_score"
+        with self.lock:
+            self.counts["checked"] += 1
+            self.counts["passed" if passed else "skipped"] += 1
+            key = f"{'passed' if passed else 'skipped'}:{reason}"
+            self.reasons[key] = self.reasons.get(key, 0) + 1
+
+        if random.random() < self.audit_rate:
+            self._audit(message, passed, score, reason)
+        return passed
+
+    def _audit(self, message, passed, score, reason):
+        try:
+            os.makedirs(os.path.dirname(self.audit_path) or ".", exist_ok=True)
+            with self.lock, open(self.audit_path, "a", encoding="utf-8") as audit:
+                audit.write(json.dumps({
+                    "time": time.time(),
+                    "passed": passed,
+                    "score": score,
+                    "reason": reason,
+                    "message": message[:500],
+                }) + "\n")
+        except Exception as e:
+            logger.warning(f"unable to write the memory prefilter audit log: {e}")
+
+    def stats(self):
+        """Skip rate and decision counts per reason of this process."""
+        with self.lock:
+            counts = dict(self.counts)
+            reasons = dict(self.reasons)
+        checked = counts["checked"]
+        return {
+            "enabled": self.enabled,
+            **counts,
+            "skip_rate": round(counts["skipped"] / checked, 4) if checked else 0.0,
+            "reasons": reasons,
+        }
+
+
+memory_prefilter = MemoryPreFilter()
@@ -1,10 +1,15 @@
 
 import uuid
 import json
-import openai
 from app.prompts.memory_prompt import FACT_RETRIEVAL_PROMPT,get_update_memory_messages
 from .llm_handle.llm_models import LLMInterface,OpenAIModel,get_llm_model,openai_embedding_model
+from app.memory_filter import memory_prefilter
 import traceback
+import asyncio
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 
 class MemoryManager:
     def __init__(self, llm, client):
@@ -25,14 +30,104 @@ class MemoryManager:
         """
         return FACT_RETRIEVAL_PROMPT, f"Input: {messages}"
 
-    def qdrant_client_retrieved_user_similar_preferences(self, user_id, embedding):
+    def qdrant_client_retrieved_user_similar_preferences(self, user_id, embeddings):
         """
-        Retrieves similar user preferences from Qdrant.
+        Retrieves similar user preferences from Qdrant for several embeddings in one request.
         :param user_id: The user ID.
-        :param embedding: The embedding vector.
-        :return: Retrieved contents from Qdrant.
+        :param embeddings: The embedding vectors.
+        :return: One list of retrieved memories per embedding.
+        """
+        return self.client._retrieve_memories(user_id, embeddings)
+
+    def _embed_facts(self, facts):
+        """
+        Embeds all the facts with a single embedding request.
+        :return: A dict mapping each fact to its embedding, in the shape expected by _create_memory_update_memory.
+        """
+        embeddings = self.embedding_model(facts)
+        if len(embeddings) != len(facts):
+            raise RuntimeError(f"expected {len(facts)} fact embeddings, got {len(embeddings)}")
+        return {fact: [embedding] for fact, embedding in zip(facts, embeddings)}
+
+    @staticmethod
+    def _old_memories(existing_memories):
+        """Flattens the per fact search results, a memory similar to several facts is listed once."""
+        retrieved_old_memory = {}
+        for existing_memory in existing_memories:
+            for mem in existing_memory or []:
+                retrieved_old_memory.setdefault(mem.id, {"id": mem.id, "text": mem.content})
+        return list(retrieved_old_memory.values())
+
+    def _extract_facts(self, messages):
+        """
+        Extracts the facts worth remembering from the user's messages.
+        :return: A list of facts.
+        """
+        if not memory_prefilter.check(messages):
+            logger.info("no memorable content in the message, skipping fact extraction")
+            return []
+
+        if isinstance(messages, str):
+            messages = [{"role": "user", "content": messages}]
+        else:
+            messages = []
+
+        system_prompt, user_prompt = self.get_fact_retrieval_message(messages)
+        response = self.llm.generate(user_prompt,system_prompt)
+
+        try:
+            return response["facts"]
+        except Exception:
+            return []
+
+    def _get_memory_actions(self, retrieved_old_memory, new_retrieved_facts):
+        """
+        Asks the LLM which ADD/UPDATE/NONE action to take for the new facts.
+        :return: A tuple of the actions and a mapping from the temporary ids given to the old memories to their ids.
+        """
+        temp_uuid_mapping = {str(idx): item["id"] for idx, item in enumerate(retrieved_old_memory)}
+        for idx, item in enumerate(retrieved_old_memory):
+            retrieved_old_memory[idx]["id"] = str(idx)
+
+        function_calling_prompt = get_update_memory_messages(retrieved_old_memory, new_retrieved_facts)
+        new_memories_with_actions = self.llm.generate(prompt=function_calling_prompt)
+        return new_memories_with_actions["memory"], temp_uuid_mapping
+
+    def _plan_memory_writes(self, actions, temp_uuid_mapping, new_message_embeddings, user_id):
         """
-        return self.client._retrieve_memory(user_id, embedding)
+        Turns the LLM actions into vector store writes.
+        :return: A list of (arguments of _create_memory_update_memory, returned memory) pairs.
+        """
+        metadata = {}
+        writes = []
+        for resp in actions:
+            data = resp["text"]
+            if resp["event"] == "ADD":
+                writes.append((
+                    {"user_id": user_id, "data": data, "embedding": new_message_embeddings[data], "metadata": metadata},
+                    {"id": None, "memory": data, "event": resp["event"]},
+                ))
+
+            elif resp["event"] == "UPDATE":
+                writes.append((
+                    {
+                        "user_id": user_id,
+                        "memory_id": temp_uuid_mapping[resp["id"]],
+                        "data": data,
+                        "embedding": new_message_embeddings[data],
+                        "metadata": metadata,
+                    },
+                    {
+                        "id": temp_uuid_mapping[resp["id"]],
+                        "memory": data,
+                        "event": resp["event"],
+                        "previous_memory": resp["old_memory"],
+                    },
+                ))
+
+            elif resp["event"] == "NONE":
+                logger.info("NOOP for Memory.")
+        return writes
 
     def add_memory(self, messages, user_id):
         try:
@@ -44,72 +139,65 @@ class MemoryManager:
             """
             if not user_id:
                 return "userid is an obligatory to save memory"
-            if isinstance(messages, str):
-                messages = [{"role": "user", "content": messages}]
-            else:
-                messages = []
-
-            metadata = {}
-            system_prompt, user_prompt = self.get_fact_retrieval_message(messages)
-            response = self.llm.generate(user_prompt,system_prompt)
-
-            try:
-                new_retrieved_facts = response["facts"]
-            except Exception:
-                new_retrieved_facts = []
-
-            retrieved_old_memory = []
-            new_message_embeddings = {}
-
-            for fact in new_retrieved_facts:
-                embedded_message = self.embedding_model(fact)
-                new_message_embeddings[fact] = embedded_message
-                existing_memory = self.qdrant_client_retrieved_user_similar_preferences(user_id, embedded_message[0])
-
-                if existing_memory:
-                    for mem in existing_memory:
-                        retrieved_old_memory.append({"id": mem["id"], "text": mem["content"]})
-
-            temp_uuid_mapping = {str(idx): item["id"] for idx, item in enumerate(retrieved_old_memory)}
-            for idx, item in enumerate(retrieved_old_memory):
-                retrieved_old_memory[idx]["id"] = str(idx)
-
-            function_calling_prompt = get_update_memory_messages(retrieved_old_memory, new_retrieved_facts)
-            new_memories_with_actions = self.llm.generate(prompt=function_calling_prompt)
+
+            new_retrieved_facts = self._extract_facts(messages)
+            if not new_retrieved_facts:
+                logger.info("no facts to remember")
+                return []
+
+            new_message_embeddings = self._embed_facts(new_retrieved_facts)
+            existing_memories = self.qdrant_client_retrieved_user_similar_preferences(
+                user_id, [new_message_embeddings[fact][0] for fact in new_retrieved_facts]
+            )
+            retrieved_old_memory = self._old_memories(existing_memories)
+
+            actions, temp_uuid_mapping = self._get_memory_actions(retrieved_old_memory, new_retrieved_facts)
             returned_memories = []
 
-            for resp in new_memories_with_actions["memory"]:
-                data = resp["text"]
-                if resp["event"] == "ADD":
-                    memory_id = self.client._create_memory_update_memory(
-                        user_id=user_id, data=data, embedding=new_message_embeddings[data], metadata=metadata
-                    )
-                    returned_memories.append({"id": memory_id, "memory": data, "event": resp["event"]})
-
-                elif resp["event"] == "UPDATE":
-                    self.client._create_memory_update_memory(
-                        user_id=user_id,
-                        memory_id=temp_uuid_mapping[resp["id"]],
-                        data=data,
-                        embedding=new_message_embeddings[data],
-                        metadata=metadata,
-                    )
-                    returned_memories.append(
-                        {
-                            "id": temp_uuid_mapping[resp["id"]],
-                            "memory": data,
-                            "event": resp["event"],
-                            "previous_memory": resp["old_memory"],
-                        }
-                    )
-
-                elif resp["event"] == "NONE":
-                    print("NOOP for Memory.")
+            for write, memory in self._plan_memory_writes(actions, temp_uuid_mapping, new_message_embeddings, user_id):
+                memory_id = self.client._create_memory_update_memory(**write)
+                if memory["event"] == "ADD":
+                    memory["id"] = memory_id
+                returned_memories.append(memory)
 
             print("returned memories are ",returned_memories)
             return returned_memories
         except:
             traceback.print_exc()
 
+    async def aadd_memory(self, messages, user_id, client):
+        """
+        Async variant of add_memory.
+        :param client: An async vector store client (see get_async_vector_store).
+        :return: A list of returned memories with their details.
+        """
+        try:
+            if not user_id:
+                return "userid is an obligatory to save memory"
+
+            new_retrieved_facts = await asyncio.to_thread(self._extract_facts, messages)
+            if not new_retrieved_facts:
+                logger.info("no facts to remember")
+                return []
+
+            new_message_embeddings = await asyncio.to_thread(self._embed_facts, new_retrieved_facts)
+            existing_memories = await client._retrieve_memories(
+                user_id, [new_message_embeddings[fact][0] for fact in new_retrieved_facts]
+            )
+            retrieved_old_memory = self._old_memories(existing_memories)
+
+            actions, temp_uuid_mapping = await asyncio.to_thread(
+                self._get_memory_actions, retrieved_old_memory, new_retrieved_facts
+            )
+            returned_memories = []
 
+            for write, memory in self._plan_memory_writes(actions, temp_uuid_mapping, new_message_embeddings, user_id):
+                memory_id = await client._create_memory_update_memory(**write)
+                if memory["event"] == "ADD":
+                    memory["id"] = memory_id
+                returned_memories.append(memory)
 
+            logger.info(f"returned memories are {returned_memories}")
+            return returned_memories
+        except:
+            traceback.print_exc()
@@ -0,0 +1,195 @@
+import os
+import time
+import sqlite3
+import threading
+import traceback
+import logging
+from contextlib import closing
+from dotenv import load_dotenv
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+MEMORY_QUEUE_PATH = os.getenv("MEMORY_QUEUE_PATH", "./memory_queue.db")
+# number of background memory writer threads per process, 0 saves memories inline with the request
+MEMORY_WORKERS = int(os.getenv("MEMORY_WORKERS", 2))
+# a job claimed longer ago than this is considered abandoned (crashed worker) and is run again
+MEMORY_JOB_LEASE = int(os.getenv("MEMORY_JOB_LEASE", 600))
+MAX_ATTEMPTS = 3
+POLL_INTERVAL = 1.0
+
+
+class MemoryQueue:
+    """
+    Persistent queue of (user_id, message) memory jobs in a SQLite file shared by all
+    the app processes. Jobs survive restarts and a job is only handed out when no
+    other job of the same user is running, so the memories of a user are written in order.
+    """
+
+    def __init__(self, path=MEMORY_QUEUE_PATH, lease=MEMORY_JOB_LEASE):
+        self.path = path
+        self.lease = lease
+        with closing(self._connect()) as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id NOT NULL,
+                    message TEXT NOT NULL,
+                    enqueued_at REAL NOT NULL,
+                    claimed_at REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0
+                )""")
+            connection.execute("CREATE INDEX IF NOT EXISTS jobs_user ON jobs (user_id, claimed_at)")
+            connection.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value REAL NOT NULL)")
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.execute("PRAGMA busy_timeout=30000")
+        return connection
+
+    def enqueue(self, user_id, message):
+        with closing(self._connect()) as connection:
+            cursor = connection.execute(
+                "INSERT INTO jobs (user_id, message, enqueued_at) VALUES (?, ?, ?)",
+                (user_id, message, time.time()))
+            return cursor.lastrowid
+
+    def claim(self):
+        """
+        Marks the oldest job whose user has no job in flight as running.
+        :return: A (job_id, user_id, message, enqueued_at) tuple or None when there is nothing to do.
+        """
+        now = time.time()
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            # jobs of a worker that died while running them
+            connection.execute("UPDATE jobs SET claimed_at = NULL WHERE claimed_at < ?", (now - self.lease,))
+            job = connection.execute("""
+                SELECT id, user_id, message, enqueued_at FROM jobs
+                WHERE claimed_at IS NULL
+                  AND user_id NOT IN (SELECT user_id FROM jobs WHERE claimed_at IS NOT NULL)
+                ORDER BY id LIMIT 1""").fetchone()
+            if job:
+                connection.execute("UPDATE jobs SET claimed_at = ?, attempts = attempts + 1 WHERE id = ?", (now, job[0]))
+            connection.execute("COMMIT")
+            return job
+        except:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+
+    def complete(self, job_id, enqueued_at):
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            self._add_stat(connection, "processed", 1)
+            self._add_stat(connection, "total_lag", time.time() - enqueued_at)
+            connection.execute("COMMIT")
+
+    def fail(self, job_id, max_attempts=MAX_ATTEMPTS):
+        """Releases a failed job for a retry, or drops it once it has used all its attempts."""
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            attempts = connection.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if attempts and attempts[0] >= max_attempts:
+                connection.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+                self._add_stat(connection, "failed", 1)
+                logger.error(f"memory job {job_id} dropped after {attempts[0]} attempts")
+            else:
+                connection.execute("UPDATE jobs SET claimed_at = NULL WHERE id = ?", (job_id,))
+                self._add_stat(connection, "retried", 1)
+            connection.execute("COMMIT")
+
+    @staticmethod
+    def _add_stat(connection, name, value):
+        connection.execute(
+            "INSERT INTO stats (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, value))
+
+    def metrics(self):
+        """Queue depth, lag of the oldest waiting job and the processed/failed counters of all processes."""
+        now = time.time()
+        with closing(self._connect()) as connection:
+            pending, running, oldest = connection.execute("""
+                SELECT SUM(claimed_at IS NULL), SUM(claimed_at IS NOT NULL), MIN(enqueued_at) FROM jobs""").fetchone()
+            stats = dict(connection.execute("SELECT name, value FROM stats").fetchall())
+        processed = int(stats.get("processed", 0))
+        return {
+            "depth": (pending or 0) + (running or 0),
+            "pending": pending or 0,
+            "running": running or 0,
+            "oldest_job_lag_seconds": round(now - oldest, 3) if oldest else 0.0,
+            "processed": processed,
+            "failed": int(stats.get("failed", 0)),
+            "retried": int(stats.get("retried", 0)),
+            "average_lag_seconds": round(stats.get("total_lag", 0.0) / processed, 3) if processed else 0.0,
+        }
+
+
+class MemoryWriter:
+    """
+    Background threads saving the memories of the queued messages after the response is sent.
+
+    :param save: function(message, user_id) doing the memory extraction and write, it should
+                 raise or return None when the write failed so the job is retried.
+    """
+
+    def __init__(self, save, queue=None, workers=MEMORY_WORKERS):
+        self.save = save
+        self.queue = queue or MemoryQueue()
+        self.workers = workers
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.threads = []
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"memory-writer-{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logger.info(f"memory writer started with {self.workers} threads, queue at {self.queue.path}")
+        return self
+
+    def stop(self, timeout=None):
+        self.stopped.set()
+        self.wakeup.set()
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def submit(self, user_id, message):
+        job_id = self.queue.enqueue(user_id, message)
+        self.wakeup.set()
+        return job_id
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                job = self.queue.claim()
+            except Exception:
+                traceback.print_exc()
+                job = None
+            if job is None:
+                self.wakeup.wait(POLL_INTERVAL)
+                self.wakeup.clear()
+                continue
+            self._process(*job)
+
+    def _process(self, job_id, user_id, message, enqueued_at):
+        try:
+            if self.save(message, user_id) is None:
+                raise RuntimeError("memory write returned no result")
+            self.queue.complete(job_id, enqueued_at)
+        except Exception:
+            traceback.print_exc()
+            logger.warning(f"memory job {job_id} of user {user_id} failed")
+            self.queue.fail(job_id)
+
+    def metrics(self):
+        metrics = self.queue.metrics()
+        metrics["workers"] = sum(thread.is_alive() for thread in self.threads)
+        return metrics
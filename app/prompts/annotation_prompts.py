@@ -129,4 +129,43 @@ If none of the values seem appropriate or relevant put empty_string ("") in the
   "selected_value": "[The selected value]",
   "confidence_score": [A score between 0 and 1 indicating confidence],
 }}
-"""
\ No newline at end of file
+"""
+
+STRUCTURED_ANNOTATION_PROMPT = """
+## TASK:
+Build the annotation query JSON answering the query, using only the schema.
+
+### Query: {query}
+
+### Schema:
+{schema}
+
+### RULES:
+1. Identify the relevant nodes and their properties based on the schema.
+2. Connect the nodes with relationships from the schema to achieve the query, the direction is strict (source)-[predicate]->(target).
+3. Generate unique `node_id`s for each node in the format "label_X" and include every node used by a predicate in "nodes".
+4. Include any specific IDs mentioned in the query in `id`, otherwise use an empty string.
+5. Only add property keys if mentioned in the query, never grab a property value from the schema.
+6. Never infer an id from your knowledge and do not invent or reverse relationships.
+
+### Response format (JSON):
+{{
+  "nodes": [
+    {{
+      "node_id": "label_1",
+      "id": "id_or_empty_string",
+      "type": "label",
+      "properties": {{
+        "key": "value"
+      }}
+    }}
+  ],
+  "predicates": [
+    {{
+      "type": "predicate",
+      "source": "label_1",
+      "target": "label_2"
+    }}
+  ]
+}}
+"""
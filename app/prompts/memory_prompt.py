@@ -143,3 +143,38 @@ def get_update_memory_messages(retrieved_old_memory_dict, response_content):
         ]
     }}
     """
+
+
+def get_memory_compaction_messages(clusters):
+    return f"""You are a smart memory manager. Each group below holds memories of the same user that say nearly the same thing.
+    Merge every group into a single memory that keeps all the distinct details of its memories and drops the repetitions.
+
+    **Guidelines**:
+    1. Keep the language and wording of the original memories as much as possible.
+    2. If memories of a group contradict each other, keep the later one (memories are listed oldest first).
+    3. Do not add information that is not in the memories.
+
+    **Example**:
+        - Groups: `[{{ "group": 0, "memories": ["BCL-2 gene is associated with apoptosis", "BCL-2 gene apoptosis"] }}]`
+        - Merged Memories:
+          ```json
+          {{
+              "memories": [
+                  {{ "group": 0, "text": "BCL-2 gene is associated with apoptosis" }}
+              ]
+          }}
+          ```
+
+    Groups:
+    ```
+    {clusters}
+    ```
+
+    Return one merged memory per group as a JSON object:
+    ```json
+    {{
+        "memories": [
+            {{ "group": 0, "text": "..." }}
+        ]
+    }}
+    """
@@ -6,11 +6,10 @@ from app.llm_handle.llm_models import (
     gemini_embedding_model,
 )
 from app.memory_layer import MemoryManager
-from PyPDF2 import PdfReader
 import traceback
+import asyncio
 import os
 import numpy as np
-import pandas as pd
 import logging
 import re
 import json
@@ -55,6 +54,8 @@ class RAG:
     def extract_preprocess_pdf(self,pdf, file_name):
         logger.info("Extracting text using PyPDF2...")
         try:
+            from PyPDF2 import PdfReader
+
             reader = PdfReader(pdf)
             docs = []
             for page in reader.pages:
@@ -69,7 +70,7 @@ class RAG:
         except Exception as e:
             traceback.print_exc()
 
-    def chunking_data(self, datas) -> pd.DataFrame:
+    def chunking_data(self, datas) -> "pd.DataFrame":
         """
         This function is a placeholder for data chunking implementation, 
         which will handle dynamic chunking of various types of documents.
@@ -78,7 +79,9 @@ class RAG:
         :return: DataFrame with chunked data 
         """
         """Process documents to ensure each chunk has at most self.max_token."""
-        
+        # pandas is only needed when documents are ingested, not to serve queries
+        import pandas as pd
+
         if isinstance(datas, list) and all(isinstance(d, dict) for d in datas):
             return pd.DataFrame(datas)
         '''
@@ -99,7 +102,7 @@ class RAG:
         df =pd.DataFrame({"content":result})
         return df
     
-    def get_contents_embed(self, df) -> pd.DataFrame:
+    def get_contents_embed(self, df) -> "pd.DataFrame":
         """
         Generates dense embeddings for the content column of the provided DataFrame.
 
@@ -179,6 +182,25 @@ class RAG:
             traceback.print_exc()
             return_response["text"] = "Error uploading your document."
 
+    def embed_query(self, query_str):
+        """
+        Generates the dense embedding of a query.
+
+        :param query_str: The query string to embed.
+        :return: The embedding vector or None if the embedding failed.
+        """
+        logger.info("Query embedding started.")
+        if isinstance(query_str, str):
+            query_str = [query_str]
+
+        embeddings = self.embedding_model(query_str)
+        if not embeddings or len(embeddings) == 0:
+            logger.error("Failed to generate dense embeddings for the query.")
+            return None
+
+        embed = np.array(embeddings)
+        return embed.reshape(-1, self.embedding_size).tolist()[0]
+
     def query(self, query_str: str, user_id=None,collection=VECTOR_COLLECTION, filter=None):
         """
         Processes a query string by generating its embeddings and retrieving related content 
@@ -192,26 +214,17 @@ class RAG:
             if filter:
                 collection=USERS_PDF_COLLECTION
 
-            logger.info("Query embedding started.")
-            if isinstance(query_str, str):
-                query_str = [query_str]  
-
-            query = {}
-            embeddings = self.embedding_model(query_str)
-            if not embeddings or len(embeddings) == 0:
-                logger.error("Failed to generate dense embeddings for the query.")
+            dense = self.embed_query(query_str)
+            if dense is None:
                 return None
 
-            embed = np.array(embeddings)
-            query["dense"] = embed.reshape(-1, self.embedding_size).tolist()[0]
-
-            result = self.client.retrieve_data(collection, query["dense"],user_id,filter)
+            result = self.client.retrieve_data(collection, dense,user_id,filter)
             logger.warning("results found for the query.")
             return result
         except Exception as e:
             logger.error(f"An error occurred during query processing: {e}")
             traceback.print_exc()
-            return {}
+            return []
 
     def get_result_from_rag(self, query_str: str, user_id: str):
         """
@@ -226,7 +239,7 @@ class RAG:
             logger.info("Generating result for the query.")
             result1 = self.query(query_str=query_str, user_id=user_id)
             result2 = self.query(query_str=query_str, user_id=user_id,filter=True)
-            query_result = {**result1, **result2}
+            query_result = (result1 or []) + (result2 or [])
             if query_result is None:
                 logger.error("No query result to process.")
                 return None
@@ -242,3 +255,34 @@ class RAG:
             logger.error(f"An error occurred while generating the result: {e}")
             traceback.print_exc()
             return None
+
+    async def aget_result_from_rag(self, query_str: str, user_id: str, client):
+        """
+        Async variant of get_result_from_rag. The query is embedded once and the
+        site and PDF collections are searched concurrently.
+
+        :param query_str: The query string to process.
+        :param user_id: The ID of the user making the request.
+        :param client: An async vector store client (see get_async_vector_store).
+        :return: The result from the LLM generated based on the query and retrieved content.
+        """
+        try:
+            logger.info("Generating result for the query.")
+            dense = await asyncio.to_thread(self.embed_query, query_str)
+            if dense is None:
+                return None
+
+            result1, result2 = await asyncio.gather(
+                client.retrieve_data(VECTOR_COLLECTION, dense, user_id),
+                client.retrieve_data(USERS_PDF_COLLECTION, dense, user_id, True),
+            )
+            query_result = (result1 or []) + (result2 or [])
+
+            prompt = RETRIEVE_PROMPT.format(query=query_str, retrieved_content=query_result)
+            result = await asyncio.to_thread(self.llm.generate, prompt)
+            logger.info("Result generated successfully.")
+            return {"text": result}
+        except Exception as e:
+            logger.error(f"An error occurred while generating the result: {e}")
+            traceback.print_exc()
+            return None
@@ -0,0 +1,104 @@
+from app.rag.rag import RAG, VECTOR_COLLECTION
+from app.storage.vector_store import build_payloads, to_json_value
+import numpy as np
+import fcntl
+import json
+import logging
+import os
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+SAMPLE_DATA_PATH = 'sample_data.json'
+WARM_START_PATH = os.getenv("WARM_START_PATH", "./warm_start")
+
+
+def artifact_paths(path=WARM_START_PATH, collection_name=VECTOR_COLLECTION):
+    """Paths of the precomputed vectors (.npy) and of their ids and payloads (.json)."""
+    return os.path.join(path, f"{collection_name}.npy"), os.path.join(path, f"{collection_name}.json")
+
+
+def build_artifact(rag: RAG, data_path=SAMPLE_DATA_PATH, path=WARM_START_PATH, collection_name=VECTOR_COLLECTION):
+    """
+    Embeds the sample data once and saves the vectors and payloads for the warm start.
+
+    :param rag: RAG instance whose chunking and embedding model are used.
+    :return: The number of points written.
+    """
+    with open(data_path) as data:
+        data = json.load(data)
+
+    df = rag.chunking_data(data)
+    df["filename"] = None
+    df = rag.get_contents_embed(df)
+    if df is None:
+        raise RuntimeError("Embedding the sample data failed")
+    payloads = build_payloads(df)
+    vectors = np.asarray(df["dense"].tolist(), dtype=np.float32)
+
+    os.makedirs(path, exist_ok=True)
+    vectors_path, meta_path = artifact_paths(path, collection_name)
+    np.save(vectors_path, vectors)
+    with open(meta_path, "w", encoding="utf-8") as file:
+        json.dump({
+            "collection": collection_name,
+            "embedding_model": rag.embedding_model.__name__,
+            "dimension": vectors.shape[1],
+            "ids": df["id"].tolist(),
+            "payloads": payloads,
+        }, file, default=to_json_value)
+    logger.info(f"warm start artifact with {len(vectors)} points written to {path}")
+    return len(vectors)
+
+
+def restore_artifact(client, rag: RAG, path=WARM_START_PATH, collection_name=VECTOR_COLLECTION):
+    """
+    Bulk loads the precomputed vectors into the vector store without calling the embedding API.
+
+    :return: True if the artifact was restored, False if it is missing or built for another embedding model.
+    """
+    vectors_path, meta_path = artifact_paths(path, collection_name)
+    if not (os.path.exists(vectors_path) and os.path.exists(meta_path)):
+        logger.warning(f"no warm start artifact found in {path}")
+        return False
+
+    with open(meta_path, "r", encoding="utf-8") as file:
+        meta = json.load(file)
+    if meta["embedding_model"] != rag.embedding_model.__name__ or meta["dimension"] != rag.embedding_size:
+        logger.warning(f"warm start artifact was built with {meta['embedding_model']}, "
+                       f"the configured model is {rag.embedding_model.__name__}")
+        return False
+
+    vectors = np.load(vectors_path, mmap_mode="r")
+    client.upsert_points(collection_name, meta["ids"], vectors, meta["payloads"])
+    logger.info(f"restored {len(vectors)} points into {collection_name} from the warm start artifact")
+    return True
+
+
+def warm_start(client, llm, path=WARM_START_PATH):
+    """
+    Populates an empty vector store with the sample web data.
+
+    Every gunicorn worker calls this while importing the app, a file lock makes sure
+    only the first one loads the data and the others find the collections in place.
+    The data is restored from the artifact of `python -m helper.build_warm_start`,
+    the sample data is only embedded again when there is no usable artifact.
+    """
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, ".lock"), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if client.list_collections():
+                logger.info("collections on the vector database already exist skipping population data")
+                return
+
+            rag = RAG(client, llm)
+            if restore_artifact(client, rag, path):
+                return
+
+            logger.info('uploading sample web data to the vector database')
+            with open(SAMPLE_DATA_PATH) as data:
+                data = json.load(data)
+            rag.save_doc_to_rag(data=data)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
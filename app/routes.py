@@ -1,4 +1,7 @@
 from app.lib.auth import token_required
+from app.memory_filter import memory_prefilter
+from app.storage.memory_cache import memory_cache
+from app.lib.annotation_client import annotation_client
 from flask import Blueprint, request, current_app,jsonify
 from dotenv import load_dotenv
 import traceback
@@ -66,4 +69,43 @@ def process_query(current_user_id, auth_token):
         current_app.logger.error(f"Exception: {e}")
         traceback.print_exc()
         return f"Bad Response: {e}", 400
- 
\ No newline at end of file
+ 
+
+
+@main_bp.route('/memory/metrics', methods=['GET'])
+@token_required
+def memory_metrics(current_user_id, auth_token):
+    """
+    Queue depth, lag and processed/failed counts of the background memory writer
+    and the skip rate of the memory prefilter and hit rate of the memory cache of this worker.
+    """
+    memory_writer = current_app.config['ai_assistant'].memory_writer
+    metrics = memory_writer.metrics() if memory_writer is not None else {"writer": "disabled (MEMORY_WORKERS=0)"}
+    metrics["prefilter"] = memory_prefilter.stats()
+    metrics["cache"] = memory_cache.stats()
+    return jsonify(metrics)
+
+
+@main_bp.route('/annotation/<graph_id>/cache', methods=['DELETE'])
+@token_required
+def invalidate_annotation_cache(current_user_id, auth_token, graph_id):
+    """Drops the cached answers of an annotation for the current user, e.g. after it was edited."""
+    removed = current_app.config['ai_assistant'].graph_summarizer.invalidate_annotation(graph_id, current_user_id)
+    return jsonify({"removed": removed})
+
+
+@main_bp.route('/annotation/metrics', methods=['GET'])
+@token_required
+def annotation_metrics(current_user_id, auth_token):
+    """
+    Latency histograms of the annotation service calls made by this worker, per "METHOD endpoint",
+    with the prompt tokens saved by schema slicing and the hit rate of the annotation answer cache.
+    """
+    annotation_graph = current_app.config['ai_assistant'].annotation_graph
+    metrics = annotation_client.metrics()
+    if annotation_graph.schema_slicer is not None:
+        metrics["schema_slicer"] = annotation_graph.schema_slicer.stats()
+    answer_cache = current_app.config['ai_assistant'].graph_summarizer.answer_cache
+    if answer_cache is not None:
+        metrics["answer_cache"] = answer_cache.stats()
+    return jsonify(metrics)
@@ -0,0 +1,205 @@
+
+import asyncio
+import os
+import traceback
+import uuid
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.http import models
+from dotenv import load_dotenv
+from app.storage.qdrant import (
+    CollectionProfiles, load_collection_profiles, user_filter, memory_filter, memory_payload,
+    memory_search_requests, memory_records,
+)
+from app.storage.vector_store import (
+    MAX_MEMORY_LIMIT, USER_COLLECTION, QDRANT_MAX_CONCURRENCY,
+    SITE_PAYLOAD_FIELDS, PDF_PAYLOAD_FIELDS, MEMORY_PAYLOAD_FIELDS, SearchHit, build_payloads,
+)
+from app.storage.memory_cache import memory_cache
+
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+
+class AsyncQdrant(CollectionProfiles):
+    """
+    Async variant of the Qdrant wrapper built on AsyncQdrantClient.
+
+    The client's connections belong to the event loop that uses them, so an instance
+    is meant to live for one request: `async with AsyncQdrant() as client: ...`.
+    At most `max_concurrency` calls are in flight at the same time.
+    """
+
+    def __init__(self, max_concurrency=QDRANT_MAX_CONCURRENCY):
+        self.profiles, self.collection_profiles = load_collection_profiles()
+        self.client = AsyncQdrantClient(os.environ.get('QDRANT_CLIENT','http://localhost:6333'))
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        await self.client.close()
+
+    async def list_collections(self):
+        async with self.semaphore:
+            collections = await self.client.get_collections()
+        return [collection.name for collection in collections.collections]
+
+    async def get_create_collection(self, collection_name):
+        async with self.semaphore:
+            try:
+                await self.client.get_collection(collection_name)
+            except:
+                logger.info("no such collection exists")
+                try:
+                    await self.client.create_collection(collection_name, **self.collection_config(collection_name))
+                except:
+                    traceback.print_exc()
+                    logger.info("error creating a collection")
+
+    async def upsert_data(self, collection_name, df, user_id=None):
+        try:
+            payloads_list = build_payloads(df, user_id)
+            await self.get_create_collection(collection_name)
+            async with self.semaphore:
+                await self.client.upsert(
+                    collection_name=collection_name,
+                    points=models.Batch(
+                        ids=df["id"].tolist(),
+                        vectors=df["dense"].tolist(),
+                        payloads=payloads_list,
+                    ),
+                )
+            logger.info("Embedding saved")
+            return "Data Successfully Uploaded"
+        except Exception as e:
+            traceback.print_exc()
+            logger.error(f"Error saving: {e}")
+
+    async def retrieve_data(self, collection, query, user_id, filter=None, limit=10):
+        try:
+            if filter:
+                async with self.semaphore:
+                    result = await self.client.search(
+                        collection_name=collection,
+                        query_vector=query,
+                        with_payload=PDF_PAYLOAD_FIELDS,
+                        score_threshold=0.3,
+                        search_params=self.search_params(collection),
+                        query_filter=user_filter(user_id),
+                        limit=limit)
+                return [
+                    SearchHit(None, point.score, point.payload.get('content', 'No content available'))
+                    for point in result
+                ]
+
+            async with self.semaphore:
+                result = await self.client.search(
+                    collection_name=collection,
+                    query_vector=query,
+                    with_payload=SITE_PAYLOAD_FIELDS,
+                    score_threshold=0.3,
+                    search_params=self.search_params(collection),
+                    limit=limit)
+            return [
+                SearchHit(point.id, point.score,
+                          point.payload.get('content', 'No content available'),
+                          point.payload.get('authors', 'Unknown'))
+                for point in result
+            ]
+        except:
+            traceback.print_exc()
+            return []
+
+    async def _create_memory_update_memory(self, user_id, data, embedding, metadata, memory_id=None):
+
+        await self.get_create_collection(USER_COLLECTION)
+
+        data = memory_payload(user_id, data)
+        if memory_id:
+            async with self.semaphore:
+                await self.client.upsert(
+                    collection_name=USER_COLLECTION,
+                    points=models.Batch(ids=[memory_id], vectors=embedding, payloads=data))
+            memory_cache.invalidate(user_id)
+            return memory_id
+        try:
+            async with self.semaphore:
+                memories, _ = await self.client.scroll(
+                    USER_COLLECTION, scroll_filter=user_filter(user_id),
+                    with_payload=["created_at_updated_at"], limit=100)
+            if len(memories) >= MAX_MEMORY_LIMIT:
+                oldest_memory = min(memories, key=lambda memory: memory.payload["created_at_updated_at"])
+                await self._delete_memory(oldest_memory.id)
+                logger.info(f"older memory is being deleted since you have reached the limit {MAX_MEMORY_LIMIT}")
+
+            logger.info("uploading new memory")
+            memory_id = [str(uuid.uuid4())]
+            async with self.semaphore:
+                await self.client.upsert(
+                    collection_name=USER_COLLECTION,
+                    points=models.Batch(ids=memory_id, vectors=embedding, payloads=data))
+            logger.info("collection updated")
+            memory_cache.invalidate(user_id)
+            return memory_id
+        except:
+            traceback.print_exc()
+
+    async def _delete_memory(self, memory_id):
+        async with self.semaphore:
+            await self.client.delete(
+                collection_name=USER_COLLECTION,
+                points_selector=models.PointIdsList(points=[memory_id]))
+        memory_cache.invalidate_memory(memory_id)
+        return None
+
+    async def _retrieve_memory(self, user_id, embedding=None, limit=1):
+        try:
+            if embedding:
+                async with self.semaphore:
+                    result = await self.client.search(
+                        collection_name=USER_COLLECTION,
+                        query_vector=embedding,
+                        with_payload=MEMORY_PAYLOAD_FIELDS,
+                        score_threshold=0.5,
+                        search_params=self.search_params(USER_COLLECTION),
+                        query_filter=memory_filter(user_id),
+                        limit=limit)
+                return memory_records(result)
+
+            # read before the vector store, a snapshot read before a concurrent write is not cached
+            generation = memory_cache.generation(user_id)
+            memories = memory_cache.get(user_id, generation)
+            if memories is None:
+                async with self.semaphore:
+                    data, _ = await self.client.scroll(
+                        collection_name=USER_COLLECTION,
+                        scroll_filter=user_filter(user_id),
+                        limit=100,
+                        with_payload=["content"],
+                        with_vectors=False)
+                memories = [(record.id, record.payload['content']) for record in data[::-1]]
+                memory_cache.put(user_id, memories, generation)
+            return [content for _, content in memories]
+        except:
+            traceback.print_exc()
+            return None
+
+    async def _retrieve_memories(self, user_id, embeddings, limit=1):
+        if not embeddings:
+            return []
+        try:
+            async with self.semaphore:
+                results = await self.client.search_batch(
+                    collection_name=USER_COLLECTION,
+                    requests=memory_search_requests(user_id, embeddings, self.search_params(USER_COLLECTION), limit))
+            return [memory_records(result) for result in results]
+        except:
+            traceback.print_exc()
+            return [[] for _ in embeddings]
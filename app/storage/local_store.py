@@ -0,0 +1,428 @@
+
+from datetime import datetime
+import os
+import json
+import fcntl
+import time
+import threading
+import traceback
+import uuid
+import numpy as np
+from dotenv import load_dotenv
+from app.storage.vector_store import (
+    MAX_MEMORY_LIMIT, USER_COLLECTION, USER_MEMORY_NAME, SearchHit, MemoryRecord, build_payloads, to_json_value,
+)
+from app.storage.memory_cache import memory_cache
+
+import logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+LOCAL_VECTOR_STORE_PATH = os.getenv("LOCAL_VECTOR_STORE_PATH", "./vector_store")
+INITIAL_CAPACITY = 1024
+# payload fields that get an inverted index for filtering
+INDEXED_FIELDS = ("user_id", "status")
+
+
+class LocalCollection:
+    """
+    One collection kept on disk as a memory-mapped float32 matrix (<name>.f32) and
+    its ids and payloads (<name>.json). Deleted rows are left as holes and dropped
+    the next time the matrix grows.
+
+    Every process maps the same files, writes are serialized with a file lock and
+    readers reload when another process has written.
+    """
+
+    def __init__(self, path, name):
+        self.name = name
+        self.vectors_path = os.path.join(path, f"{name}.f32")
+        self.meta_path = os.path.join(path, f"{name}.json")
+        self.lock_path = os.path.join(path, f"{name}.lock")
+        self.lock = threading.RLock()
+        self.meta_version = None
+        self.dimension = None
+        self.capacity = 0
+        self.ids = []
+        self.payloads = []
+        self.vectors = None
+        self._reload()
+        if self.meta_version is None:
+            self._build_indexes()
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.meta_path)
+            return (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            return None
+
+    def _reload(self):
+        version = self._stat()
+        if version is None or version == self.meta_version:
+            return
+        with open(self.meta_path, "r", encoding="utf-8") as file:
+            meta = json.load(file)
+        self.dimension = meta["dimension"]
+        self.capacity = meta["capacity"]
+        self.ids = meta["ids"]
+        self.payloads = meta["payloads"]
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(self.capacity, self.dimension))
+        self.meta_version = version
+        self._build_indexes()
+
+    def _build_indexes(self):
+        self.rows = {}
+        self.alive = np.zeros(self.capacity, dtype=bool)
+        self.indexes = {field: {} for field in INDEXED_FIELDS}
+        for row, point_id in enumerate(self.ids):
+            if point_id is None:
+                continue
+            self.rows[point_id] = row
+            self.alive[row] = True
+            self._index_payload(row, self.payloads[row])
+
+    def _index_payload(self, row, payload):
+        for field in INDEXED_FIELDS:
+            value = payload.get(field)
+            if value is not None:
+                self.indexes[field].setdefault(value, set()).add(row)
+
+    def _unindex_payload(self, row, payload):
+        for field in INDEXED_FIELDS:
+            rows = self.indexes[field].get(payload.get(field))
+            if rows:
+                rows.discard(row)
+
+    def _save(self):
+        self.vectors.flush()
+        temp_path = f"{self.meta_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump({
+                "dimension": self.dimension,
+                "capacity": self.capacity,
+                "ids": self.ids,
+                "payloads": self.payloads,
+            }, file, default=to_json_value)
+        os.replace(temp_path, self.meta_path)
+        self.meta_version = self._stat()
+
+    def _resize(self, required):
+        """Rewrites the matrix with only the live rows and room for `required` more."""
+        live = [row for row, point_id in enumerate(self.ids) if point_id is not None]
+        capacity = max(INITIAL_CAPACITY, 2 * (len(live) + required))
+        temp_path = f"{self.vectors_path}.tmp"
+        vectors = np.memmap(temp_path, dtype=np.float32, mode="w+", shape=(capacity, self.dimension))
+        if live:
+            vectors[:len(live)] = self.vectors[live]
+        vectors.flush()
+        del vectors
+        os.replace(temp_path, self.vectors_path)
+
+        self.ids = [self.ids[row] for row in live]
+        self.payloads = [self.payloads[row] for row in live]
+        self.capacity = capacity
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dimension))
+        self._build_indexes()
+
+    def write(self):
+        """Context manager holding the thread and process locks for a write."""
+        return _WriteLock(self)
+
+    def upsert(self, ids, vectors, payloads):
+        with self.write():
+            self._upsert_rows(ids, vectors, payloads)
+            self._save()
+
+    def delete(self, ids):
+        with self.write():
+            self._delete_rows(ids)
+            self._save()
+
+    def replace(self, delete_ids, ids, vectors, payloads):
+        """Deletes `delete_ids` and upserts the new points in a single write, readers see both or neither."""
+        with self.write():
+            self._delete_rows(delete_ids)
+            self._upsert_rows(ids, vectors, payloads)
+            self._save()
+
+    def _upsert_rows(self, ids, vectors, payloads):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+        if self.dimension is None:
+            self.dimension = vectors.shape[1]
+            self.vectors = np.zeros((0, self.dimension), dtype=np.float32)
+        elif vectors.shape[1] != self.dimension:
+            raise ValueError(f"Vector size {vectors.shape[1]} does not match collection {self.name} ({self.dimension})")
+
+        new_ids = [point_id for point_id in dict.fromkeys(ids) if point_id not in self.rows]
+        if len(self.ids) + len(new_ids) > self.capacity:
+            self._resize(len(new_ids))
+
+        for point_id, vector, payload in zip(ids, vectors, payloads):
+            row = self.rows.get(point_id)
+            if row is None:
+                row = len(self.ids)
+                self.ids.append(point_id)
+                self.payloads.append(payload)
+                self.rows[point_id] = row
+                self.alive[row] = True
+            else:
+                self._unindex_payload(row, self.payloads[row])
+                self.payloads[row] = payload
+            self.vectors[row] = vector
+            self._index_payload(row, payload)
+
+    def _delete_rows(self, ids):
+        for point_id in ids:
+            row = self.rows.pop(point_id, None)
+            if row is None:
+                continue
+            self._unindex_payload(row, self.payloads[row])
+            self.ids[row] = None
+            self.payloads[row] = None
+            self.alive[row] = False
+
+    def _mask(self, must):
+        count = len(self.ids)
+        mask = self.alive[:count].copy()
+        for field, value in (must or {}).items():
+            if field in self.indexes:
+                field_mask = np.zeros(count, dtype=bool)
+                field_mask[list(self.indexes[field].get(value, ()))] = True
+            else:
+                field_mask = np.array([payload is not None and payload.get(field) == value for payload in self.payloads], dtype=bool)
+            mask &= field_mask
+        return mask
+
+    def search(self, query, limit, score_threshold=None, must=None):
+        """Dot-product top-k over the live rows matching every field in `must`."""
+        return self.search_batch([query], limit, score_threshold, must)[0]
+
+    def search_batch(self, queries, limit, score_threshold=None, must=None):
+        """search for several queries with one matrix product, one result list per query."""
+        with self.lock:
+            self._reload()
+            count = len(self.ids)
+            if not count:
+                return [[] for _ in queries]
+            mask = self._mask(must)
+            all_scores = self.vectors[:count] @ np.asarray(queries, dtype=np.float32).T
+            results = []
+            for scores in all_scores.T:
+                query_mask = mask & (scores >= score_threshold) if score_threshold is not None else mask
+                candidates = np.flatnonzero(query_mask)
+                if len(candidates) > limit:
+                    top = np.argpartition(-scores[candidates], limit - 1)[:limit]
+                    candidates = candidates[top]
+                candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+                results.append([(self.ids[row], float(scores[row]), self.payloads[row]) for row in candidates])
+            return results
+
+    def scroll(self, must=None, limit=None, with_vectors=False):
+        """Live (id, payload) pairs, or (id, payload, vector) triples, matching `must` in insertion order."""
+        with self.lock:
+            self._reload()
+            if not self.ids:
+                return []
+            rows = np.flatnonzero(self._mask(must))[:limit]
+            if with_vectors:
+                return [(self.ids[row], self.payloads[row], np.array(self.vectors[row])) for row in rows]
+            return [(self.ids[row], self.payloads[row]) for row in rows]
+
+
+class _WriteLock:
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __enter__(self):
+        self.collection.lock.acquire()
+        self.file = open(self.collection.lock_path, "a")
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        self.collection._reload()
+        return self.collection
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+        self.collection.lock.release()
+
+
+class LocalVectorStore:
+    """
+    In-process vector store with the same interface as the Qdrant wrapper,
+    used when VECTOR_STORE=local so no vector database service is needed.
+    """
+    _collections = {}
+    _collections_lock = threading.Lock()
+
+    def __init__(self, path=LOCAL_VECTOR_STORE_PATH):
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+        logger.info(f"local vector store at {self.path}")
+
+    def list_collections(self):
+        return sorted(name[:-len(".json")] for name in os.listdir(self.path) if name.endswith(".json"))
+
+    def get_create_collection(self, collection_name):
+        key = (os.path.abspath(self.path), collection_name)
+        with self._collections_lock:
+            if key not in self._collections:
+                self._collections[key] = LocalCollection(self.path, collection_name)
+            return self._collections[key]
+
+    def upsert_data(self,collection_name,df,user_id=None):
+        try:
+            payloads_list = build_payloads(df, user_id)
+            collection = self.get_create_collection(collection_name)
+            collection.upsert(df["id"].tolist(), df["dense"].tolist(), payloads_list)
+            logger.info("Embedding saved")
+            return "Data Successfully Uploaded"
+
+        except Exception as e:
+            traceback.print_exc()
+            logger.error(f"Error saving: {e}")
+
+    def upsert_points(self, collection_name, ids, vectors, payloads, batch_size=None):
+        """Bulk upload of precomputed vectors (a float32 array) with their ids and payloads."""
+        self.get_create_collection(collection_name).upsert(ids, vectors, payloads)
+
+    def retrieve_data(self,collection, query,user_id,filter=None,limit=10):
+        try:
+            store = self.get_create_collection(collection)
+            if filter:
+                result = store.search(query, limit=limit, score_threshold=0.3, must={"user_id": user_id})
+                return [
+                    SearchHit(None, score, payload.get('content', 'No content available'))
+                    for _, score, payload in result
+                ]
+
+            result = store.search(query, limit=limit, score_threshold=0.3)
+            return [
+                SearchHit(point_id, score,
+                          payload.get('content', 'No content available'),
+                          payload.get('authors', 'Unknown'))
+                for point_id, score, payload in result
+            ]
+        except:
+            traceback.print_exc()
+            return []
+
+    def _create_memory_update_memory(self,user_id,data, embedding, metadata,memory_id=None):
+
+        store = self.get_create_collection(USER_COLLECTION)
+
+        current_time = datetime.utcnow().isoformat()
+        payload = {"content": data, "user_id": user_id, "created_at_updated_at": current_time,
+                   "updated_at": time.time(), "status":USER_MEMORY_NAME}
+        if memory_id:
+            store.upsert([memory_id], embedding, [payload])
+            memory_cache.invalidate(user_id)
+            return memory_id
+        try:
+            memories = store.scroll(must={"user_id": user_id})
+            if len(memories) >= MAX_MEMORY_LIMIT:
+                oldest_memory_id, _ = min(memories, key=lambda memory: memory[1]["created_at_updated_at"])
+                self._delete_memory(oldest_memory_id)
+                logger.info(f"older memory is being deleted since you have reached the limit {MAX_MEMORY_LIMIT}")
+
+            logger.info("uploading new memory")
+            memory_id = [str(uuid.uuid4())]
+            store.upsert(memory_id, embedding, [payload])
+            logger.info("collection updated")
+            memory_cache.invalidate(user_id)
+            return memory_id
+        except:
+            traceback.print_exc()
+
+    def _delete_memory(self, memory_id):
+        self.get_create_collection(USER_COLLECTION).delete([memory_id])
+        memory_cache.invalidate_memory(memory_id)
+        return None
+
+    def _retrieve_memory(self,user_id,embedding=None,limit=1):
+        try:
+            store = self.get_create_collection(USER_COLLECTION)
+            if embedding:
+                # score threshold of 0.5 will return a similiar memories with similiarity score of more than 0.5
+                result = store.search(embedding, limit=limit, score_threshold=0.5,
+                                      must={"user_id": user_id, "status": USER_MEMORY_NAME})
+                return [
+                    MemoryRecord(point_id, payload.get('content'), payload.get('created_at_updated_at'))
+                    for point_id, _, payload in result
+                ]
+            else:
+                # read before the vector store, a snapshot read before a concurrent write is not cached
+                generation = memory_cache.generation(user_id)
+                memories = memory_cache.get(user_id, generation)
+                if memories is None:
+                    data = store.scroll(must={"user_id": user_id}, limit=100)
+                    memories = [(point_id, payload['content']) for point_id, payload in data[::-1]]
+                    memory_cache.put(user_id, memories, generation)
+                return [content for _, content in memories]
+        except:
+            traceback.print_exc()
+            return None
+
+    def _retrieve_memories(self, user_id, embeddings, limit=1):
+        """
+        Similar memories of a user for several embeddings at once.
+        :return: A list of MemoryRecord lists, one per embedding in the same order.
+        """
+        if not embeddings:
+            return []
+        try:
+            results = self.get_create_collection(USER_COLLECTION).search_batch(
+                embeddings, limit=limit, score_threshold=0.5,
+                must={"user_id": user_id, "status": USER_MEMORY_NAME})
+            return [
+                [MemoryRecord(point_id, payload.get('content'), payload.get('created_at_updated_at'))
+                 for point_id, _, payload in result]
+                for result in results
+            ]
+        except:
+            traceback.print_exc()
+            return [[] for _ in embeddings]
+
+    def _memory_users_since(self, since=None):
+        """
+        Users with a memory written after `since` (epoch seconds), every user with memories when None.
+        The memories written by the compaction job itself are left out.
+        """
+        try:
+            memories = self.get_create_collection(USER_COLLECTION).scroll()
+            return {
+                payload.get("user_id") for _, payload in memories
+                if since is None or (payload.get("updated_at", 0) > since and not payload.get("compacted"))
+            }
+        except:
+            traceback.print_exc()
+            return set()
+
+    def _retrieve_memory_vectors(self, user_id):
+        """All the memories of a user with their vectors, as (MemoryRecord, vector) pairs."""
+        memories = self.get_create_collection(USER_COLLECTION).scroll(
+            must={"user_id": user_id, "status": USER_MEMORY_NAME}, with_vectors=True)
+        return [
+            (MemoryRecord(point_id, payload.get('content'), payload.get('created_at_updated_at')), vector)
+            for point_id, payload, vector in memories
+        ]
+
+    def _replace_memories(self, user_id, memory_ids, data, embeddings):
+        """
+        Replaces memories of a user with new ones in a single write.
+        :return: The ids of the new memories.
+        """
+        current_time = datetime.utcnow().isoformat()
+        new_ids = [str(uuid.uuid4()) for _ in data]
+        payloads = [
+            # compacted: written by the compaction job, not a new write of the user
+            {"content": content, "user_id": user_id, "created_at_updated_at": current_time,
+             "updated_at": time.time(), "status":USER_MEMORY_NAME, "compacted": True}
+            for content in data
+        ]
+        self.get_create_collection(USER_COLLECTION).replace(memory_ids, new_ids, embeddings, payloads)
+        memory_cache.invalidate(user_id)
+        return new_ids
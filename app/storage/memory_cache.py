@@ -0,0 +1,135 @@
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from functools import cached_property
+from dotenv import load_dotenv
+from app.lib.cache import SQLiteCache
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# number of users whose memories are kept in memory
+MEMORY_CACHE_SIZE = int(os.getenv("MEMORY_CACHE_SIZE", 1024))
+# seconds a snapshot is served at most, writes of every process are also seen through the user's generation
+MEMORY_CACHE_TTL = float(os.getenv("MEMORY_CACHE_TTL", 300))
+
+
+class MemoryCache:
+    """
+    LRU of the latest memories of each user, as (memory_id, content) pairs, so the
+    conversation prompt gets the user's memories without a vector store read per request.
+
+    Memory writes run on the writer threads of any worker process, so each user has a
+    generation counter in the shared SQLite cache file, incremented after every write or
+    delete of their memories. A snapshot is stamped with the generation read before the
+    vector store was read, and it is only served while that is still the user's generation,
+    whichever process made the write. A snapshot read before a write is never stored by put().
+    """
+
+    def __init__(self, max_users=MEMORY_CACHE_SIZE, ttl=MEMORY_CACHE_TTL):
+        self.max_users = max_users
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.snapshots = OrderedDict()
+        self.memory_users = {}
+        self.hits = 0
+        self.misses = 0
+
+    @cached_property
+    def generations(self):
+        # opened on first use, not when the module is imported
+        return SQLiteCache("memory_generations")
+
+    def generation(self, user_id):
+        """
+        The current generation of the user's memories, read it before reading them from the
+        vector store and pass it to put().
+        :return: The generation, None when the shared counter can not be read (nothing is cached then).
+        """
+        try:
+            return self.generations.counter(str(user_id))
+        except Exception as e:
+            logger.error(f"Unable to read the memory generation of {user_id}: {e}")
+            return None
+
+    def get(self, user_id, generation=None):
+        """
+        :param generation: generation() when the caller already read it, read here otherwise.
+        :return: The cached (memory_id, content) pairs of the user or None on a miss.
+        """
+        if generation is None:
+            generation = self.generation(user_id)
+        with self.lock:
+            entry = self.snapshots.get(user_id)
+        if entry is not None and entry[0] >= time.monotonic() and generation is not None and entry[2] == generation:
+            with self.lock:
+                if self.snapshots.get(user_id) is entry:
+                    self.snapshots.move_to_end(user_id)
+                self.hits += 1
+            return entry[1]
+        with self.lock:
+            if entry is not None and self.snapshots.get(user_id) is entry:
+                self._drop(user_id)
+            self.misses += 1
+        return None
+
+    def put(self, user_id, memories, generation):
+        """
+        Stores a snapshot of the user's memories.
+        :param generation: generation() read before the memories were read.
+        :return: False when the memories were written since, the snapshot is not stored.
+        """
+        if generation is None or generation != self.generation(user_id):
+            return False
+        with self.lock:
+            self._drop(user_id)
+            self.snapshots[user_id] = (time.monotonic() + self.ttl, list(memories), generation)
+            for memory_id, _ in memories:
+                self.memory_users[memory_id] = user_id
+            while len(self.snapshots) > self.max_users:
+                self._drop(next(iter(self.snapshots)))
+        return True
+
+    def invalidate(self, user_id):
+        """Called after a write or delete of the user's memories, in any process."""
+        try:
+            self.generations.increment(str(user_id))
+        except Exception as e:
+            logger.error(f"Unable to increment the memory generation of {user_id}: {e}")
+        with self.lock:
+            self._drop(user_id)
+
+    def invalidate_memory(self, memory_id):
+        """Drops the snapshot holding a memory, used when only the memory id is known."""
+        with self.lock:
+            user_id = self.memory_users.get(memory_id)
+        if user_id is not None:
+            self.invalidate(user_id)
+
+    def _drop(self, user_id):
+        entry = self.snapshots.pop(user_id, None)
+        if entry:
+            for memory_id, _ in entry[1]:
+                self.memory_users.pop(memory_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.snapshots.clear()
+            self.memory_users.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "users": len(self.snapshots),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+memory_cache = MemoryCache()
@@ -1,35 +1,172 @@
 
 from datetime import datetime
+import time
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
 import os
 import traceback
-import pandas as pd
 from typing import List
 from qdrant_client.models import PointStruct, PointIdsList
 from dotenv import load_dotenv
 import uuid
+import yaml
+from app.storage.vector_store import (
+    MAX_MEMORY_LIMIT, USER_COLLECTION, USER_MEMORY_NAME, VECTOR_SIZE,
+    SITE_PAYLOAD_FIELDS, PDF_PAYLOAD_FIELDS, MEMORY_PAYLOAD_FIELDS, SearchHit, MemoryRecord, build_payloads,
+)
+from app.storage.memory_cache import memory_cache
 
-MAX_MEMORY_LIMIT = 10
-MAX_PDF_LIMIT = 2
-USER_COLLECTION = os.getenv("USER_COLLECTION","USER_COLLECTIONS")
-USER_MEMORY_NAME = "user memories"
+CONFIG_PATH = './config/config.yaml'
+DEFAULT_PROFILE = "default"
 
 import logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 load_dotenv()
-class Qdrant:
+
+def load_collection_profiles(config_path=CONFIG_PATH):
+    """
+    Reads the collection profiles and the collection to profile mapping from the config file.
+    :return: A tuple of (profiles, collection name -> profile name).
+    """
+    try:
+        with open(config_path, 'r') as config_file:
+            config = yaml.safe_load(config_file) or {}
+    except Exception as e:
+        logger.warning(f"unable to read qdrant collection profiles from {config_path}: {e}")
+        config = {}
+    return config.get("QDRANT_COLLECTION_PROFILES") or {}, config.get("QDRANT_COLLECTIONS") or {}
+
+
+class CollectionProfiles:
+    """Applies the collection profiles of config.yaml, shared by the sync and async wrappers."""
+
+    def get_profile(self, collection_name, profile_name=None):
+        """
+        Returns the storage profile of a collection.
+        :param profile_name: overrides the profile configured for the collection.
+        """
+        profile_name = profile_name or self.collection_profiles.get(collection_name, DEFAULT_PROFILE)
+        if profile_name not in self.profiles:
+            logger.warning(f"unknown collection profile {profile_name}, using plain float32 vectors")
+            return {}
+        return self.profiles[profile_name]
+
+    def _quantization_config(self, profile):
+        quantization = profile.get("quantization")
+        if quantization == "scalar":
+            return models.ScalarQuantization(
+                scalar=models.ScalarQuantizationConfig(
+                    type=models.ScalarType.INT8,
+                    quantile=profile.get("quantile", 0.99),
+                    always_ram=True))
+        if quantization == "binary":
+            return models.BinaryQuantization(
+                binary=models.BinaryQuantizationConfig(always_ram=True))
+        if quantization:
+            raise ValueError(f"Unsupported quantization type: {quantization}")
+        return None
+
+    def _hnsw_config(self, profile):
+        hnsw = profile.get("hnsw")
+        if not hnsw:
+            return None
+        return models.HnswConfigDiff(
+            m=hnsw.get("m"),
+            ef_construct=hnsw.get("ef_construct"),
+            on_disk=hnsw.get("on_disk"))
+
+    def search_params(self, collection_name, profile_name=None):
+        """Search parameters that rescore quantized candidates with the original vectors."""
+        profile = self.get_profile(collection_name, profile_name)
+        if not profile.get("quantization"):
+            return None
+        return models.SearchParams(
+            quantization=models.QuantizationSearchParams(
+                rescore=profile.get("rescore", True),
+                oversampling=profile.get("oversampling")))
+
+    def collection_config(self, collection_name, profile_name=None):
+        """Keyword arguments of create_collection for the profile of a collection."""
+        profile = self.get_profile(collection_name, profile_name)
+        logger.info(f"creating collection {collection_name} with profile {profile_name or self.collection_profiles.get(collection_name, DEFAULT_PROFILE)}")
+        return {
+            "vectors_config": models.VectorParams(
+                size=VECTOR_SIZE,
+                distance=models.Distance.DOT,
+                on_disk=profile.get("on_disk", False)),
+            "quantization_config": self._quantization_config(profile),
+            "hnsw_config": self._hnsw_config(profile),
+        }
+
+
+def user_filter(user_id):
+    return models.Filter(must=[models.FieldCondition(key="user_id", match=models.MatchValue(value=user_id),),])
+
+
+def memory_filter(user_id):
+    return models.Filter(
+        must=[
+            models.FieldCondition(
+            key="user_id", match=models.MatchValue(value=user_id),),
+            models.FieldCondition(
+            key="status", match=models.MatchValue(value=USER_MEMORY_NAME),)
+            ],
+        )
+
+
+def memory_search_requests(user_id, embeddings, search_params, limit=1):
+    """One search request per embedding for the similar memories of a user, sent together with search_batch."""
+    return [
+        models.SearchRequest(
+            vector=embedding,
+            filter=memory_filter(user_id),
+            with_payload=MEMORY_PAYLOAD_FIELDS,
+            # score threshold of 0.5 will return a similiar memories with similiarity score of more than 0.5
+            score_threshold=0.5,
+            params=search_params,
+            limit=limit)
+        for embedding in embeddings
+    ]
+
+
+def memory_records(points):
+    return [
+        MemoryRecord(point.id, point.payload.get('content'), point.payload.get('created_at_updated_at'))
+        for point in points
+    ]
+
+
+def memory_payload(user_id, data, compacted=False):
+    """
+    :param compacted: marks memories written by the compaction job, which are not new writes of the user.
+    """
+    current_time = datetime.utcnow().isoformat()
+    # updated_at (epoch seconds) has a range index, for the users with writes since the last compaction pass
+    payload = {"content": data, "user_id": user_id, "created_at_updated_at": current_time,
+               "updated_at": time.time(), "status":USER_MEMORY_NAME}
+    if compacted:
+        payload["compacted"] = True
+    return [payload]
+
+
+class Qdrant(CollectionProfiles):
 
     def __init__(self):
 
+        self.profiles, self.collection_profiles = load_collection_profiles()
         try:
             self.client = QdrantClient(os.environ.get('QDRANT_CLIENT','http://localhost:6333'))
             print(f"qdrant connected")
         except:
             print('qdrant connection is failed')
 
+    def list_collections(self):
+        return [collection.name for collection in self.client.get_collections().collections]
+
+    def create_collection(self, collection_name, profile_name=None):
+        self.client.create_collection(collection_name, **self.collection_config(collection_name, profile_name))
 
     def get_create_collection(self,collection_name):
 
@@ -38,12 +175,7 @@ class Qdrant:
         except:
             print("no such collection exists")
             try:
-                logger.info(f"creating collection {collection_name}")
-                # Get vector size based on model type
-                vector_size = 1536
-                self.client.create_collection(
-                    collection_name,
-                    vectors_config=models.VectorParams(size=vector_size, distance=models.Distance.DOT) )
+                self.create_collection(collection_name)
                 print(f"Collection '{collection_name}' CREATED.")
             except:
                 traceback.print_exc()
@@ -52,23 +184,7 @@ class Qdrant:
 
     def upsert_data(self,collection_name,df,user_id=None):
                 try:
-                    excluded_columns = {"dense"}
-                    payload_columns = [col for col in df.columns if col not in excluded_columns]
-                    payloads_list = [
-                        {col: getattr(item, col) for col in payload_columns}
-                        for item in df.itertuples(index=False)
-                    ]
-
-                    if user_id:
-                        filename = df["filename"].to_list()[0]
-                        for payload in payloads_list:
-                            payload["user_id"] = user_id
-                            payload["id"] = f"{user_id}_{filename}"
-                        
-                    import random
-                    if 'id' not in df.columns:
-                        df['id'] = [random.randint(100000, 999999) for _ in range(len(df))]
-                    
+                    payloads_list = build_payloads(df, user_id)
                     self.get_create_collection(collection_name)
                     self.client.upsert(
                         collection_name=collection_name,
@@ -85,49 +201,60 @@ class Qdrant:
                     traceback.print_exc()
                     print("Error saving:", e)
             
-    def retrieve_data(self,collection, query,user_id,filter=None):
+    def upsert_points(self, collection_name, ids, vectors, payloads, batch_size=256):
+        """Bulk upload of precomputed vectors (a float32 array) with their ids and payloads."""
+        self.get_create_collection(collection_name)
+        self.client.upload_collection(
+            collection_name=collection_name,
+            vectors=vectors,
+            payload=payloads,
+            ids=ids,
+            batch_size=batch_size,
+            wait=True)
+
+    def retrieve_data(self,collection, query,user_id,filter=None,limit=10):
+        """
+        Searches a document collection.
+        :param filter: restricts the search to the documents uploaded by user_id.
+        :return: A list of SearchHit records.
+        """
         try:
             if filter:
                 result = self.client.search(
                         collection_name=collection,
                         query_vector=query,
-                        with_payload=True,
+                        with_payload=PDF_PAYLOAD_FIELDS,
                         score_threshold=0.3,
-                        query_filter= models.Filter(
-                                    must=[models.FieldCondition(key="user_id", match=models.MatchValue(value=user_id),),]),
-                        limit=10)
-                response = {}
-                for i, point in enumerate(result):
-                    response[i] = {
-                        "score": point.score,
-                        "content": point.payload.get('content', 'No content available')
-                    }
-                return response
+                        search_params=self.search_params(collection),
+                        query_filter=user_filter(user_id),
+                        limit=limit)
+                return [
+                    SearchHit(None, point.score, point.payload.get('content', 'No content available'))
+                    for point in result
+                ]
         
             result = self.client.search(
                     collection_name=collection,
                     query_vector=query,
-                    with_payload=True,
+                    with_payload=SITE_PAYLOAD_FIELDS,
                     score_threshold=0.3,
-                    limit=10)
-            response = {}
-            for i, point in enumerate(result):
-                response[i] = {
-                    "id": point.id,
-                    "score": point.score,
-                    "authors": point.payload.get('authors', 'Unknown'),
-                    "content": point.payload.get('content', 'No content available')
-                }
-            return response
+                    search_params=self.search_params(collection),
+                    limit=limit)
+            return [
+                SearchHit(point.id, point.score,
+                          point.payload.get('content', 'No content available'),
+                          point.payload.get('authors', 'Unknown'))
+                for point in result
+            ]
         except:
-            return {"error":"not found"}
+            traceback.print_exc()
+            return []
 
     def _create_memory_update_memory(self,user_id,data, embedding, metadata,memory_id=None):
 
         self.get_create_collection(USER_COLLECTION)
 
-        current_time = datetime.utcnow().isoformat()
-        data = [{"content": data, "user_id": user_id, "created_at_updated_at": current_time, "status":USER_MEMORY_NAME}]
+        data = memory_payload(user_id, data)
         if memory_id:
                 self.client.upsert(
                     collection_name=USER_COLLECTION,
@@ -135,10 +262,14 @@ class Qdrant:
                     ids=[memory_id],
                     vectors=embedding,
                     payloads=data,),)
+                memory_cache.invalidate(user_id)
                 return memory_id
         # check if a collection have top 10 collections
         try:
-            memories = self.client.scroll(USER_COLLECTION, with_payload=True)
+            # the memories of this user only, the limit applies per user
+            memories = self.client.scroll(
+                USER_COLLECTION, scroll_filter=user_filter(user_id),
+                with_payload=["created_at_updated_at"], limit=100)
             if len(memories[0]) >= MAX_MEMORY_LIMIT:
                 sorted_memories = sorted(
                     memories[0],
@@ -159,6 +290,7 @@ class Qdrant:
                         vectors=embedding,
                         payloads=data,),)
             logger.info("collection updated")
+            memory_cache.invalidate(user_id)
             return memory_id
         except:
             traceback.print_exc()
@@ -172,52 +304,134 @@ class Qdrant:
                 points=[memory_id],
             ),
         )
+        memory_cache.invalidate_memory(memory_id)
         return None
 
-    def _retrieve_memory(self,user_id,embedding=None):
+    def _retrieve_memory(self,user_id,embedding=None,limit=1):
+        """
+        Retrieves the memories of a user.
+        :param embedding: when given, only the `limit` most similar memories are returned as MemoryRecord,
+                          otherwise the contents of the latest memories are returned, from the memory cache
+                          when the user's snapshot is cached.
+        """
         try:
             if embedding:
                 result = self.client.search(
                         collection_name=USER_COLLECTION,
                         query_vector=embedding,
-                        with_payload=True,
+                        with_payload=MEMORY_PAYLOAD_FIELDS,
                         # score threshold of 0.5 will return a similiar memories with similiarity score of more than 0.5
                         score_threshold=0.5,
-                        query_filter= models.Filter(
-                                                must=[
-                                                    models.FieldCondition(
-                                                    key="user_id", match=models.MatchValue(value=user_id),),
-                                                    models.FieldCondition(
-                                                    key="status", match=models.MatchValue(value=USER_MEMORY_NAME),)
-                                                    ],
-                                                ),
-                        limit=1000)
-
-                if result:
-                    response = {}
-                    for i, point in enumerate(result):
-                        response[i] = {
-                            "id": point.id,
-                            "content": point.payload.get('content'),
-                            "date": point.payload.get('created_at_updated_at')
-                            }
-
-                    return [response[0]]
-            else:
-                data = self.client.scroll(
-                    collection_name=USER_COLLECTION,
-                    scroll_filter=models.Filter(
-                        must=[
-                            models.FieldCondition(key="user_id", match=models.MatchValue(value=user_id)),
-                        ]
-                    ),
-                    limit=100,
-                    with_payload=True,
-                    with_vectors=False,
-                )
+                        search_params=self.search_params(USER_COLLECTION),
+                        query_filter=memory_filter(user_id),
+                        limit=limit)
 
-                data = [record.payload['content'] for record in data[0][::-1]]
-                return data
+                return memory_records(result)
+            else:
+                # read before the vector store, a snapshot read before a concurrent write is not cached
+                generation = memory_cache.generation(user_id)
+                memories = memory_cache.get(user_id, generation)
+                if memories is None:
+                    data = self.client.scroll(
+                        collection_name=USER_COLLECTION,
+                        scroll_filter=user_filter(user_id),
+                        limit=100,
+                        with_payload=["content"],
+                        with_vectors=False,
+                    )
+                    memories = [(record.id, record.payload['content']) for record in data[0][::-1]]
+                    memory_cache.put(user_id, memories, generation)
+                return [content for _, content in memories]
         except:
             traceback.print_exc()
             return None
+
+    def _retrieve_memories(self, user_id, embeddings, limit=1):
+        """
+        Similar memories of a user for several embeddings in a single search_batch request.
+        :return: A list of MemoryRecord lists, one per embedding in the same order.
+        """
+        if not embeddings:
+            return []
+        try:
+            results = self.client.search_batch(
+                collection_name=USER_COLLECTION,
+                requests=memory_search_requests(user_id, embeddings, self.search_params(USER_COLLECTION), limit))
+            return [memory_records(result) for result in results]
+        except:
+            traceback.print_exc()
+            return [[] for _ in embeddings]
+
+    def _ensure_memory_indexes(self):
+        """Payload indexes of the filters of the compaction job, creating an existing index is a no-op."""
+        self.client.create_payload_index(USER_COLLECTION, "updated_at", field_schema=models.PayloadSchemaType.FLOAT, wait=True)
+        self.client.create_payload_index(USER_COLLECTION, "user_id", field_schema=models.PayloadSchemaType.KEYWORD, wait=True)
+
+    def _memory_users_since(self, since=None):
+        """
+        Users with a memory written after `since` (epoch seconds), every user with memories when None.
+        Only the memories written since are read, with a range filter on the updated_at index;
+        the memories written by the compaction job itself are left out.
+        """
+        users = set()
+        offset = None
+        scroll_filter = None
+        try:
+            if since is not None:
+                self._ensure_memory_indexes()
+                scroll_filter = models.Filter(
+                    must=[models.FieldCondition(key="updated_at", range=models.Range(gt=since))],
+                    must_not=[models.FieldCondition(key="compacted", match=models.MatchValue(value=True))])
+            while True:
+                points, offset = self.client.scroll(
+                    collection_name=USER_COLLECTION,
+                    scroll_filter=scroll_filter,
+                    with_payload=["user_id"],
+                    limit=1000,
+                    offset=offset)
+                users.update(point.payload.get("user_id") for point in points)
+                if offset is None:
+                    return users
+        except:
+            traceback.print_exc()
+            return users
+
+    def _retrieve_memory_vectors(self, user_id):
+        """All the memories of a user with their vectors, as (MemoryRecord, vector) pairs."""
+        memories = []
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=USER_COLLECTION,
+                scroll_filter=memory_filter(user_id),
+                with_payload=MEMORY_PAYLOAD_FIELDS,
+                with_vectors=True,
+                limit=1000,
+                offset=offset)
+            memories.extend(
+                (MemoryRecord(point.id, point.payload.get('content'), point.payload.get('created_at_updated_at')), point.vector)
+                for point in points
+            )
+            if offset is None:
+                return memories
+
+    def _replace_memories(self, user_id, memory_ids, data, embeddings):
+        """
+        Replaces memories of a user with new ones in one batch request, the new memories
+        are written before the old ones are deleted so nothing is lost if the request fails midway.
+        :return: The ids of the new memories.
+        """
+        new_ids = [str(uuid.uuid4()) for _ in data]
+        points = [
+            models.PointStruct(id=memory_id, vector=embedding, payload=memory_payload(user_id, content, compacted=True)[0])
+            for memory_id, content, embedding in zip(new_ids, data, embeddings)
+        ]
+        self.client.batch_update_points(
+            collection_name=USER_COLLECTION,
+            update_operations=[
+                models.UpsertOperation(upsert=models.PointsList(points=points)),
+                models.DeleteOperation(delete=models.PointIdsList(points=list(memory_ids))),
+            ],
+            wait=True)
+        memory_cache.invalidate(user_id)
+        return new_ids
@@ -0,0 +1,138 @@
+import os
+import asyncio
+import functools
+import random
+import logging
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MAX_MEMORY_LIMIT = 10
+MAX_PDF_LIMIT = 2
+USER_COLLECTION = os.getenv("USER_COLLECTION","USER_COLLECTIONS")
+USER_MEMORY_NAME = "user memories"
+VECTOR_SIZE = 1536
+
+# "qdrant" uses the Qdrant service, "local" keeps the vectors in memory-mapped files inside the process
+VECTOR_STORE = os.getenv("VECTOR_STORE", "qdrant")
+# maximum number of vector store calls in flight at once for one async client
+QDRANT_MAX_CONCURRENCY = int(os.getenv("QDRANT_MAX_CONCURRENCY", 8))
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# payload fields fetched for each kind of search, everything else stays on the server
+SITE_PAYLOAD_FIELDS = ["content", "authors"]
+PDF_PAYLOAD_FIELDS = ["content"]
+MEMORY_PAYLOAD_FIELDS = ["content", "created_at_updated_at"]
+
+
+class SearchHit:
+    """A document search result carrying only the projected payload fields."""
+    __slots__ = ("id", "score", "content", "authors")
+
+    def __init__(self, id, score, content, authors=None):
+        self.id = id
+        self.score = score
+        self.content = content
+        self.authors = authors
+
+    def __repr__(self):
+        fields = {name: getattr(self, name) for name in self.__slots__ if getattr(self, name) is not None}
+        return repr(fields)
+
+
+class MemoryRecord:
+    """A user memory returned by a similarity search."""
+    __slots__ = ("id", "content", "date")
+
+    def __init__(self, id, content, date=None):
+        self.id = id
+        self.content = content
+        self.date = date
+
+    def __repr__(self):
+        return repr({"id": self.id, "content": self.content, "date": self.date})
+
+
+def build_payloads(df, user_id=None):
+    """Payloads of the rows of df, every column except the embeddings."""
+    excluded_columns = {"dense"}
+    payload_columns = [col for col in df.columns if col not in excluded_columns]
+    payloads_list = [
+        {col: getattr(item, col) for col in payload_columns}
+        for item in df.itertuples(index=False)
+    ]
+
+    if user_id:
+        filename = df["filename"].to_list()[0]
+        for payload in payloads_list:
+            payload["user_id"] = user_id
+            payload["id"] = f"{user_id}_{filename}"
+
+    if 'id' not in df.columns:
+        df['id'] = [random.randint(100000, 999999) for _ in range(len(df))]
+    return payloads_list
+
+
+def to_json_value(value):
+    """json.dump default for payload values, numpy scalars come from pandas rows."""
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
+def get_vector_store(backend=None):
+    """
+    Returns the vector store selected by the VECTOR_STORE environment variable.
+    :param backend: overrides the configured backend ("qdrant" or "local").
+    """
+    backend = backend or VECTOR_STORE
+    if backend == "qdrant":
+        from app.storage.qdrant import Qdrant
+        return Qdrant()
+    if backend == "local":
+        from app.storage.local_store import LocalVectorStore
+        return LocalVectorStore()
+    raise ValueError(f"Invalid vector store backend: {backend}")
+
+
+class AsyncVectorStore:
+    """
+    Async view of a synchronous vector store. Calls run in worker threads,
+    at most `max_concurrency` at a time.
+    """
+
+    def __init__(self, store, max_concurrency=QDRANT_MAX_CONCURRENCY):
+        self.store = store
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        pass
+
+    def __getattr__(self, name):
+        method = getattr(self.store, name)
+
+        @functools.wraps(method)
+        async def call(*args, **kwargs):
+            async with self.semaphore:
+                return await asyncio.to_thread(method, *args, **kwargs)
+        return call
+
+
+def get_async_vector_store(backend=None):
+    """
+    Returns an async client for the configured vector store, to be used for a single request:
+    `async with get_async_vector_store() as client: ...`.
+    """
+    backend = backend or VECTOR_STORE
+    if backend == "qdrant":
+        from app.storage.async_qdrant import AsyncQdrant
+        return AsyncQdrant()
+    return AsyncVectorStore(get_vector_store(backend))
@@ -6,14 +6,29 @@ import json
 import tiktoken
 import logging
 import os
-import requests
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 from dotenv import load_dotenv
+from app.lib.annotation_client import annotation_client
+from app.lib.cache import SQLiteCache
+from app.annotation_graph.question_cache import normalize_question
+from app.graph_sampler import sample_graph
 from app.prompts.summarizer_prompts import SUMMARY_PROMPT, SUMMARY_PROMPT_BASED_ON_USER_QUERY,SUMMARY_PROMPT_CHUNKING,SUMMARY_PROMPT_CHUNKING_USER_QUERY
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 load_dotenv()
+
+# "on" serves repeated explanations of an annotation (and questions about it) from the shared cache
+ANSWER_CACHE = os.getenv("ANSWER_CACHE", "on")
+# seconds an annotation answer is served from the cache
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", 3600))
+# description batches of a graph summarized in parallel (map step), 1 summarizes them one by one
+SUMMARY_MAX_WORKERS = int(os.getenv("SUMMARY_MAX_WORKERS", 4))
+# partial summaries merged by one LLM call of the reduce step, the rounds grow as log(batches) in this base
+SUMMARY_REDUCE_FANIN = max(2, int(os.getenv("SUMMARY_REDUCE_FANIN", 4)))
+
 class Graph_Summarizer: 
     '''
     Handles graph-related operations like processing nodes, edges, generating responses ...
@@ -26,8 +41,15 @@ class Graph_Summarizer:
             self.max_token=2000
         elif self.llm.__class__.__name__ == 'OpenAIModel':
             self.max_token=100000     
-        self.tokenizer = tiktoken.get_encoding("cl100k_base")
         self.kg_service_url = os.getenv('ANNOTATION_SERVICE_URL')
+        self.annotation_client = annotation_client
+        # answers of the annotation service keyed by graph id, user and normalized question, shared by the workers
+        self.answer_cache = SQLiteCache("annotation_answers", ttl=ANSWER_CACHE_TTL) if ANSWER_CACHE == "on" else None
+
+    @cached_property
+    def tokenizer(self):
+        # loading the encoding reads (or downloads) its BPE ranks, it is done on first use, not at startup
+        return tiktoken.get_encoding("cl100k_base")
 
     def clean_and_format_response(self,desc):
         desc = desc.strip()
@@ -44,14 +66,6 @@ class Graph_Summarizer:
         return formatted_desc
 
 
-    def group_edges_by_source(self,edges):
-        """Group edges by source_node."""
-        grouped_edges = defaultdict(list)
-        for edge in edges:
-            source_node_id = edge["source"].split(' ')[-1]  # Extract ID
-            grouped_edges[source_node_id].append(edge)
-        return grouped_edges
-
     def generate_node_description(self,node):
         """Generate a description for a node with available attributes."""
         desc_parts = []
@@ -74,37 +88,6 @@ class Graph_Summarizer:
             desc_parts.append(f"{key.capitalize()}: {value}")
         return " | ".join(desc_parts)
 
-    def generate_grouped_descriptions(self,edges, nodes,batch_size=50):
-        grouped_edges = self.group_edges_by_source(edges)
-        descriptions = []
-
-        # Process each source node and its related target nodes
-        for source_node_id, related_edges in grouped_edges.items():
-            source_node = nodes.get(source_node_id, {})
-            source_desc = self.generate_node_description(source_node)
-
-            # Collect descriptions for all target nodes linked to this source node
-            target_descriptions = []
-            for edge in related_edges:
-                target_node_id = edge["target"].split(' ')[-1]
-                target_node = nodes.get(target_node_id, {})
-                target_desc = self.generate_node_description(target_node)
-
-                # Add the relationship and target node description
-                label = edge["label"]
-                target_descriptions.append(f"{label} -> Target Node ({edge['target']}): {target_desc}")
-
-            # Combine the source node description with all target node descriptions
-            source_and_targets = (f"Source Node ({source_node_id}): {source_desc}\n" +
-                                "\n".join(target_descriptions))
-            descriptions.append(source_and_targets)
-
-            # If batch processing is required, we can break or yield after each batch
-            # if len(descriptions) >= batch_size:
-            #   break   Process the next batch in another iteration
-
-        return descriptions
-
     def nodes_description(self,nodes):
         nodes_descriptions = []
         for source_node_id in nodes:
@@ -113,78 +96,117 @@ class Graph_Summarizer:
             nodes_descriptions.append(source_desc)
         return nodes_descriptions
     
-    def num_tokens_from_string(self, encoding_name: str):
-        """Calculates the number of tokens in each description and groups them into batches under a token limit."""
-        encoding = tiktoken.get_encoding(encoding_name)
-        accumulated_tokens = 0
-        grouped_batched_descriptions = []
-        self.current_batch = []  
-        for i, desc in enumerate(self.description):          
-            desc_tokens = len(encoding.encode(desc))
-            if accumulated_tokens + desc_tokens <= self.max_token:
-                self.current_batch.append(desc)
-                accumulated_tokens += desc_tokens
-            else:
-                grouped_batched_descriptions.append(self.current_batch)
-                self.current_batch = [desc]
-                accumulated_tokens = desc_tokens  
-        if self.current_batch:
-            grouped_batched_descriptions.append(self.current_batch)         
-        return grouped_batched_descriptions
+    def iter_descriptions(self, graph, limited_nodes=100, described=None):
+        """
+        Descriptions of the first limited_nodes nodes of a graph and of the edges between them,
+        yielded one source node at a time: "Source Node (id): ..." followed by one
+        "label -> Target Node (id): ..." line per edge, then one "Source Node (id): ..." line
+        per node without an edge to another kept node.
+
+        One pass over the nodes builds the id index of the kept nodes, one pass over the edges
+        groups the kept edges by source, so memory depends on the kept nodes and edges only,
+        not on the size of the graph.
+
+        :param described: set the ids of the described nodes are added to.
+        """
+        nodes = {}
+        for node in graph.get('nodes') or []:
+            if len(nodes) >= limited_nodes:
+                break
+            nodes[node['data']['id']] = node['data']
+
+        # source id -> [(label, target id)], in the order the sources first appear in the edges
+        grouped_edges = {}
+        for edge in graph.get('edges') or []:
+            data = edge['data']
+            if data['source'] in nodes and data['target'] in nodes:
+                grouped_edges.setdefault(data['source'], []).append((data['label'], data['target']))
+
+        node_descriptions = {}
+        def describe(node_id):
+            if node_id not in node_descriptions:
+                node_descriptions[node_id] = self.generate_node_description(nodes[node_id])
+                if described is not None:
+                    described.add(node_id)
+            return node_descriptions[node_id]
 
-
-    
-    def graph_description(self,graph, limited_nodes = 100):
+        for source_node_id, related_edges in grouped_edges.items():
+            target_descriptions = (f"{label} -> Target Node ({target_node_id}): {describe(target_node_id)}"
+                                   for label, target_node_id in related_edges)
+            yield f"Source Node ({source_node_id}): {describe(source_node_id)}\n" + "\n".join(target_descriptions)
+
+        for node_id in nodes:
+            if node_id not in node_descriptions:
+                yield f"Source Node ({node_id}): {describe(node_id)}"
+
+    def batch_descriptions(self, descriptions):
+        """Groups descriptions, in order, into batches of at most self.max_token tokens (a longer description is a batch on its own)."""
+        batches = []
+        current_batch, accumulated_tokens = [], 0
+        for desc in descriptions:
+            desc_tokens = len(self.tokenizer.encode(desc))
+            if current_batch and accumulated_tokens + desc_tokens > self.max_token:
+                batches.append(current_batch)
+                current_batch, accumulated_tokens = [], 0
+            current_batch.append(desc)
+            accumulated_tokens += desc_tokens
+        if current_batch:
+            batches.append(current_batch)
+        return batches
+
+    def graph_description(self,graph, limited_nodes = 100, described=None):
+        """
+        :param described: set the ids of the described nodes are added to.
+        :return: The token bounded batches of descriptions of a graph, empty when it has no nodes.
+        """
         if not graph:
-            self.descriptions = "no graph is returned"
-            return self.descriptions
-            
-        limited_node_ids = set()
-        if isinstance(graph, dict) and 'nodes' in graph:
-            if len(graph['nodes']):
-                for i in range(min(limited_nodes, len(graph['nodes']))):
-                    limited_node_ids.add(graph['nodes'][i]['data']['id'])
-
-                limited_nodes_data = [node for node in graph['nodes'] if node['data']['id'] in limited_node_ids]
-                limited_edges_data = []
-                for edge in graph['edges']:
-                    if edge['data']['source'] in limited_node_ids and edge['data']['target'] in limited_node_ids:
-                        limited_edges_data.append(edge)
-
-                limited_graph = {
-                    "nodes": limited_nodes_data,
-                    "edges": limited_edges_data
-                }
-                nodes = {node['data']['id']: node['data'] for node in limited_graph['nodes']}
- 
-                if len(limited_graph['edges']) > 0:
-                    edges = [{'source': edge['data']['source'],
-                            'target': edge['data']['target'],
-                            'label': edge['data']['label']} for edge in limited_graph['edges']]
-            
-                self.description = self.generate_grouped_descriptions(edges, nodes, batch_size=10)
-                self.descriptions = self.num_tokens_from_string("cl100k_base")
-            else:
-                self.descriptions = []
-
-            return self.descriptions
-
-
-    def annotate_by_id(self, graph_id, token,query=None):
+            return "no graph is returned"
+        if not isinstance(graph, dict):
+            return []
+        return self.batch_descriptions(self.iter_descriptions(graph, limited_nodes, described))
+
+
+    @staticmethod
+    def _answer_key(graph_id, user_id, query):
+        # "q:" keeps a question made only of stopwords apart from the bare explanation
+        return f"{graph_id}|{user_id}|" + (f"q:{normalize_question(query)}" if query else "")
+
+    def invalidate_annotation(self, graph_id, user_id=None):
+        """
+        Drops the cached answers of an annotation, of one user or of every user.
+        :return: The number of answers removed.
+        """
+        if self.answer_cache is None:
+            return 0
+        prefix = f"{graph_id}|{user_id}|" if user_id is not None else f"{graph_id}|"
+        return self.answer_cache.delete_prefix(prefix)
+
+    def annotate_by_id(self, graph_id, token,query=None, user_id=None):
         logger.info("querying annotation by graph id...")
         
         try:
+            # annotations are private, answers are only shared between requests of the same user
+            cache_key = self._answer_key(graph_id, user_id, query) if self.answer_cache is not None and user_id is not None else None
+            if cache_key is not None:
+                cached = self.answer_cache.get(cache_key)
+                if cached is not None:
+                    logger.info("annotation answer served from the cache")
+                    return cached
+
             params =  {"source": "ai-assistant"}
             if query:
                 logger.debug(f"Sending request to {self.kg_service_url}")
                 json_payload = {"requests": {"question": query}}  
-                response = requests.post(
-                    self.kg_service_url + '/annotation/' + graph_id,
+                response = self.annotation_client.post(
+                    '/annotation/' + graph_id,
+                    endpoint='/annotation/<id>',
                     params=params,  
                     json=json_payload,
                     headers={"Authorization": f"Bearer {token}"}
                 )
                 json_response = response.json()
+                if cache_key is not None and response.ok and json_response.get("answer") is not None:
+                    self.answer_cache.set(cache_key, {"text": json_response["answer"]})
                 response = {
                     "text": json_response.get("answer") if json_response.get("answer") is not None else "Graph is too big, No summaries provided to answer your question"
                 }
@@ -193,8 +215,9 @@ class Graph_Summarizer:
                 return response
             else:
                 logger.debug(f"Sending request to {self.kg_service_url}")
-                response = requests.get(
-                    self.kg_service_url + '/annotation/' + graph_id,
+                response = self.annotation_client.get(
+                    '/annotation/' + graph_id,
+                    endpoint='/annotation/<id>',
                     # params=params, need title to be added form the annotation
                     headers={"Authorization": f"Bearer {token}"}
                 )
@@ -208,6 +231,9 @@ class Graph_Summarizer:
                         "text": json_response.get("answer") if json_response.get("answer") is not None else json_response.get("title")
                         }
                 logger.info(f"response is {response}")
+                # the title is a placeholder while the annotation is computed, only answers are cached
+                if cache_key is not None and json_response.get("answer") is not None:
+                    self.answer_cache.set(cache_key, response)
                 return response
 
         except Exception as e:
@@ -242,39 +268,74 @@ class Graph_Summarizer:
     #         logger.info("error generating graph information from /annotation endpoint")
     #         return []
 
-    def summary(self,graph=None,user_query=None,graph_id=None, token = None):
+    def _parallel(self, function, items):
+        """function applied to the items with at most SUMMARY_MAX_WORKERS threads, results in order."""
+        if SUMMARY_MAX_WORKERS <= 1 or len(items) <= 1:
+            return [function(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(SUMMARY_MAX_WORKERS, len(items))) as executor:
+            return list(executor.map(function, items))
+
+    def _summarize_batch(self, batch, user_query=None):
+        """Map step: summary of one token bounded batch of descriptions."""
+        if user_query:
+            prompt = SUMMARY_PROMPT_BASED_ON_USER_QUERY.format(description=batch, user_query=user_query)
+        else:
+            prompt = SUMMARY_PROMPT.format(description=batch)
+        return self.llm.generate(prompt)
+
+    def _merge_summaries(self, summaries, user_query=None):
+        """Reduce step: one summary of the partial summaries of a group, the first one is given as the previous summary."""
+        if len(summaries) == 1:
+            return summaries[0]
+        description = "\n\n".join(str(summary) for summary in summaries[1:])
+        if user_query:
+            prompt = SUMMARY_PROMPT_CHUNKING_USER_QUERY.format(description=description, user_query=user_query, prev_summery=summaries[0])
+        else:
+            prompt = SUMMARY_PROMPT_CHUNKING.format(description=description, prev_summery=summaries[0])
+        return self.llm.generate(prompt)
+
+    def summarize_batches(self, batches, user_query=None):
+        """
+        Map-reduce summary of the description batches of a graph: the batches are summarized in
+        parallel, then the partial summaries are merged SUMMARY_REDUCE_FANIN at a time, each round
+        in parallel, until one is left. A graph of n batches takes 1 + log(n) rounds of LLM calls
+        instead of n sequential ones.
+        """
+        summaries = self._parallel(lambda batch: self._summarize_batch(batch, user_query), batches)
+        rounds = 1
+        while len(summaries) > 1:
+            groups = [summaries[i:i + SUMMARY_REDUCE_FANIN] for i in range(0, len(summaries), SUMMARY_REDUCE_FANIN)]
+            summaries = self._parallel(lambda group: self._merge_summaries(group, user_query), groups)
+            rounds += 1
+        logger.info(f"Summarized {len(batches)} description batches in {rounds} rounds of LLM calls")
+        return summaries[0]
+
+    def summary(self,graph=None,user_query=None,graph_id=None, token = None, user_id=None):
 
         try:
             # send the query and the annotation id for the annotation endpoint for the answer
             if graph_id:
-                result = self.annotate_by_id(graph_id=graph_id, query=user_query,token= token)
+                result = self.annotate_by_id(graph_id=graph_id, query=user_query,token= token, user_id=user_id)
                 return result
-                
-            if graph:
-                graph = self.graph_description(graph)
-
-            prev_summery=[]
-            for i, batch in enumerate(self.descriptions):  
-                if prev_summery:
-                    if user_query:
-                        prompt = SUMMARY_PROMPT_CHUNKING_USER_QUERY.format(description=batch,user_query=user_query,prev_summery=prev_summery)
-                    else:
-                        prompt = SUMMARY_PROMPT_CHUNKING.format(description=batch,prev_summery=prev_summery)
-                else:
-                    if user_query:
-                        prompt = SUMMARY_PROMPT_BASED_ON_USER_QUERY.format(description=batch,user_query=user_query)
-                        print("prompt", prompt)
-                    else:
-                        prompt = SUMMARY_PROMPT.format(description=batch)
-                        print("prompt", prompt)
-
-                response = self.llm.generate(prompt)
-                prev_summery = [response]  
-                return {"text": prev_summery}
-                # cleaned_desc = self.clean_and_format_response(prev_summery)
-                # return cleaned_desc
+
+            if not graph or not isinstance(graph, dict):
+                return {"text": "No graph information to summarize"}
+
+            # the summarizer is shared by the requests, the batches are kept local to this one
+            sample, coverage = sample_graph(
+                graph,
+                node_tokens=lambda node: len(self.tokenizer.encode(self.generate_node_description(node))),
+                count_tokens=lambda text: len(self.tokenizer.encode(text)),
+                user_query=user_query
+            )
+            described = set()
+            batches = self.graph_description(sample, limited_nodes=len(sample["nodes"]), described=described)
+            # coverage of the nodes that reach the prompts
+            coverage["nodes"] = len(described)
+            coverage["node_fraction"] = round(len(described) / coverage["total_nodes"], 4) if coverage["total_nodes"] else 0.0
+            if not batches:
+                return {"text": "No graph information to summarize"}
+
+            return {"text": [self.summarize_batches(batches, user_query)], "coverage": coverage}
         except:
             traceback.print_exc()
-   
-
-              
\ No newline at end of file
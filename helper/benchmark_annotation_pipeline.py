@@ -0,0 +1,77 @@
+"""
+Compares the annotation query pipelines: the two step extraction + conversion against
+the single structured output call. For each question the annotation JSON is built and
+validated (grounded against Neo4j), the KG service is not called.
+
+usage: python -m helper.benchmark_annotation_pipeline [--questions questions.txt] [--repeat 1]
+"""
+import argparse
+import os
+import time
+import statistics
+from dotenv import load_dotenv
+from app.annotation_graph.schema_handler import SchemaHandler
+from app.annotation_graph.annotated_graph import Graph
+from app.llm_handle.llm_models import get_llm_model
+
+load_dotenv()
+
+MODES = ["two_step", "structured"]
+DEFAULT_QUESTIONS = [
+    "What transcripts does TP53 have?",
+    "Which proteins are translated from the transcripts of BRCA1?",
+    "What genes are coexpressed with IGF1?",
+    "Which pathways is the gene MAPK1 part of?",
+    "What exons are included in the transcript ENST00000269305?",
+    "Which GO terms does the gene FOXO3 belong to?",
+]
+
+
+def run_mode(graph, mode, questions, repeat):
+    latencies = []
+    passed = 0
+    for _ in range(repeat):
+        for question in questions:
+            started = time.perf_counter()
+            try:
+                initial_json = graph.build_annotation_json(question, mode=mode)
+                build_time = time.perf_counter() - started
+                validation = graph._validate_and_update(initial_json)
+                ok = validation["validation_report"]["validation_status"] == "success"
+            except Exception as e:
+                build_time = time.perf_counter() - started
+                print(f"  [{mode}] {question}: {e}")
+                ok = False
+            latencies.append(build_time)
+            passed += ok
+    return latencies, passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare the annotation query pipeline modes")
+    parser.add_argument("--questions", help="file with one question per line")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per question")
+    args = parser.parse_args()
+
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        with open(args.questions) as file:
+            questions = [line.strip() for line in file if line.strip()]
+
+    schema_handler = SchemaHandler(
+        schema_config_path='./config/schema_config.yaml',
+        biocypher_config_path='./config/biocypher_config.yaml',
+        enhanced_schema_path='./config/enhanced_schema.txt'
+    )
+    llm = get_llm_model(model_provider=os.getenv('ADVANCED_LLM_PROVIDER'), model_version=os.getenv('ADVANCED_LLM_VERSION'))
+    graph = Graph(llm, schema_handler)
+
+    print(f"{'mode':<12}{'runs':>6}{'p50 build s':>14}{'p95 build s':>14}{'pass rate':>12}")
+    for mode in MODES:
+        latencies, passed = run_mode(graph, mode, questions, args.repeat)
+        latencies.sort()
+        p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+        print(f"{mode:<12}{len(latencies):>6}{statistics.median(latencies):>14.2f}{p95:>14.2f}{passed / len(latencies):>12.0%}")
+
+    if graph.schema_slicer is not None:
+        print(f"schema slicing: {graph.schema_slicer.stats()}")
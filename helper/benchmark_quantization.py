@@ -0,0 +1,115 @@
+"""
+Reports the estimated vector memory saved by a collection profile against recall@10 on our data.
+
+Qdrant does not report the memory used per collection, so the memory figures are computed
+from the number of points, the vector size and the profile (vectors, quantized vectors and
+HNSW links). They are estimates; the recall and latency are measured.
+
+A shadow copy of the collection is built under the profile. Each sampled point's own
+vector is used as a query. The ground truth is an exact search on the original
+collection and it is compared with a search on the shadow copy.
+
+usage: python -m helper.benchmark_quantization SITE_INFORMATION --profile binary --queries 100
+"""
+import argparse
+import logging
+import random
+import time
+from qdrant_client.http import models
+from app.storage.qdrant import Qdrant, VECTOR_SIZE
+from helper.rebuild_collection import copy_collection
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+TOP_K = 10
+BYTES_PER_DIMENSION = {None: 4, "scalar": 1, "binary": 1 / 8}
+
+
+def vector_memory(points, profile, dimension=VECTOR_SIZE):
+    """Estimated bytes of vector data held in RAM and on disk for a profile."""
+    original = points * dimension * 4
+    hnsw = profile.get("hnsw") or {}
+    links = points * hnsw.get("m", 16) * 2 * 4
+    quantization = profile.get("quantization")
+    quantized = int(points * dimension * BYTES_PER_DIMENSION[quantization]) if quantization else 0
+
+    ram = quantized + (0 if hnsw.get("on_disk") else links)
+    disk = links if hnsw.get("on_disk") else 0
+    if profile.get("on_disk"):
+        disk += original
+    else:
+        ram += original
+    return {"ram": ram, "disk": disk}
+
+
+def wait_for_indexing(client, collection_name, timeout=600):
+    start = time.time()
+    while client.get_collection(collection_name).status != models.CollectionStatus.GREEN:
+        if time.time() - start > timeout:
+            raise TimeoutError(f"{collection_name} is still indexing after {timeout}s")
+        time.sleep(1)
+
+
+def sample_vectors(client, collection_name, size):
+    records, _ = client.scroll(collection_name, limit=10000, with_vectors=True, with_payload=False)
+    return random.sample(records, min(size, len(records)))
+
+
+def benchmark(collection_name, profile_name, queries):
+    qdrant = Qdrant()
+    profile = qdrant.get_profile(collection_name, profile_name)
+    shadow = f"{collection_name}__bench_{profile_name}"
+    points = copy_collection(qdrant, collection_name, shadow, profile_name)
+    wait_for_indexing(qdrant.client, shadow)
+
+    search_params = qdrant.search_params(collection_name, profile_name)
+
+    recalls, latencies = [], []
+    try:
+        for record in sample_vectors(qdrant.client, collection_name, queries):
+            exact = qdrant.client.search(
+                collection_name=collection_name,
+                query_vector=record.vector,
+                search_params=models.SearchParams(exact=True),
+                with_payload=False,
+                limit=TOP_K)
+            start = time.perf_counter()
+            approximate = qdrant.client.search(
+                collection_name=shadow,
+                query_vector=record.vector,
+                search_params=search_params,
+                with_payload=False,
+                limit=TOP_K)
+            latencies.append(time.perf_counter() - start)
+
+            expected = {point.id for point in exact}
+            found = {point.id for point in approximate}
+            if expected:
+                recalls.append(len(expected & found) / len(expected))
+    finally:
+        qdrant.client.delete_collection(shadow)
+
+    baseline = vector_memory(points, qdrant.get_profile(collection_name, "default"))
+    candidate = vector_memory(points, profile)
+    saved = 1 - candidate["ram"] / baseline["ram"] if baseline["ram"] else 0
+
+    print(f"collection        : {collection_name} ({points} points)")
+    print(f"profile           : {profile_name}")
+    print(f"est. RAM default  : {baseline['ram'] / 2**20:.2f} MiB")
+    print(f"est. RAM {profile_name:<8} : {candidate['ram'] / 2**20:.2f} MiB (disk {candidate['disk'] / 2**20:.2f} MiB)")
+    print(f"est. RAM saved    : {saved:.1%} (computed from the profile, not measured)")
+    if recalls:
+        print(f"recall@{TOP_K}         : {sum(recalls) / len(recalls):.4f} over {len(recalls)} queries")
+        print(f"mean latency      : {1000 * sum(latencies) / len(latencies):.2f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Estimated memory saved against recall@10 for a Qdrant collection profile")
+    parser.add_argument("collection", help="collection holding the data to benchmark")
+    parser.add_argument("--profile", required=True, help="profile name from QDRANT_COLLECTION_PROFILES")
+    parser.add_argument("--queries", type=int, default=100, help="number of sampled query vectors")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    benchmark(args.collection, args.profile, args.queries)
@@ -0,0 +1,74 @@
+"""
+Compares the schema path index with the recursive DFS it replaced in DFSHandler on every
+(source, target) pair of node types of the full schema: build time, lookup time and how
+often the DFS path was longer than the shortest one.
+
+usage: python -m helper.benchmark_schema_paths [--k 3] [--max-hops 3] [--repeat 100]
+"""
+import argparse
+import time
+from dotenv import load_dotenv
+from app.annotation_graph.schema_handler import SchemaHandler
+from app.annotation_graph.schema_paths import SchemaPathIndex, SCHEMA_PATH_K, SCHEMA_PATH_MAX_HOPS
+
+load_dotenv()
+
+
+def recursive_dfs(graph, current, target, path=None, relationships=None, visited=None):
+    """The former DFSHandler.extract_relations_between_nodes_dfs, returning the number of relationships."""
+    visited = set() if visited is None else visited
+    path = [] if path is None else path
+    relationships = [] if relationships is None else relationships
+    visited.add(current)
+    path.append(current)
+    if current == target:
+        return len(relationships)
+    for neighbor, rel in graph[current]:
+        if neighbor not in visited:
+            hops = recursive_dfs(graph, neighbor, target, path.copy(), relationships + [rel], visited.copy())
+            if hops is not None:
+                return hops
+    return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the schema path index against the recursive DFS")
+    parser.add_argument("--k", type=int, default=SCHEMA_PATH_K, help="alternative paths kept per pair")
+    parser.add_argument("--max-hops", type=int, default=SCHEMA_PATH_MAX_HOPS, help="longest alternative path")
+    parser.add_argument("--repeat", type=int, default=100, help="lookups of every pair")
+    args = parser.parse_args()
+
+    schema_handler = SchemaHandler(
+        schema_config_path='./config/schema_config.yaml',
+        biocypher_config_path='./config/biocypher_config.yaml',
+        enhanced_schema_path='./config/enhanced_schema.txt'
+    )
+    graph = schema_handler.schema_graph
+    node_types = sorted(set(graph) | {target for relations in list(graph.values()) for target, _ in relations})
+    pairs = [(source, target) for source in node_types for target in node_types if source != target]
+
+    started = time.perf_counter()
+    index = SchemaPathIndex(graph, k=args.k, max_hops=args.max_hops)
+    build_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        for source, target in pairs:
+            index.shortest(source, target)
+    index_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    dfs_hops = {}
+    for _ in range(args.repeat):
+        for source, target in pairs:
+            dfs_hops[(source, target)] = recursive_dfs(graph, source, target)
+    dfs_seconds = time.perf_counter() - started
+
+    lookups = args.repeat * len(pairs)
+    reachable = [pair for pair in pairs if index.shortest(*pair)]
+    longer = sum(dfs_hops[pair] > len(index.shortest(*pair)[1]) for pair in reachable)
+    print(f"{len(node_types)} node types, {len(pairs)} pairs, {len(reachable)} connected")
+    print(f"index build: {build_seconds * 1000:.1f}ms (k={args.k}, max hops={args.max_hops})")
+    print(f"index lookup: {index_seconds / lookups * 1e6:.2f}us per pair")
+    print(f"recursive dfs: {dfs_seconds / lookups * 1e6:.2f}us per pair")
+    print(f"dfs path longer than the shortest: {longer} of {len(reachable)} pairs")
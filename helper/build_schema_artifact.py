@@ -0,0 +1,32 @@
+"""
+Precompiles the schema structures derived by BioCypher (ontology mapping, processed schema,
+parent nodes, adjacency list and schema graph) so the app workers load them at boot instead of
+building them. Run it at image build time or after editing the files in config/; the app also
+rebuilds the artifact itself when the config hash no longer matches.
+
+usage: python -m helper.build_schema_artifact [--output ./schema_artifact.json]
+"""
+import argparse
+import time
+from dotenv import load_dotenv
+from app.annotation_graph.schema_handler import SchemaHandler, SCHEMA_ARTIFACT_PATH
+
+load_dotenv()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the precompiled schema artifact")
+    parser.add_argument("--output", default=SCHEMA_ARTIFACT_PATH, help="artifact path")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    schema_handler = SchemaHandler(
+        schema_config_path='./config/schema_config.yaml',
+        biocypher_config_path='./config/biocypher_config.yaml',
+        enhanced_schema_path='./config/enhanced_schema.txt',
+        artifact_path=None
+    )
+    if not hasattr(schema_handler, "schema_graph"):
+        raise SystemExit("building the schema failed, see the log above")
+    schema_handler.save_artifact(args.output)
+    print(f"schema artifact {schema_handler.schema_hash[:12]} built in {time.perf_counter() - started:.2f}s: {args.output}")
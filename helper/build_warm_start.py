@@ -0,0 +1,27 @@
+"""
+Build step producing the precomputed vectors of sample_data.json, so that the app
+restores them at first boot instead of embedding the sample data again.
+
+The embedding model follows ADVANCED_LLM_PROVIDER, the same model the app uses.
+
+usage: python -m helper.build_warm_start [--data sample_data.json] [--output ./warm_start]
+"""
+import argparse
+import os
+from dotenv import load_dotenv
+from app.llm_handle.llm_models import get_llm_model
+from app.rag.rag import RAG
+from app.rag.warm_start import build_artifact, SAMPLE_DATA_PATH, WARM_START_PATH
+
+load_dotenv()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Precompute the warm start vectors of the sample data")
+    parser.add_argument("--data", default=SAMPLE_DATA_PATH, help="sample data to embed")
+    parser.add_argument("--output", default=WARM_START_PATH, help="directory of the artifact")
+    args = parser.parse_args()
+
+    llm = get_llm_model(model_provider=os.getenv('ADVANCED_LLM_PROVIDER'), model_version=os.getenv('ADVANCED_LLM_VERSION'))
+    count = build_artifact(RAG(client=None, llm=llm), data_path=args.data, path=args.output)
+    print(f"{count} points written to {args.output}")
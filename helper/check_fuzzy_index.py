@@ -0,0 +1,71 @@
+"""
+Checks FuzzyIndex.search against a plain Python Levenshtein similarity computed like
+apoc.text.levenshteinSimilarity on lowercased values, over random values and values whose
+length changes when lowercased ("İstanbul"). Exits with status 1 on a mismatch, so it can
+run in CI after changes to the index.
+
+usage: python -m helper.check_fuzzy_index [--values 2000] [--queries 200] [--seed 0]
+"""
+import argparse
+import random
+import string
+import sys
+from app.annotation_graph.fuzzy_index import FuzzyIndex
+
+# values that are not plain ASCII, some longer or shorter once lowercased
+UNICODE_VALUES = ["İstanbul", "İSTANBUL", "istanbul", "Straße", "STRASSE", "ǅemal", "Ωmega", "ΣΊΣΥΦΟΣ", "café", "naïve"]
+
+
+def levenshtein(first, second):
+    previous = list(range(len(second) + 1))
+    for row, char in enumerate(first, start=1):
+        current = [row]
+        for column, other in enumerate(second, start=1):
+            current.append(min(previous[column] + 1, current[column - 1] + 1, previous[column - 1] + (char != other)))
+        previous = current
+    return previous[-1]
+
+
+def reference_search(values, search_value, top_k=10, threshold=0.3):
+    """:return: The expected (value, similarity) pairs, best first."""
+    query = search_value.lower()
+    scored = []
+    for position, value in enumerate(dict.fromkeys(values)):
+        lowered = value.lower()
+        longest = max(len(lowered), len(query))
+        similarity = 1 - levenshtein(lowered, query) / longest if longest else 1.0
+        if similarity > threshold:
+            scored.append((position, value, similarity))
+    scored.sort(key=lambda match: (-match[2], match[0]))
+    return [(value, round(similarity, 2)) for _, value, similarity in scored[:top_k]]
+
+
+def random_value(generator):
+    alphabet = string.ascii_letters + string.digits + "-_"
+    return "".join(generator.choice(alphabet) for _ in range(generator.randint(1, 12)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check the fuzzy index against a reference Levenshtein similarity")
+    parser.add_argument("--values", type=int, default=2000, help="random values indexed")
+    parser.add_argument("--queries", type=int, default=200, help="random queries checked")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generator = random.Random(args.seed)
+    values = [random_value(generator) for _ in range(args.values)] + UNICODE_VALUES
+    index = FuzzyIndex(values)
+    queries = UNICODE_VALUES + [generator.choice(values) for _ in range(args.queries)] \
+        + [random_value(generator) for _ in range(args.queries)]
+
+    failures = 0
+    for query in queries:
+        # scores equal to the k-th best may be cut in another order, compare the scores and the values above the cut
+        expected, found = reference_search(values, query), index.search(query)
+        if [score for _, score in expected] != [score for _, score in found] or \
+                {value for value, score in expected if score > expected[-1][1]} != \
+                {value for value, score in found if score > found[-1][1]}:
+            print(f"FAIL: {query!r}: expected {expected}, found {found}")
+            failures += 1
+    print(f"{len(queries) - failures}/{len(queries)} queries match over {len(index)} values")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,75 @@
+"""
+Measures the startup import time of a module with `python -X importtime` in a fresh
+interpreter and prints the slowest imports. With --budget-ms or --forbid it exits with
+status 1 when the import is over budget or loads a module that should be deferred, so it
+can run in CI after dependency or import changes.
+
+usage: python -m helper.check_import_time [--module app] [--top 20] [--budget-ms 2000]
+                                          [--forbid autogen pandas] [--output importtime.json]
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+
+def import_times(module):
+    """
+    Imports module in a new interpreter.
+    :return: A list of (module name, self µs, cumulative µs) in import order.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    times = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        if not fields[0].strip().isdigit():
+            continue
+        times.append((fields[2].strip(), int(fields[0]), int(fields[1])))
+    return times
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure the import time of the app")
+    parser.add_argument("--module", default="app", help="module to import")
+    parser.add_argument("--top", type=int, default=20, help="slowest imports printed")
+    parser.add_argument("--budget-ms", type=float, default=None, help="fail above this cumulative import time")
+    parser.add_argument("--forbid", nargs="*", default=[], help="top level packages that must not be imported at startup")
+    parser.add_argument("--output", default=None, help="write the per module times as JSON")
+    args = parser.parse_args()
+
+    times = import_times(args.module)
+    total = next((cumulative for name, _, cumulative in times if name == args.module), 0)
+    loaded = {name for name, _, _ in times}
+
+    print(f"import {args.module}: {total / 1000:.0f}ms, {len(times)} modules")
+    print(f"{'cumulative ms':>14} {'self ms':>8}  module")
+    # top level packages only, their submodules are part of the cumulative time
+    packages = [entry for entry in times if "." not in entry[0]]
+    for name, own, cumulative in sorted(packages, key=lambda entry: -entry[2])[:args.top]:
+        print(f"{cumulative / 1000:>14.1f} {own / 1000:>8.1f}  {name}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "module": args.module,
+                "total_us": total,
+                "modules": [{"name": name, "self_us": own, "cumulative_us": cumulative} for name, own, cumulative in times],
+            }, f, indent=2)
+
+    failed = False
+    for name in args.forbid:
+        if name in loaded:
+            print(f"FAIL: {name} is imported at startup")
+            failed = True
+    if args.budget_ms is not None and total / 1000 > args.budget_ms:
+        print(f"FAIL: import {args.module} took {total / 1000:.0f}ms, budget {args.budget_ms:.0f}ms")
+        failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,31 @@
+"""
+Merges near-duplicate user memories. Each pass only looks at the users with memory writes
+since the previous one, run it from cron or keep it running with --interval.
+
+usage: python -m helper.compact_memories [--full] [--threshold 0.85] [--interval SECONDS]
+"""
+import argparse
+import os
+import time
+from dotenv import load_dotenv
+from app.llm_handle.llm_models import get_llm_model
+from app.memory_compaction import MemoryCompactor, MEMORY_COMPACTION_THRESHOLD
+from app.storage.vector_store import get_vector_store
+
+load_dotenv()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Merge near-duplicate user memories")
+    parser.add_argument("--full", action="store_true", help="compact every user, not only the ones written since the last pass")
+    parser.add_argument("--threshold", type=float, default=MEMORY_COMPACTION_THRESHOLD, help="cosine similarity of memories to merge")
+    parser.add_argument("--interval", type=int, default=0, help="seconds between passes, runs a single pass when 0")
+    args = parser.parse_args()
+
+    llm = get_llm_model(model_provider=os.getenv('ADVANCED_LLM_PROVIDER'), model_version=os.getenv('ADVANCED_LLM_VERSION'))
+    compactor = MemoryCompactor(llm, get_vector_store(), threshold=args.threshold)
+
+    print(compactor.run(full=args.full))
+    while args.interval:
+        time.sleep(args.interval)
+        print(compactor.run())
@@ -0,0 +1,173 @@
+"""
+Rebuilds an existing Qdrant collection under a new collection profile without taking it offline.
+
+The points are copied into a new physical collection named
+<collection>__<profile>_<timestamp>, created with the new profile. The points written to
+the live collection during the copy are then copied again (new, changed and deleted
+points). Finally the collection name is switched to the new collection with a Qdrant alias.
+The app keeps reading and writing through the name, which Qdrant resolves to the
+collection behind the alias.
+
+When the name is already an alias, from a previous rebuild, the switch is one atomic
+alias update. The first rebuild of a collection created under its own name has to delete
+that collection before the alias can take the name, so writes are lost for the duration of
+those two calls: run it when the collection is not written to.
+
+usage: python -m helper.rebuild_collection PDF_COLLECTION --profile scalar_int8 [--keep-old]
+"""
+import argparse
+import hashlib
+import json
+import logging
+import time
+from qdrant_client.http import models
+from app.storage.qdrant import Qdrant
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 256
+
+
+def point_digest(record):
+    """Digest of the vector and payload of a point, to find the points changed since they were copied."""
+    content = json.dumps([record.vector, record.payload], sort_keys=True, default=str)
+    return hashlib.blake2b(content.encode(), digest_size=16).digest()
+
+
+def scroll_points(client, collection_name, batch_size=BATCH_SIZE):
+    """Yields the batches of points (vector and payload) of a collection."""
+    offset = None
+    while True:
+        records, offset = client.scroll(
+            collection_name=collection_name,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True)
+        if records:
+            yield records
+        if offset is None:
+            return
+
+
+def upsert_records(client, collection_name, records):
+    client.upsert(
+        collection_name=collection_name,
+        points=models.Batch(
+            ids=[record.id for record in records],
+            vectors=[record.vector for record in records],
+            payloads=[record.payload for record in records]),
+        wait=True)
+
+
+def copy_points(client, source, target, batch_size=BATCH_SIZE, digests=None):
+    """
+    Copies every point (vector and payload) of source into target.
+    :param digests: dict filled with the point_digest of each copied point, by id.
+    :return: The number of points copied.
+    """
+    copied = 0
+    for records in scroll_points(client, source, batch_size):
+        upsert_records(client, target, records)
+        if digests is not None:
+            digests.update((record.id, point_digest(record)) for record in records)
+        copied += len(records)
+    return copied
+
+
+def copy_collection(qdrant, source, target, profile_name, digests=None):
+    """Creates target with the given profile and fills it with the points of source."""
+    if qdrant.client.collection_exists(target):
+        qdrant.client.delete_collection(target)
+    qdrant.create_collection(target, profile_name)
+    return copy_points(qdrant.client, source, target, digests=digests)
+
+
+def catch_up(client, source, target, digests, batch_size=BATCH_SIZE):
+    """
+    Copies to target the points written to source after they were first copied: points
+    added or changed in source are upserted and points deleted from source are deleted,
+    unless target already holds a newer version of them.
+    :return: The number of points upserted or deleted.
+    """
+    changed, seen = 0, set()
+    for records in scroll_points(client, source, batch_size):
+        seen.update(record.id for record in records)
+        stale = [record for record in records if digests.get(record.id) != point_digest(record)]
+        if not stale:
+            continue
+        current = {record.id: point_digest(record) for record in client.retrieve(
+            target, ids=[record.id for record in stale], with_payload=True, with_vectors=True)}
+        # a point changed in target since the first copy was written there after the switch, it is newer
+        updates = [record for record in stale if current.get(record.id) == digests.get(record.id)]
+        if updates:
+            upsert_records(client, target, updates)
+            changed += len(updates)
+
+    deleted = [point_id for point_id in digests if point_id not in seen]
+    for start in range(0, len(deleted), batch_size):
+        batch = deleted[start:start + batch_size]
+        current = {record.id: point_digest(record) for record in client.retrieve(
+            target, ids=batch, with_payload=True, with_vectors=True)}
+        unchanged = [point_id for point_id in batch if current.get(point_id) == digests[point_id]]
+        if unchanged:
+            client.delete(target, points_selector=models.PointIdsList(points=unchanged), wait=True)
+            changed += len(unchanged)
+    return changed
+
+
+def alias_target(client, alias_name):
+    """:return: The collection behind an alias, None when the name is not an alias."""
+    for alias in client.get_aliases().aliases:
+        if alias.alias_name == alias_name:
+            return alias.collection_name
+    return None
+
+
+def rebuild_collection(collection_name, profile_name, keep_old=False):
+    qdrant = Qdrant()
+    client = qdrant.client
+    if profile_name not in qdrant.profiles:
+        raise ValueError(f"Unknown collection profile: {profile_name}")
+
+    current = alias_target(client, collection_name) or collection_name
+    new_collection = f"{collection_name}__{profile_name}_{int(time.time())}"
+    expected = client.count(collection_name, exact=True).count
+
+    logger.info(f"copying {expected} points of {current} to {new_collection}")
+    digests = {}
+    copied = copy_collection(qdrant, current, new_collection, profile_name, digests=digests)
+    if copied < expected:
+        client.delete_collection(new_collection)
+        raise RuntimeError(f"Copied {copied} of {expected} points, keeping {collection_name} untouched")
+    logger.info(f"{catch_up(client, current, new_collection, digests)} points written during the copy caught up")
+
+    if current != collection_name:
+        client.update_collection_aliases(change_aliases_operations=[
+            models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=collection_name)),
+            models.CreateAliasOperation(create_alias=models.CreateAlias(collection_name=new_collection, alias_name=collection_name)),
+        ])
+        # writes that reached the previous collection before the switch
+        logger.info(f"{catch_up(client, current, new_collection, digests)} points written during the switch caught up")
+        if not keep_old:
+            client.delete_collection(current)
+    else:
+        # a collection and an alias can not share a name, the collection is dropped right before the alias is created
+        client.delete_collection(collection_name)
+        client.update_collection_aliases(change_aliases_operations=[
+            models.CreateAliasOperation(create_alias=models.CreateAlias(collection_name=new_collection, alias_name=collection_name)),
+        ])
+
+    logger.info(f"{collection_name} now points to {new_collection} with profile {profile_name} "
+                f"({client.count(collection_name, exact=True).count} points)")
+    logger.info(f"set QDRANT_COLLECTIONS.{collection_name}: {profile_name} in config/config.yaml to keep it on new deployments")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Rebuild a Qdrant collection under a new collection profile")
+    parser.add_argument("collection", help="name of the collection to rebuild")
+    parser.add_argument("--profile", required=True, help="profile name from QDRANT_COLLECTION_PROFILES")
+    parser.add_argument("--keep-old", action="store_true", help="keep the previous collection behind the alias")
+    args = parser.parse_args()
+    rebuild_collection(args.collection, args.profile, keep_old=args.keep_old)